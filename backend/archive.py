@@ -0,0 +1,186 @@
+"""
+Export and import chat archives as NDJSON
+
+One JSON object per line: a header, then {"table": ..., "row": {...}}
+records in dependency order. Rows are streamed from a server-side cursor
+(yield_per), so memory stays flat however large the database is.
+
+    python -m backend.archive export --user-id 42 -o alice.ndjson   # one user's data
+    python -m backend.archive export -o full.ndjson                 # whole database
+    python -m backend.archive import full.ndjson
+
+A user export holds their profile (without the password hash), contacts,
+groups and every message they can see. A full export keeps ids and
+password hashes and is meant for moving a deployment, e.g. from SQLite
+to Postgres. It is imported into an empty, migrated database with
+batched executemany inserts; derived data (conversation summaries, the
+search index) is rebuilt from the imported rows.
+"""
+import argparse
+import asyncio
+import json
+import sys
+from datetime import datetime, timezone
+from typing import IO, Iterable, Optional
+
+from sqlalchemy import DateTime, insert, or_, select, text
+
+from . import crud, database, models
+
+ARCHIVE_VERSION = 1
+EXPORT_BATCH_SIZE = 1000
+IMPORT_BATCH_SIZE = 1000
+
+# Tables in a full archive, parents before children. Change log, summaries
+# and OTPs are derived or short-lived and are not archived.
+ARCHIVE_TABLES = [
+    models.User.__table__,
+    models.Group.__table__,
+    models.GroupMember.__table__,
+    models.Contact.__table__,
+    models.Message.__table__,
+    models.MessageArchive.__table__,
+    models.MessageReceipt.__table__,
+    models.CallHistory.__table__,
+    models.Blob.__table__,
+]
+USER_PRIVATE_COLUMNS = {"password_hash"}
+
+def _json_default(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f"Cannot serialise {type(value).__name__}")
+
+def archive_header(scope: str, user_id: Optional[int] = None) -> dict:
+    return {
+        "archive": "echat",
+        "version": ARCHIVE_VERSION,
+        "scope": scope,
+        "user_id": user_id,
+        "exported_at": datetime.now(timezone.utc),
+    }
+
+def archive_line(record: dict) -> str:
+    """One NDJSON line: a header or a {"table": ..., "row": ...} record"""
+    return json.dumps(record, default=_json_default) + "\n"
+
+def _user_queries(user_id: int):
+    """(table, select) pairs for everything belonging to or visible to one user"""
+    users = models.User.__table__
+    user_group_ids = select(models.GroupMember.group_id).where(models.GroupMember.user_id == user_id)
+    return [
+        (users, select(*[c for c in users.c if c.name not in USER_PRIVATE_COLUMNS]).where(users.c.id == user_id)),
+        (models.Group.__table__, select(models.Group.__table__).where(models.Group.id.in_(user_group_ids))),
+        (models.GroupMember.__table__, select(models.GroupMember.__table__).where(
+            models.GroupMember.group_id.in_(user_group_ids)
+        )),
+        (models.Contact.__table__, select(models.Contact.__table__).where(models.Contact.owner_id == user_id)),
+        (models.Message.__table__, select(models.Message.__table__).where(crud.message_visible_to(user_id))),
+        (models.CallHistory.__table__, select(models.CallHistory.__table__).where(or_(
+            models.CallHistory.caller_id == user_id, models.CallHistory.receiver_id == user_id
+        ))),
+    ]
+
+async def export_archive(out: IO[str], user_id: Optional[int] = None, batch_size: int = EXPORT_BATCH_SIZE) -> dict:
+    """Write an archive to `out`; returns row counts per table"""
+    if user_id is None:
+        queries = [(table, select(table)) for table in ARCHIVE_TABLES]
+    else:
+        queries = _user_queries(user_id)
+
+    out.write(archive_line(archive_header("all" if user_id is None else "user", user_id)))
+
+    counts = {}
+    async with database.SessionLocal() as db:
+        for table, stmt in queries:
+            stmt = stmt.order_by(*table.primary_key.columns).execution_options(yield_per=batch_size)
+            result = await db.stream(stmt)
+            count = 0
+            async for row in result.mappings():
+                out.write(archive_line({"table": table.name, "row": dict(row)}))
+                count += 1
+            counts[table.name] = count
+    return counts
+
+def _decoder(table):
+    """Turn a JSON row back into column values (ISO strings -> datetimes)"""
+    datetime_columns = [c.name for c in table.columns if isinstance(c.type, DateTime)]
+
+    def decode(row: dict) -> dict:
+        for name in datetime_columns:
+            if row.get(name) is not None:
+                row[name] = datetime.fromisoformat(row[name])
+        return row
+    return decode
+
+async def _reset_sequences(conn):
+    """Move Postgres id sequences past the imported ids"""
+    if conn.dialect.name != "postgresql":
+        return
+    for table in ARCHIVE_TABLES:
+        if "id" in table.c and table.c.id.autoincrement:
+            await conn.execute(text(
+                f"SELECT setval(pg_get_serial_sequence('{table.name}', 'id'), "
+                f"COALESCE((SELECT MAX(id) FROM {table.name}), 0) + 1, false)"
+            ))
+
+async def import_archive(lines: Iterable[str], batch_size: int = IMPORT_BATCH_SIZE) -> dict:
+    """Load a full archive into an empty database; returns row counts per table"""
+    lines = iter(lines)
+    header = json.loads(next(lines))
+    if header.get("archive") != "echat" or header.get("version") != ARCHIVE_VERSION:
+        raise ValueError("Not an E-Chat archive of a supported version")
+    if header.get("scope") != "all":
+        raise ValueError("Only full archives can be imported; user archives don't carry every referenced row")
+
+    tables = {table.name: (table, _decoder(table)) for table in ARCHIVE_TABLES}
+    counts = {}
+    async with database.engine.begin() as conn:
+        current, batch = None, []
+        for line in lines:
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            if record["table"] != current or len(batch) >= batch_size:
+                if batch:
+                    await conn.execute(insert(tables[current][0]), batch)
+                current, batch = record["table"], []
+            batch.append(tables[current][1](record["row"]))
+            counts[current] = counts.get(current, 0) + 1
+        if batch:
+            await conn.execute(insert(tables[current][0]), batch)
+        await _reset_sequences(conn)
+
+    # Derived tables are rebuilt rather than archived
+    async with database.SessionLocal() as db:
+        await crud.rebuild_conversation_summaries(db)
+    return counts
+
+async def main():
+    parser = argparse.ArgumentParser(description="Export or import E-Chat archives (NDJSON)")
+    subcommands = parser.add_subparsers(dest="command", required=True)
+    export_parser = subcommands.add_parser("export", help="Write an archive")
+    export_parser.add_argument("--user-id", type=int, help="Export one user's data instead of the whole database")
+    export_parser.add_argument("-o", "--output", help="Output file (default: stdout)")
+    import_parser = subcommands.add_parser("import", help="Load a full archive into an empty database")
+    import_parser.add_argument("input", help="Archive file")
+    args = parser.parse_args()
+
+    try:
+        if args.command == "export":
+            out = open(args.output, "w", encoding="utf-8") if args.output else sys.stdout
+            try:
+                counts = await export_archive(out, user_id=args.user_id)
+            finally:
+                if args.output:
+                    out.close()
+            print(f"📦 Exported {sum(counts.values())} rows: {counts}", file=sys.stderr)
+        else:
+            with open(args.input, encoding="utf-8") as f:
+                counts = await import_archive(f)
+            print(f"📥 Imported {sum(counts.values())} rows: {counts}", file=sys.stderr)
+    finally:
+        await database.engine.dispose()
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -6,11 +6,13 @@ import bcrypt
 import hashlib
 import logging
 import secrets
+import time
 from email.message import EmailMessage
 import aiosmtplib
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
 from dotenv import load_dotenv
+from .cache import verified_tokens_cache
 
 # Load environment variables
 load_dotenv()
@@ -93,14 +95,30 @@ async def send_otp_email(email: str, otp: str):
         print(f"SMTP Error: {e}")
         return False
 
+def _token_digest(token: str) -> str:
+    return hashlib.sha256(token.encode("utf-8")).hexdigest()
+
 def verify_token(token: str):
+    # Reconnecting clients present the same long-lived token over and over,
+    # so remember tokens that already passed signature verification
+    digest = _token_digest(token)
+    cached = verified_tokens_cache.get(digest)
+    if cached is not None:
+        user, expires_at = cached
+        if expires_at is None or expires_at > time.time():
+            return dict(user)
+        verified_tokens_cache.invalidate(digest)
+        return None
+
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
         email: str = payload.get("sub")
         user_id: int = payload.get("id")
         if email is None or user_id is None:
             return None
-        return {"email": email, "id": user_id}
+        user = {"email": email, "id": user_id}
+        verified_tokens_cache.set(digest, (user, payload.get("exp")))
+        return dict(user)
     except JWTError:
         return None
 
@@ -0,0 +1,142 @@
+"""
+Cross-worker message backplane for Socket.IO
+
+Every worker only knows the sessions connected to it. With a pub/sub
+client manager, emits to a room are published to the other workers too,
+so a message reaches a user no matter which worker their socket landed on.
+
+Select the backend with SOCKETIO_BACKPLANE_URL:
+    (unset)           single worker, no backplane
+    memory://         in-process fake, for tests and local development
+    redis://host:port Redis pub/sub (requires the `redis` package)
+"""
+import asyncio
+import logging
+import os
+from typing import Dict, List, Optional
+
+import socketio
+from socketio.async_pubsub_manager import AsyncPubSubManager
+
+logger = logging.getLogger(__name__)
+
+SOCKETIO_BACKPLANE_URL = os.getenv("SOCKETIO_BACKPLANE_URL", "")
+SOCKETIO_CHANNEL = os.getenv("SOCKETIO_CHANNEL", "echat")
+
+def user_room(user_id: int) -> str:
+    """Socket.IO room holding every session of one user, on any worker"""
+    return f"user_{user_id}"
+
+class UserRoomSyncMixin:
+    """Lets a pub/sub manager act on a user's sessions on every worker.
+
+    Rides on the stock pub/sub messages: an ``enter_room`` carrying a
+    ``user_id`` instead of a ``sid`` makes each worker join its local
+    sessions of that user to the room, and an ``emit`` carrying a
+    ``skip_user_id`` makes each worker leave that user's sessions out.
+    """
+
+    async def enter_user_room(self, user_id: int, room: str, namespace: str = "/"):
+        await _enter_local_user_room(self, user_id, room, namespace)
+        await self._publish({
+            'method': 'enter_room',
+            'user_id': user_id,
+            'room': room,
+            'namespace': namespace,
+            'host_id': self.host_id,
+        })
+
+    async def _handle_enter_room(self, message):
+        if 'user_id' in message:
+            await _enter_local_user_room(
+                self, message['user_id'], message.get('room'), message.get('namespace') or "/"
+            )
+        else:
+            await super()._handle_enter_room(message)
+
+    async def emit_skipping_user(self, event: str, data, room: str, user_id: int, namespace: str = "/"):
+        # JSON payloads only: no binary attachments or callbacks
+        message = {
+            'method': 'emit',
+            'event': event,
+            'data': [data],
+            'binary': False,
+            'namespace': namespace,
+            'room': room,
+            'skip_sid': None,
+            'skip_user_id': user_id,
+            'callback': None,
+            'host_id': self.host_id,
+        }
+        await self._handle_emit(message)
+        await self._publish(message)
+
+    async def _handle_emit(self, message):
+        if message.get('skip_user_id') is not None:
+            namespace = message.get('namespace') or "/"
+            message = {**message, 'skip_sid': _local_user_sids(self, message['skip_user_id'], namespace)}
+        await super()._handle_emit(message)
+
+def _local_user_sids(manager, user_id: int, namespace: str) -> List[str]:
+    return [sid for sid, _eio_sid in manager.get_participants(namespace, user_room(user_id))]
+
+async def _enter_local_user_room(manager, user_id: int, room: str, namespace: str):
+    for sid in _local_user_sids(manager, user_id, namespace):
+        await socketio.AsyncManager.enter_room(manager, sid, namespace, room)
+
+class InProcessManager(UserRoomSyncMixin, AsyncPubSubManager):
+    """Pub/sub client manager backed by in-process queues.
+
+    Managers created with the same channel in one process behave like
+    workers sharing a Redis channel, which makes cross-worker delivery
+    testable without a Redis server.
+    """
+    name = 'memory'
+
+    # channel -> queues of every listening manager
+    _subscribers: Dict[str, List[asyncio.Queue]] = {}
+
+    async def _publish(self, data):
+        # Round-trip through JSON like a real broker would
+        payload = self.json.dumps(data)
+        for queue in self._subscribers.get(self.channel, []):
+            queue.put_nowait(payload)
+
+    async def _listen(self):
+        queue: asyncio.Queue = asyncio.Queue()
+        self._subscribers.setdefault(self.channel, []).append(queue)
+        try:
+            while True:
+                yield await queue.get()
+        finally:
+            self._subscribers[self.channel].remove(queue)
+
+class RedisManager(UserRoomSyncMixin, socketio.AsyncRedisManager):
+    """Redis pub/sub client manager with cross-worker user room joins"""
+
+def create_client_manager(url: str = None) -> Optional[socketio.AsyncManager]:
+    """Build the client manager for SOCKETIO_BACKPLANE_URL, or None for a single worker"""
+    url = SOCKETIO_BACKPLANE_URL if url is None else url
+    if not url:
+        return None
+    if url.startswith("memory://"):
+        logger.info("Using in-process Socket.IO backplane")
+        return InProcessManager(channel=SOCKETIO_CHANNEL)
+    if url.startswith(("redis://", "rediss://", "unix://")):
+        logger.info("Using Redis Socket.IO backplane")
+        return RedisManager(url, channel=SOCKETIO_CHANNEL)
+    raise ValueError(f"Unsupported SOCKETIO_BACKPLANE_URL: {url}")
+
+async def join_user_to_room(sio: socketio.AsyncServer, user_id: int, room: str):
+    """Add every session of a user, on any worker, to a room"""
+    if hasattr(sio.manager, "enter_user_room"):
+        await sio.manager.enter_user_room(user_id, room)
+    else:
+        await _enter_local_user_room(sio.manager, user_id, room, "/")
+
+async def emit_skipping_user(sio: socketio.AsyncServer, event: str, data, room: str, user_id: int):
+    """Emit to a room, leaving out every session of one user on any worker"""
+    if hasattr(sio.manager, "emit_skipping_user"):
+        await sio.manager.emit_skipping_user(event, data, room, user_id)
+    else:
+        await sio.emit(event, data, room=room, skip_sid=_local_user_sids(sio.manager, user_id, "/"))
@@ -0,0 +1,96 @@
+"""
+Message insert throughput benchmark
+
+Compares the old engine setup (echo=True, default SQLite journal) with the
+engine from database.build_engine (echo off, WAL, synchronous=NORMAL), and
+the write-behind batch path on top of it.
+
+Usage:
+    python -m backend.bench_message_insert [--messages 2000] [--senders 20]
+"""
+import argparse
+import asyncio
+import contextlib
+import os
+import sys
+import tempfile
+import time
+
+# Add parent directory to path
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy.orm import sessionmaker
+
+from backend import crud
+from backend.database import Base, build_engine
+from backend.write_behind import MessageWriteBuffer
+
+async def _prepare(engine):
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    session_factory = sessionmaker(bind=engine, class_=AsyncSession, expire_on_commit=False, autoflush=False)
+    async with session_factory() as db:
+        alice = await crud.create_user(db, "alice@bench.local", "x")
+        bob = await crud.create_user(db, "bob@bench.local", "x")
+    return session_factory, alice.id, bob.id
+
+async def bench_per_message(engine, messages: int, senders: int) -> float:
+    """Concurrent senders, one transaction per message (the default send path)"""
+    session_factory, alice_id, bob_id = await _prepare(engine)
+
+    async def sender(count: int):
+        for i in range(count):
+            async with session_factory() as db:
+                await crud.create_message(db, sender_id=alice_id, receiver_id=bob_id, content=f"message {i}")
+
+    start = time.perf_counter()
+    await asyncio.gather(*[sender(messages // senders) for _ in range(senders)])
+    return time.perf_counter() - start
+
+async def bench_write_behind(engine, messages: int, senders: int) -> float:
+    """Concurrent senders sharing a write-behind buffer"""
+    session_factory, alice_id, bob_id = await _prepare(engine)
+    buffer = MessageWriteBuffer(session_factory=session_factory)
+
+    async def sender(count: int):
+        for i in range(count):
+            await buffer.submit(sender_id=alice_id, receiver_id=bob_id, content=f"message {i}")
+
+    start = time.perf_counter()
+    await asyncio.gather(*[sender(messages // senders) for _ in range(senders)])
+    elapsed = time.perf_counter() - start
+    await buffer.close()
+    return elapsed
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--messages", type=int, default=2000)
+    parser.add_argument("--senders", type=int, default=20)
+    args = parser.parse_args()
+    total = args.messages - args.messages % args.senders
+
+    with tempfile.TemporaryDirectory() as tmp:
+        runs = []
+
+        # Old setup: SQL echo on (sent to /dev/null so only formatting is measured)
+        url = f"sqlite+aiosqlite:///{tmp}/before.db"
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            engine = create_async_engine(url, echo=True)
+            runs.append(("before: echo, default journal", await bench_per_message(engine, total, args.senders)))
+            await engine.dispose()
+
+        engine = build_engine(f"sqlite+aiosqlite:///{tmp}/after.db")
+        runs.append(("after: no echo, WAL + NORMAL", await bench_per_message(engine, total, args.senders)))
+        await engine.dispose()
+
+        engine = build_engine(f"sqlite+aiosqlite:///{tmp}/write_behind.db")
+        runs.append(("after + write-behind batching", await bench_write_behind(engine, total, args.senders)))
+        await engine.dispose()
+
+    print(f"{total} messages, {args.senders} concurrent senders")
+    for label, elapsed in runs:
+        print(f"  {label:<32} {elapsed:7.2f}s  {total / elapsed:9.0f} msg/s")
+
+if __name__ == "__main__":
+    asyncio.run(main())
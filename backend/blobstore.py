@@ -0,0 +1,166 @@
+"""
+Content-addressed storage for uploaded files
+
+Each distinct file is stored once, under its SHA-256 digest, and shared by
+every upload of the same bytes (a forwarded meme is written to disk once,
+not once per chat). The blobs table counts the messages, archived messages
+and profile photos pointing at each digest; the garbage collector removes
+blobs nobody points at, together with their resized variants:
+
+    python -m backend.blobstore gc
+"""
+import argparse
+import asyncio
+import hashlib
+import logging
+import os
+import time
+from pathlib import Path
+from typing import Optional
+
+import aiofiles
+import aiofiles.os
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from . import crud, database, media
+
+logger = logging.getLogger(__name__)
+
+UPLOAD_ROOT = Path("backend/uploads")
+BLOB_DIR = UPLOAD_ROOT / "blobs"
+# Unreferenced blobs and files younger than this are kept; they may belong to
+# an upload whose message hasn't been sent yet
+ORPHAN_GRACE_SECONDS = 3600
+
+_touch = aiofiles.os.wrap(os.utime)
+
+def new_hasher():
+    return hashlib.sha256()
+
+def blob_path(digest: str, extension: str) -> str:
+    """Path of a blob relative to the uploads directory"""
+    return f"blobs/{digest[:2]}/{digest}{extension}"
+
+def blob_url(path: str) -> str:
+    return f"/uploads/{path}"
+
+async def hash_file(path: Path) -> str:
+    """SHA-256 of a file already on disk, read in chunks"""
+    hasher = new_hasher()
+    async with aiofiles.open(path, "rb") as f:
+        while True:
+            chunk = await f.read(1024 * 1024)
+            if not chunk:
+                break
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+async def store(
+    db: AsyncSession,
+    temp_path: Path,
+    digest: str,
+    size: int,
+    extension: str,
+    content_type: Optional[str] = None
+) -> str:
+    """Adopt a fully written temp file as a blob and return its URL.
+
+    If the content already exists, the temp file is discarded. Either way
+    the blob file is fresh, so the garbage collector's grace period covers
+    the time until a message or profile takes a reference.
+    """
+    existing = await crud.get_blob(db, digest)
+    if existing:
+        await aiofiles.os.remove(temp_path)
+        await _touch_quietly(UPLOAD_ROOT / existing.path)
+        return blob_url(existing.path)
+
+    path = blob_path(digest, extension)
+    target = UPLOAD_ROOT / path
+    await aiofiles.os.makedirs(target.parent, exist_ok=True)
+    await aiofiles.os.replace(temp_path, target)
+    try:
+        await crud.create_blob(db, digest, path, size, content_type)
+    except IntegrityError:
+        # Same content stored concurrently by another request; share its row
+        await db.rollback()
+        existing = await crud.get_blob(db, digest)
+        if existing.path != path:
+            await aiofiles.os.remove(target)
+            await _touch_quietly(UPLOAD_ROOT / existing.path)
+        return blob_url(existing.path)
+    return blob_url(path)
+
+async def retain(db: AsyncSession, url: Optional[str]):
+    """Add one reference to the blob behind a URL (no-op for non-blob URLs)"""
+    await crud.change_blob_refs_for_urls(db, [url], 1)
+    await db.commit()
+
+async def release(db: AsyncSession, url: Optional[str]):
+    """Drop one reference to the blob behind a URL (no-op for non-blob URLs)"""
+    await crud.change_blob_refs_for_urls(db, [url], -1)
+    await db.commit()
+
+async def _touch_quietly(path: Path):
+    try:
+        await _touch(path)
+    except FileNotFoundError:
+        pass
+
+async def _remove_quietly(path: Path):
+    try:
+        await aiofiles.os.remove(path)
+    except FileNotFoundError:
+        pass
+
+def _older_than(path: Path, cutoff: float) -> bool:
+    try:
+        return path.stat().st_mtime < cutoff
+    except FileNotFoundError:
+        return True
+
+async def collect_garbage(db: AsyncSession, grace_seconds: int = ORPHAN_GRACE_SECONDS) -> dict:
+    """Delete unreferenced blobs, their variants, and blob files that have no row"""
+    cutoff = time.time() - grace_seconds
+    removed_blobs = 0
+    after = None
+    while True:
+        blobs = await crud.get_unreferenced_blobs(db, after=after)
+        if not blobs:
+            break
+        after = blobs[-1].digest
+        for blob in blobs:
+            if not _older_than(UPLOAD_ROOT / blob.path, cutoff):
+                continue
+            # Re-checks ref_count in the DELETE, so a blob re-referenced meanwhile is kept
+            if await crud.delete_blob(db, blob.digest):
+                await _remove_quietly(UPLOAD_ROOT / blob.path)
+                await media.remove_variants(blob.path)
+                removed_blobs += 1
+
+    # Files left behind by uploads that crashed between writing and recording the blob
+    removed_orphans = 0
+    if BLOB_DIR.exists():
+        for file_path in BLOB_DIR.glob("*/*"):
+            digest = file_path.stem
+            if _older_than(file_path, cutoff) and not await crud.get_blob(db, digest):
+                await _remove_quietly(file_path)
+                await media.remove_variants(file_path.relative_to(UPLOAD_ROOT).as_posix())
+                removed_orphans += 1
+
+    return {"blobs": removed_blobs, "orphans": removed_orphans}
+
+async def main():
+    parser = argparse.ArgumentParser(description="Manage content-addressed uploads")
+    parser.add_argument("command", choices=["gc"])
+    args = parser.parse_args()
+
+    if args.command == "gc":
+        async with database.SessionLocal() as db:
+            removed = await collect_garbage(db)
+        print(f"🧹 Removed {removed['blobs']} unreferenced blobs and {removed['orphans']} orphan files")
+    await database.engine.dispose()
+
+if __name__ == "__main__":
+    asyncio.run(main())
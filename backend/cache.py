@@ -0,0 +1,105 @@
+"""
+In-process caches for hot read paths
+
+Each worker has its own copy. Caches of data another worker can change
+take a ttl, so a worker that didn't make the change catches up within
+ttl seconds.
+"""
+import os
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Optional
+
+class LRUCache:
+    """Bounded mapping that evicts the least recently used key when full.
+
+    With a ttl, entries also expire that many seconds after they were set.
+    """
+
+    def __init__(self, maxsize: int = 1024, ttl: Optional[float] = None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        # key -> (value, expires_at or None)
+        self._data: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _live(self, key: Hashable):
+        entry = self._data.get(key)
+        if entry is None:
+            return None
+        if entry[1] is not None and entry[1] <= time.monotonic():
+            del self._data[key]
+            return None
+        return entry
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """Return the cached value and mark it as recently used"""
+        entry = self._live(key)
+        if entry is None:
+            self.misses += 1
+            return default
+        self._data.move_to_end(key)
+        self.hits += 1
+        return entry[0]
+
+    def peek(self, key: Hashable, default: Any = None) -> Any:
+        """Return the cached value without touching recency or counters"""
+        entry = self._live(key)
+        return default if entry is None else entry[0]
+
+    def set(self, key: Hashable, value: Any):
+        """Store a value, evicting the oldest entry if the cache is full"""
+        expires_at = time.monotonic() + self.ttl if self.ttl is not None else None
+        self._data[key] = (value, expires_at)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+    def invalidate(self, key: Hashable):
+        """Drop a key if present"""
+        self._data.pop(key, None)
+
+    def clear(self):
+        self._data.clear()
+
+    def __contains__(self, key: Hashable) -> bool:
+        return self._live(key) is not None
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def stats(self) -> Dict[str, int]:
+        """Counters for monitoring"""
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+# group_id -> tuple of member user ids
+group_members_cache = LRUCache(
+    maxsize=int(os.getenv("GROUP_MEMBERS_CACHE_SIZE", "1024")),
+    ttl=float(os.getenv("GROUP_MEMBERS_CACHE_TTL", "30"))
+)
+
+# user_id -> set of user ids that have this user in their contact list
+contact_watchers_cache = LRUCache(
+    maxsize=int(os.getenv("CONTACT_WATCHERS_CACHE_SIZE", "10000")),
+    ttl=float(os.getenv("CONTACT_WATCHERS_CACHE_TTL", "30"))
+)
+
+# sha256(token) -> (user dict, exp timestamp) for tokens that passed verification
+verified_tokens_cache = LRUCache(maxsize=int(os.getenv("VERIFIED_TOKENS_CACHE_SIZE", "10000")))
+
+def cache_stats() -> Dict[str, Dict[str, int]]:
+    """Stats for every shared cache, keyed by cache name"""
+    return {
+        "group_members": group_members_cache.stats(),
+        "contact_watchers": contact_watchers_cache.stats(),
+        "verified_tokens": verified_tokens_cache.stats(),
+    }
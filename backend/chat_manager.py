@@ -1,17 +1,30 @@
+import asyncio
 import socketio
 import logging
 from typing import Dict, Set
-from . import auth, crud, database
+from . import auth, crud, database, media, schemas, sync
+from .backplane import user_room, join_user_to_room, emit_skipping_user
+from .presence import presence_store, PRESENCE_HEARTBEAT_SECONDS
+from .receipts import receipt_aggregator, MAX_ACK_IDS
+from .typing_indicator import typing_manager
+from .write_behind import message_write_buffer, WRITE_BEHIND_ENABLED
 from sqlalchemy.ext.asyncio import AsyncSession
 
 logger = logging.getLogger(__name__)
 
-# Store active connections: user_id -> set of session IDs
+# Store active connections on this worker: user_id -> set of session IDs
 active_connections: Dict[int, Set[str]] = {}
 
 # Store session to user mapping
 session_to_user: Dict[str, int] = {}
 
+# Socket.IO server, kept so REST routes can update room membership
+sio_server: socketio.AsyncServer = None
+
+def group_room(group_id: int) -> str:
+    """Socket.IO room holding every connected session of a group's members"""
+    return f"group_{group_id}"
+
 async def get_db():
     """Get database session"""
     async with database.SessionLocal() as session:
@@ -19,6 +32,20 @@ async def get_db():
 
 def setup_socketio_events(sio: socketio.AsyncServer):
     """Setup all Socket.IO event handlers"""
+    global sio_server
+    sio_server = sio
+
+    async def send_receipt_counts(sender_id: int, receipts: list):
+        await send_to_user(sio, sender_id, 'message_receipts', {'receipts': receipts})
+    receipt_aggregator.notify = send_receipt_counts
+
+    async def send_typing(event: str, user_id: int, receiver_id: int, group_id: int):
+        payload = {'user_id': user_id, 'receiver_id': receiver_id, 'group_id': group_id}
+        if group_id is not None:
+            await emit_skipping_user(sio, event, payload, group_room(group_id), user_id)
+        else:
+            await send_to_user(sio, receiver_id, event, payload)
+    typing_manager.notify = send_typing
     
     @sio.event
     async def connect(sid, environ, auth_data):
@@ -43,14 +70,29 @@ def setup_socketio_events(sio: socketio.AsyncServer):
                 active_connections[user_id] = set()
             active_connections[user_id].add(sid)
             session_to_user[sid] = user_id
+
+            # Per-user room, so any worker can reach this session through the backplane
+            await sio.enter_room(sid, user_room(user_id))
+
+            # Join group rooms so group messages are a single emit
+            async with database.SessionLocal() as db:
+                group_ids = await crud.get_user_group_ids(db, user_id)
+                sync_cursor = await crud.get_latest_change_id(db)
+            for group_id in group_ids:
+                await sio.enter_room(sid, group_room(group_id))
             
             logger.info(f"User {user_id} connected with session {sid}")
             
-            # Send connection confirmation
-            await sio.emit('connected', {'user_id': user_id}, room=sid)
+            # Send connection confirmation, with the sync cursor for clients that have none yet
+            await sio.emit('connected', {'user_id': user_id, 'sync_cursor': sync_cursor}, room=sid)
+
+            # Reconnecting clients can pass their cursor in the auth data to get the delta right away
+            if auth_data.get('since') is not None:
+                await send_sync_delta(sio, sid, user_id, auth_data['since'])
             
-            # Broadcast online status to contacts
-            await broadcast_user_status(sio, user_id, 'online')
+            # Broadcast online status to contacts when this is the user's first live session
+            if await presence_store.add_session(user_id, sid):
+                await broadcast_user_status(sio, user_id, 'online')
             
             return True
             
@@ -68,11 +110,13 @@ def setup_socketio_events(sio: socketio.AsyncServer):
                 # Remove session
                 if user_id in active_connections:
                     active_connections[user_id].discard(sid)
-                    
-                    # If no more sessions, user is offline
                     if not active_connections[user_id]:
                         del active_connections[user_id]
-                        await broadcast_user_status(sio, user_id, 'offline')
+
+                # If no more sessions on any worker, user is offline
+                if await presence_store.remove_session(user_id, sid):
+                    await typing_manager.stop_all(user_id)
+                    await broadcast_user_status(sio, user_id, 'offline')
                 
                 del session_to_user[sid]
                 logger.info(f"User {user_id} disconnected session {sid}")
@@ -88,61 +132,89 @@ def setup_socketio_events(sio: socketio.AsyncServer):
                 return
             
             user_id = session_to_user[sid]
-            content = data.get('content')
             receiver_id = data.get('receiver_id')
             group_id = data.get('group_id')
+            file_url = data.get('file_url')
+            message_fields = dict(
+                sender_id=user_id,
+                receiver_id=receiver_id,
+                group_id=group_id,
+                content=data.get('content'),
+                file_url=file_url,
+                file_type=data.get('file_type'),
+                file_name=data.get('file_name'),
+                file_size=data.get('file_size'),
+                **media.image_variant_urls(file_url)
+            )
             
             # Save message to database
-            async with database.SessionLocal() as db:
-                message = await crud.create_message(
-                    db,
-                    sender_id=user_id,
-                    receiver_id=receiver_id,
-                    group_id=group_id,
-                    content=content
-                )
-                
-                message_payload = {
-                    'id': message.id,
-                    'content': message.content,
-                    'sender_id': message.sender_id,
-                    'receiver_id': message.receiver_id,
-                    'group_id': message.group_id,
-                    'created_at': message.created_at.isoformat(),
-                    'status': message.status
-                }
-                
-                # Send to receiver(s)
-                if group_id:
-                    # Group message
-                    members = await crud.get_group_members_ids(db, group_id)
-                    for member_id in members:
-                        if member_id != user_id:  # Don't send to sender
-                            await send_to_user(sio, member_id, 'new_message', message_payload)
-                elif receiver_id:
-                    # Direct message
-                    await send_to_user(sio, receiver_id, 'new_message', message_payload)
+            if WRITE_BEHIND_ENABLED:
+                # Batched with other messages; returns once the batch is committed
+                message = await message_write_buffer.submit(**message_fields)
+            else:
+                async with database.SessionLocal() as db:
+                    message = await crud.create_message(db, **message_fields)
                 
-                # Confirm to sender
-                await sio.emit('message_sent', message_payload, room=sid)
+            message_payload = {
+                'id': message.id,
+                'content': message.content,
+                'sender_id': message.sender_id,
+                'receiver_id': message.receiver_id,
+                'group_id': message.group_id,
+                'file_url': message.file_url,
+                'file_type': message.file_type,
+                'file_name': message.file_name,
+                'file_size': message.file_size,
+                'thumbnail_url': message.thumbnail_url,
+                'preview_url': message.preview_url,
+                'created_at': message.created_at.isoformat(),
+                'status': message.status
+            }
+            
+            # Send to receiver(s)
+            if group_id:
+                # Group message: one emit to the group room, skipping the sender's sessions on every worker
+                await emit_skipping_user(sio, 'new_message', message_payload, group_room(group_id), user_id)
+            elif receiver_id:
+                # Direct message
+                await send_to_user(sio, receiver_id, 'new_message', message_payload)
+            
+            # Confirm to sender
+            await sio.emit('message_sent', message_payload, room=sid)
                 
         except Exception as e:
             logger.error(f"Error sending message: {e}", exc_info=True)
     
+    @sio.event
+    async def resume(sid, data):
+        """Replay changes since the client's cursor, one page per 'sync' event"""
+        try:
+            if sid not in session_to_user:
+                return
+            
+            await send_sync_delta(sio, sid, session_to_user[sid], (data or {}).get('since'))
+                
+        except Exception as e:
+            logger.error(f"Error in resume: {e}", exc_info=True)
+    
     @sio.event
     async def typing_start(sid, data):
-        """Handle typing start"""
+        """Handle typing start; debounced and expired by the typing manager"""
         try:
             if sid not in session_to_user:
                 return
             
             user_id = session_to_user[sid]
             receiver_id = data.get('receiver_id')
+            group_id = data.get('group_id')
             
-            if receiver_id:
-                await send_to_user(sio, receiver_id, 'typing_start', {
-                    'user_id': user_id
-                })
+            if group_id:
+                async with database.SessionLocal() as db:
+                    if not await crud.is_group_member(db, group_id, user_id):
+                        return
+                await typing_manager.start(user_id, group_id=group_id)
+            elif receiver_id:
+                await typing_manager.start(user_id, receiver_id=receiver_id)
                 
         except Exception as e:
             logger.error(f"Error in typing_start: {e}")
@@ -156,11 +228,12 @@ def setup_socketio_events(sio: socketio.AsyncServer):
             
             user_id = session_to_user[sid]
             receiver_id = data.get('receiver_id')
+            group_id = data.get('group_id')
             
-            if receiver_id:
-                await send_to_user(sio, receiver_id, 'typing_stop', {
-                    'user_id': user_id
-                })
+            if group_id:
+                await typing_manager.stop(user_id, group_id=group_id)
+            elif receiver_id:
+                await typing_manager.stop(user_id, receiver_id=receiver_id)
                 
         except Exception as e:
             logger.error(f"Error in typing_stop: {e}")
@@ -175,25 +248,77 @@ def setup_socketio_events(sio: socketio.AsyncServer):
             user_id = session_to_user[sid]
             message_id = data.get('message_id')
             
-            # Update message status in database
+            # Update message status in database; the UPDATE returns the sender to notify
             async with database.SessionLocal() as db:
-                await crud.update_message_status(db, message_id, 'read')
+                sender_id = await crud.update_message_status(db, message_id, 'read', actor_id=user_id)
             
             # Notify sender
-            read_payload = {
-                'type': 'message_read',
-                'message_id': message_id,
-                'read_by': user_id
-            }
+            if sender_id is not None:
+                receipt_aggregator.add([message_id])
+                read_payload = {
+                    'type': 'message_read',
+                    'message_id': message_id,
+                    'read_by': user_id
+                }
+                await send_to_user(sio, sender_id, 'message_read', read_payload)
+                    
+        except Exception as e:
+            logger.error(f"Error in message_read: {e}")
+    
+    @sio.event
+    async def messages_ack(sid, data):
+        """Handle a batch of receipts: {message_ids, status: 'delivered' | 'read'}"""
+        try:
+            if sid not in session_to_user:
+                return
+            
+            user_id = session_to_user[sid]
+            message_ids = [int(i) for i in data.get('message_ids', [])[:MAX_ACK_IDS]]
+            read = data.get('status') == 'read'
             
-            # Get message sender and notify them
             async with database.SessionLocal() as db:
-                message = await crud.get_message_by_id(db, message_id)
-                if message:
-                    await send_to_user(sio, message.sender_id, 'message_read', read_payload)
+                changed = await crud.record_receipts(db, user_id, message_ids, read=read)
+            
+            # Senders hear about it once per window, with counts
+            receipt_aggregator.add(changed)
                     
         except Exception as e:
-            logger.error(f"Error in message_read: {e}")
+            logger.error(f"Error in messages_ack: {e}", exc_info=True)
+    
+    @sio.event
+    async def messages_read_upto(sid, data):
+        """Handle reading a whole conversation up to a message: {contact_id | group_id, upto_id}"""
+        try:
+            if sid not in session_to_user:
+                return
+            
+            user_id = session_to_user[sid]
+            contact_id = data.get('contact_id')
+            group_id = data.get('group_id')
+            upto_id = data.get('upto_id')
+            if upto_id is None or (contact_id is None and group_id is None):
+                return
+            
+            async with database.SessionLocal() as db:
+                if group_id is not None and not await crud.is_group_member(db, group_id, user_id):
+                    return
+                read_by_sender = await crud.mark_read_upto(
+                    db, user_id, crud.conversation_key(user_id, contact_id, group_id), upto_id
+                )
+            
+            # One receipt per sender instead of one per message
+            for sender_id, message_ids in read_by_sender.items():
+                receipt_aggregator.add(message_ids)
+                await send_to_user(sio, sender_id, 'messages_read_upto', {
+                    'type': 'messages_read_upto',
+                    'read_by': user_id,
+                    'group_id': group_id,
+                    'upto_id': message_ids[-1],
+                    'message_ids': message_ids
+                })
+                    
+        except Exception as e:
+            logger.error(f"Error in messages_read_upto: {e}", exc_info=True)
     
     @sio.event
     async def profile_updated(sid, data):
@@ -204,18 +329,19 @@ def setup_socketio_events(sio: socketio.AsyncServer):
             
             user_id = session_to_user[sid]
             
-            # Get user's contacts
+            # Get users who have this user as a contact
             async with database.SessionLocal() as db:
-                contacts = await crud.get_contacts(db, user_id)
-                
-                # Broadcast profile update to all contacts
-                for contact in contacts:
-                    await send_to_user(sio, contact.id, 'contact_profile_updated', {
-                        'user_id': user_id,
-                        'display_name': data.get('display_name'),
-                        'about': data.get('about'),
-                        'profile_photo_url': data.get('profile_photo_url')
-                    })
+                watcher_ids = await crud.get_watcher_ids(db, user_id)
+
+            # Broadcast profile update to all of them
+            profile_payload = {
+                'user_id': user_id,
+                'display_name': data.get('display_name'),
+                'about': data.get('about'),
+                'profile_photo_url': data.get('profile_photo_url')
+            }
+            for watcher_id in watcher_ids:
+                await send_to_user(sio, watcher_id, 'contact_profile_updated', profile_payload)
                     
             logger.info(f"Profile updated broadcast for user {user_id}")
             
@@ -223,30 +349,56 @@ def setup_socketio_events(sio: socketio.AsyncServer):
             logger.error(f"Error in profile_updated: {e}")
 
 async def send_to_user(sio: socketio.AsyncServer, user_id: int, event: str, data: dict):
-    """Send event to all sessions of a user"""
-    if user_id in active_connections:
-        for sid in active_connections[user_id]:
-            await sio.emit(event, data, room=sid)
+    """Send event to all sessions of a user, on any worker"""
+    await sio.emit(event, data, room=user_room(user_id))
+
+async def send_sync_delta(sio: socketio.AsyncServer, sid: str, user_id: int, since):
+    """Emit one page of changes after `since`; the client resumes again while has_more"""
+    if since is not None:
+        since = max(int(since), 0)
+    async with database.SessionLocal() as db:
+        delta = await sync.get_delta(db, user_id, since)
+    await sio.emit('sync', schemas.SyncResponse.model_validate(delta).model_dump(mode="json"), room=sid)
+
+async def join_group_room(user_id: int, group_id: int):
+    """Add all connected sessions of a user, on any worker, to a group's room"""
+    if sio_server is None:
+        return
+    await join_user_to_room(sio_server, user_id, group_room(group_id))
 
 async def broadcast_user_status(sio: socketio.AsyncServer, user_id: int, status: str):
     """Broadcast user online/offline status to their contacts"""
     try:
         async with database.SessionLocal() as db:
-            contacts = await crud.get_contacts(db, user_id)
-            
-            status_payload = {
-                'type': 'user_status',
-                'user_id': user_id,
-                'status': status
-            }
+            watcher_ids = await crud.get_watcher_ids(db, user_id)
             
-            # Notify each contact
-            for contact in contacts:
-                await send_to_user(sio, contact.id, 'user_status', status_payload)
+        status_payload = {
+            'type': 'user_status',
+            'user_id': user_id,
+            'status': status
+        }
+        
+        # Notify everyone who has this user in their contact list
+        for watcher_id in watcher_ids:
+            await send_to_user(sio, watcher_id, 'user_status', status_payload)
                 
     except Exception as e:
         logger.error(f"Broadcast status error: {e}", exc_info=True)
 
-def is_user_online(user_id: int) -> bool:
-    """Check if user is online"""
-    return user_id in active_connections
+async def is_user_online(user_id: int) -> bool:
+    """Check if user is online on any worker"""
+    return await presence_store.is_online(user_id)
+
+async def presence_loop(sio: socketio.AsyncServer):
+    """Refresh this worker's sessions and report users whose sessions expired"""
+    while True:
+        await asyncio.sleep(PRESENCE_HEARTBEAT_SECONDS)
+        try:
+            for user_id, sids in list(active_connections.items()):
+                await presence_store.heartbeat(user_id, list(sids))
+
+            for user_id in await presence_store.sweep():
+                logger.info(f"Presence expired for user {user_id}")
+                await broadcast_user_status(sio, user_id, 'offline')
+        except Exception as e:
+            logger.error(f"Presence loop error: {e}", exc_info=True)
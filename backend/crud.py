@@ -1,8 +1,21 @@
 from sqlalchemy.future import select
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import or_, and_, update
+from sqlalchemy.orm import aliased
+from sqlalchemy import or_, and_, update, insert, delete, func, literal, null, true, case, Integer
+from sqlalchemy.dialects import postgresql, sqlite
 from datetime import datetime
+import json
 from . import models, schemas, auth
+from .cache import group_members_cache, contact_watchers_cache
+
+SNIPPET_LENGTH = 100
+# Read receipts recorded per "read up to" (the newest messages of the range)
+READ_RECEIPTS_LIMIT = 500
+
+def _upsert(db: AsyncSession, table):
+    """INSERT supporting ON CONFLICT for the session's database"""
+    dialect = postgresql if db.bind.dialect.name == "postgresql" else sqlite
+    return dialect.insert(table)
 
 async def get_user_by_email(db: AsyncSession, email: str):
     result = await db.execute(select(models.User).where(models.User.email == email))
@@ -12,7 +25,6 @@ async def create_user(db: AsyncSession, email: str, password_hash: str):
     db_user = models.User(email=email, password_hash=password_hash)
     db.add(db_user)
     await db.commit()
-    await db.refresh(db_user)
     return db_user
 
 async def get_contacts(db: AsyncSession, user_id: int):
@@ -52,19 +64,51 @@ async def add_contact(db: AsyncSession, user_id: int, contact_email: str):
     new_contact = models.Contact(owner_id=user_id, contact_user_id=contact_user.id)
     db.add(new_contact)
     await db.commit()
+    _add_watcher(contact_user.id, user_id)
     return contact_user
 
+def _add_watcher(user_id: int, watcher_id: int):
+    """Record that watcher_id now sees user_id, if user_id's watchers are cached"""
+    watchers = contact_watchers_cache.peek(user_id)
+    if watchers is not None:
+        watchers.add(watcher_id)
+
+async def get_watcher_ids(db: AsyncSession, user_id: int):
+    """Get ids of users who have user_id in their contact list.
+
+    This is the reverse of get_contacts: everyone who added the user as a
+    contact plus everyone the user has messaged. These are the users who
+    should receive the user's presence and profile updates.
+    """
+    cached = contact_watchers_cache.get(user_id)
+    if cached is not None:
+        return set(cached)
+
+    result = await db.execute(select(models.Contact.owner_id).where(models.Contact.contact_user_id == user_id))
+    watchers = set(result.scalars().all())
+
+    stmt_msgs = select(models.Message.receiver_id).where(
+        models.Message.sender_id == user_id,
+        models.Message.receiver_id.is_not(None)
+    ).distinct()
+    result_msgs = await db.execute(stmt_msgs)
+    watchers.update(result_msgs.scalars().all())
+
+    contact_watchers_cache.set(user_id, watchers)
+    return set(watchers)
+
 # --- Groups ---
 async def create_group(db: AsyncSession, name: str, admin_id: int):
     db_group = models.Group(name=name, admin_id=admin_id)
     db.add(db_group)
-    await db.commit()
-    await db.refresh(db_group)
+    await db.flush()
     
-    # Auto-add admin as member
+    # Auto-add admin as member, in the same transaction
     member = models.GroupMember(group_id=db_group.id, user_id=admin_id)
     db.add(member)
+    db.add(_membership_change(db_group.id, admin_id, "joined"))
     await db.commit()
+    group_members_cache.set(db_group.id, (admin_id,))
     
     return db_group
 
@@ -81,20 +125,252 @@ async def add_group_member(db: AsyncSession, group_id: int, user_email: str):
     
     member = models.GroupMember(group_id=group_id, user_id=user.id)
     db.add(member)
+    db.add(_membership_change(group_id, user.id, "joined"))
     await db.commit()
+
+    cached = group_members_cache.peek(group_id)
+    if cached is not None:
+        group_members_cache.set(group_id, cached + (user.id,))
     return user
 
+async def get_group(db: AsyncSession, group_id: int):
+    result = await db.execute(select(models.Group).where(models.Group.id == group_id))
+    return result.scalars().first()
+
+async def set_group_retention(db: AsyncSession, group: models.Group, retention_days: int = None):
+    """Set how many days a group keeps messages (None = global policy, 0 = forever)"""
+    group.retention_days = retention_days
+    await db.commit()
+    return group
+
 async def get_user_groups(db: AsyncSession, user_id: int):
     # Join groups on members
     stmt = select(models.Group).join(models.GroupMember, models.Group.id == models.GroupMember.group_id).where(models.GroupMember.user_id == user_id)
     result = await db.execute(stmt)
     return result.scalars().all()
 
+async def get_user_group_ids(db: AsyncSession, user_id: int):
+    """Get ids of all groups a user belongs to"""
+    result = await db.execute(select(models.GroupMember.group_id).where(models.GroupMember.user_id == user_id))
+    return result.scalars().all()
+
 async def get_group_members_ids(db: AsyncSession, group_id: int):
+    """Get member ids of a group, served from the membership cache when possible"""
+    cached = group_members_cache.get(group_id)
+    if cached is not None:
+        return list(cached)
+
     result = await db.execute(select(models.GroupMember.user_id).where(models.GroupMember.group_id == group_id))
-    return result.scalars().all()
+    member_ids = result.scalars().all()
+    group_members_cache.set(group_id, tuple(member_ids))
+    return list(member_ids)
+
+async def is_group_member(db: AsyncSession, group_id: int, user_id: int) -> bool:
+    """Whether user_id belongs to a group.
+
+    A cached member list may predate a join handled by another worker, so
+    a user missing from it is looked up again before being turned away.
+    """
+    cached = group_members_cache.get(group_id)
+    if cached is not None and user_id in cached:
+        return True
+    group_members_cache.invalidate(group_id)
+    return user_id in await get_group_members_ids(db, group_id)
 
 # --- Messages ---
+def conversation_key(user_id: int = None, other_user_id: int = None, group_id: int = None) -> str:
+    """Canonical key for a conversation, identical from both sides of a 1:1 chat"""
+    if group_id is not None:
+        return f"g:{group_id}"
+    if user_id is None or other_user_id is None:
+        return None
+    low, high = sorted((user_id, other_user_id))
+    return f"u:{low}:{high}"
+
+def message_values(
+    sender_id: int,
+    receiver_id: int = None,
+    group_id: int = None,
+    content: str = None,
+    file_url: str = None,
+    file_type: str = None,
+    file_name: str = None,
+    file_size: int = None,
+    thumbnail_url: str = None,
+    preview_url: str = None
+) -> dict:
+    """Column values for a new message row"""
+    return dict(
+        sender_id=sender_id,
+        receiver_id=receiver_id,
+        group_id=group_id,
+        conversation_id=conversation_key(sender_id, receiver_id, group_id),
+        content=content,
+        file_url=file_url,
+        file_type=file_type,
+        file_name=file_name,
+        file_size=file_size,
+        thumbnail_url=thumbnail_url,
+        preview_url=preview_url,
+        status="sent"
+    )
+
+def _message_change(msg) -> dict:
+    """Change log values announcing a new message"""
+    return dict(
+        kind="message",
+        actor_id=msg.sender_id,
+        user_id=msg.receiver_id,
+        group_id=msg.group_id,
+        message_id=msg.id
+    )
+
+def _membership_change(group_id: int, user_id: int, action: str):
+    return models.ChangeLog(
+        kind="membership",
+        user_id=user_id,
+        group_id=group_id,
+        payload=json.dumps({"action": action})
+    )
+
+def message_snippet(msg) -> str:
+    """Preview text of a message for the chat list"""
+    if msg.content:
+        return msg.content[:SNIPPET_LENGTH]
+    if msg.file_name:
+        return f"📎 {msg.file_name}"[:SNIPPET_LENGTH]
+    return None
+
+async def summary_rows(db: AsyncSession, messages) -> dict:
+    """Chat list rows for everyone in the conversations of `messages` (oldest first).
+
+    Keyed on (user_id, conversation_id); unread_count is the number of the
+    messages each user didn't send.
+    """
+    rows = {}
+    for msg in messages:
+        if not msg.conversation_id:
+            continue
+        if msg.group_id is not None:
+            participants = [(member_id, None) for member_id in await get_group_members_ids(db, msg.group_id)]
+        else:
+            participants = [(msg.sender_id, msg.receiver_id), (msg.receiver_id, msg.sender_id)]
+
+        for user_id, peer_id in participants:
+            unread = 0 if user_id == msg.sender_id else 1
+            row = rows.get((user_id, msg.conversation_id))
+            if row is not None:
+                unread += row["unread_count"]
+            rows[(user_id, msg.conversation_id)] = dict(
+                user_id=user_id,
+                conversation_id=msg.conversation_id,
+                peer_user_id=peer_id,
+                group_id=msg.group_id,
+                last_message_id=msg.id,
+                last_sender_id=msg.sender_id,
+                snippet=message_snippet(msg),
+                unread_count=unread,
+                updated_at=msg.created_at
+            )
+    return rows
+
+async def _update_summaries(db: AsyncSession, messages):
+    """Upsert chat list rows for new messages, in the caller's transaction"""
+    rows = await summary_rows(db, messages)
+    if not rows:
+        return
+    summary = models.ConversationSummary
+    stmt = _upsert(db, summary)
+    # A batch committed late must not replace a newer last message
+    newer = stmt.excluded.last_message_id > summary.last_message_id
+    latest = lambda column: case((newer, getattr(stmt.excluded, column)), else_=getattr(summary, column))
+    stmt = stmt.on_conflict_do_update(
+        index_elements=["user_id", "conversation_id"],
+        set_={
+            "last_message_id": latest("last_message_id"),
+            "last_sender_id": latest("last_sender_id"),
+            "snippet": latest("snippet"),
+            "updated_at": latest("updated_at"),
+            "unread_count": summary.unread_count + stmt.excluded.unread_count,
+        }
+    )
+    await db.execute(stmt, list(rows.values()))
+
+async def archive_messages(db: AsyncSession, rows: list):
+    """Copy message rows into messages_archive, in the caller's transaction.
+
+    Rows already archived (by an overlapping retention pass) are skipped.
+    """
+    stmt = _upsert(db, models.MessageArchive).on_conflict_do_nothing(index_elements=["id"])
+    await db.execute(stmt, rows)
+
+async def refresh_summaries(db: AsyncSession, conversation_ids):
+    """Repoint chat list rows at the newest remaining message after messages were deleted.
+
+    Rows of conversations with nothing left are removed. Runs in the
+    caller's transaction, so deleted text never outlives its message.
+    """
+    conversation_ids = set(conversation_ids) - {None, ""}
+    if not conversation_ids:
+        return
+    summary = models.ConversationSummary
+    last_ids = select(func.max(models.Message.id)).where(
+        models.Message.conversation_id.in_(conversation_ids)
+    ).group_by(models.Message.conversation_id)
+    result = await db.execute(select(models.Message).where(models.Message.id.in_(last_ids)))
+    latest = {msg.conversation_id: msg for msg in result.scalars().all()}
+
+    emptied = conversation_ids - latest.keys()
+    if emptied:
+        await db.execute(delete(summary).where(summary.conversation_id.in_(emptied)))
+    for conversation_id, msg in latest.items():
+        # Deleted messages may have been unread; no more can be unread than others sent
+        others_sent = select(func.count(models.Message.id)).where(
+            models.Message.conversation_id == conversation_id,
+            models.Message.sender_id != summary.user_id
+        ).scalar_subquery()
+        await db.execute(update(summary).where(summary.conversation_id == conversation_id).values(
+            last_message_id=msg.id,
+            last_sender_id=msg.sender_id,
+            snippet=message_snippet(msg),
+            updated_at=msg.created_at,
+            unread_count=case((summary.unread_count > others_sent, others_sent), else_=summary.unread_count)
+        ))
+
+async def rebuild_conversation_summaries(db: AsyncSession, batch_size: int = 1000) -> int:
+    """Build the chat list from history when conversation_summaries is empty; returns rows written"""
+    summary = models.ConversationSummary
+    if await db.scalar(select(func.count()).select_from(summary)):
+        return 0
+
+    last_ids = select(func.max(models.Message.id)).where(
+        models.Message.conversation_id != ""
+    ).group_by(models.Message.conversation_id)
+    result = await db.execute(select(models.Message).where(models.Message.id.in_(last_ids)).order_by(models.Message.id))
+    rows = await summary_rows(db, result.scalars().all())
+
+    # 1:1 unread counts from message status; groups have no per-member read state in old data
+    result = await db.execute(
+        select(models.Message.conversation_id, models.Message.receiver_id, func.count(models.Message.id))
+        .where(models.Message.receiver_id.is_not(None), models.Message.status != "read")
+        .group_by(models.Message.conversation_id, models.Message.receiver_id)
+    )
+    unread = {(receiver_id, key): count for key, receiver_id, count in result.all()}
+    values = list(rows.values())
+    for row in values:
+        row["unread_count"] = unread.get((row["user_id"], row["conversation_id"]), 0)
+
+    for start in range(0, len(values), batch_size):
+        await db.execute(insert(summary), values[start:start + batch_size])
+    await db.commit()
+    return len(values)
+
+def _after_messages_created(messages):
+    """Keep in-process caches in step with newly stored messages"""
+    for msg in messages:
+        if msg.receiver_id is not None:
+            _add_watcher(msg.sender_id, msg.receiver_id)
+
 async def create_message(
     db: AsyncSession, 
     sender_id: int, 
@@ -104,10 +380,12 @@ async def create_message(
     file_url: str = None,
     file_type: str = None,
     file_name: str = None,
-    file_size: int = None
+    file_size: int = None,
+    thumbnail_url: str = None,
+    preview_url: str = None
 ):
-    db_msg = models.Message(
-        sender_id=sender_id,
+    db_msg = models.Message(**message_values(
+        sender_id,
         receiver_id=receiver_id,
         group_id=group_id,
         content=content,
@@ -115,52 +393,339 @@ async def create_message(
         file_type=file_type,
         file_name=file_name,
         file_size=file_size,
-        status="sent"
-    )
+        thumbnail_url=thumbnail_url,
+        preview_url=preview_url
+    ))
     db.add(db_msg)
+    await db.flush()
+    db.add(models.ChangeLog(**_message_change(db_msg)))
+    await _update_summaries(db, [db_msg])
+    # The attached file (and its thumbnail/preview variants) lives as long as the message
+    await change_blob_refs_for_urls(db, [file_url], 1)
     await db.commit()
-    await db.refresh(db_msg)
+    _after_messages_created([db_msg])
     return db_msg
 
-async def get_chat_history(db: AsyncSession, user_id: int, contact_or_group_id: int, is_group: bool = False):
+async def create_messages(db: AsyncSession, values: list):
+    """Insert a batch of messages in one statement, returning them in input order"""
+    if not values:
+        return []
+    result = await db.scalars(
+        insert(models.Message).returning(models.Message, sort_by_parameter_order=True),
+        values
+    )
+    messages = result.all()
+    await db.execute(insert(models.ChangeLog), [_message_change(msg) for msg in messages])
+    await _update_summaries(db, messages)
+    await change_blob_refs_for_urls(db, [msg.file_url for msg in messages], 1)
+    await db.commit()
+    _after_messages_created(messages)
+    return messages
+
+def message_visible_to(user_id: int):
+    """Filter for messages in conversations user_id belongs to"""
+    user_group_ids = select(models.GroupMember.group_id).where(models.GroupMember.user_id == user_id)
+    return or_(
+        and_(
+            models.Message.group_id.is_(None),
+            or_(models.Message.sender_id == user_id, models.Message.receiver_id == user_id)
+        ),
+        models.Message.group_id.in_(user_group_ids)
+    )
+
+async def get_chat_history(
+    db: AsyncSession,
+    user_id: int,
+    contact_or_group_id: int,
+    is_group: bool = False,
+    before_id: int = None,
+    after_id: int = None,
+    limit: int = 50
+):
+    """Get one page of a conversation, oldest first.
+
+    Pages are keyed on message id: ``before_id`` walks back into older
+    messages, ``after_id`` walks forward into newer ones. Without a cursor
+    the most recent ``limit`` messages are returned.
+    """
     if is_group:
-        stmt = select(models.Message).where(models.Message.group_id == contact_or_group_id).order_by(models.Message.created_at.asc())
+        key = conversation_key(group_id=contact_or_group_id)
     else:
-        stmt = select(models.Message).where(
-            or_(
-                and_(models.Message.sender_id == user_id, models.Message.receiver_id == contact_or_group_id),
-                and_(models.Message.sender_id == contact_or_group_id, models.Message.receiver_id == user_id)
-            )
-        ).order_by(models.Message.created_at.asc())
-    
+        key = conversation_key(user_id, contact_or_group_id)
+    stmt = select(models.Message).where(models.Message.conversation_id == key)
+
+    if before_id is not None:
+        stmt = stmt.where(models.Message.id < before_id)
+
+    if after_id is not None:
+        # Walking forward: take the oldest messages after the cursor
+        stmt = stmt.where(models.Message.id > after_id).order_by(models.Message.id.asc()).limit(limit)
+        result = await db.execute(stmt)
+        return result.scalars().all()
+
+    # Walking back: take the newest messages, then flip to chronological order
+    stmt = stmt.order_by(models.Message.id.desc()).limit(limit)
     result = await db.execute(stmt)
-    return result.scalars().all()
+    return list(reversed(result.scalars().all()))
 
 async def mark_messages_read(db: AsyncSession, sender_id: int, receiver_id: int):
     # Mark messages sent by sender_id to receiver_id as Read
     stmt = update(models.Message).where(
+        models.Message.conversation_id == conversation_key(sender_id, receiver_id),
         models.Message.sender_id == sender_id,
-        models.Message.receiver_id == receiver_id,
         models.Message.status != "read"
-    ).values(status="read")
+    ).values(status="read").returning(models.Message.id)
     
-    await db.execute(stmt)
+    result = await db.execute(stmt)
+    read_ids = result.scalars().all()
+    if read_ids:
+        # One entry for the whole range: everything up to message_id is read
+        db.add(models.ChangeLog(
+            kind="status",
+            actor_id=receiver_id,
+            user_id=sender_id,
+            message_id=max(read_ids),
+            payload=json.dumps({"status": "read", "upto": True})
+        ))
+    # Everything the other side sent is read now
+    await db.execute(update(models.ConversationSummary).where(
+        models.ConversationSummary.user_id == receiver_id,
+        models.ConversationSummary.conversation_id == conversation_key(sender_id, receiver_id)
+    ).values(unread_count=0))
+    await db.commit()
+
+async def mark_read_upto(db: AsyncSession, reader_id: int, conversation_id: str, upto_id: int):
+    """Mark every message in a conversation up to upto_id as read by reader_id.
+
+    Records read receipts for the newest READ_RECEIPTS_LIMIT of them in one
+    INSERT ... SELECT ... ON CONFLICT; returns {sender_id: [message ids]} for
+    the messages this reader hadn't read yet, so each sender gets a single
+    receipt.
+    """
+    read_range = and_(
+        models.Message.conversation_id == conversation_id,
+        models.Message.id <= upto_id,
+        models.Message.sender_id != reader_id
+    )
+    # Message.status is the 1:1 view; groups are read per member in message_receipts
+    await db.execute(update(models.Message).where(
+        read_range, models.Message.receiver_id.is_not(None), models.Message.status != "read"
+    ).values(status="read"))
+    read_ids = await _upsert_receipts(
+        db, reader_id,
+        select(models.Message.id).where(read_range).order_by(models.Message.id.desc()).limit(READ_RECEIPTS_LIMIT),
+        read=True
+    )
+
+    read_by_sender = {}
+    if read_ids:
+        result = await db.execute(
+            select(models.Message.sender_id, models.Message.id).where(models.Message.id.in_(read_ids))
+        )
+        for sender_id, message_id in result.all():
+            read_by_sender.setdefault(sender_id, []).append(message_id)
+        await db.execute(insert(models.ChangeLog), [
+            dict(
+                kind="status",
+                actor_id=reader_id,
+                user_id=sender_id,
+                message_id=max(message_ids),
+                payload=json.dumps({"status": "read", "upto": True})
+            )
+            for sender_id, message_ids in read_by_sender.items()
+        ])
+    await _lower_unread_after(db, reader_id, conversation_id, upto_id)
     await db.commit()
+    return {sender_id: sorted(message_ids) for sender_id, message_ids in read_by_sender.items()}
+
+async def _lower_unread_after(db: AsyncSession, reader_id: int, conversation_id: str, upto_id: int):
+    """Having read up to upto_id, at most the messages others sent after it are unread"""
+    # A short range scan of the conversation index
+    still_unread = select(func.count(models.Message.id)).where(
+        models.Message.conversation_id == conversation_id,
+        models.Message.id > upto_id,
+        models.Message.sender_id != reader_id
+    ).scalar_subquery()
+    summary = models.ConversationSummary
+    # Reading an older message again must not bring newer ones back as unread
+    await db.execute(update(summary).where(
+        summary.user_id == reader_id,
+        summary.conversation_id == conversation_id
+    ).values(unread_count=case(
+        (summary.unread_count > still_unread, still_unread), else_=summary.unread_count
+    )))
 
-async def update_message_status(db: AsyncSession, message_id: int, status: str):
+async def update_message_status(db: AsyncSession, message_id: int, status: str, actor_id: int = None):
     """Update message status (sent, delivered, read)"""
     stmt = update(models.Message).where(
         models.Message.id == message_id
-    ).values(status=status)
+    ).values(status=status).returning(models.Message.sender_id, models.Message.conversation_id)
     
-    await db.execute(stmt)
+    result = await db.execute(stmt)
+    row = result.first()
+    sender_id = row.sender_id if row else None
+    if sender_id is not None:
+        db.add(models.ChangeLog(
+            kind="status",
+            actor_id=actor_id,
+            user_id=sender_id,
+            message_id=message_id,
+            payload=json.dumps({"status": status})
+        ))
+        if status == "read" and actor_id is not None and actor_id != sender_id and row.conversation_id:
+            await _upsert_receipts(db, actor_id, select(models.Message.id).where(
+                models.Message.id == message_id, _received_by(actor_id)
+            ), read=True)
+            await _lower_unread_after(db, actor_id, row.conversation_id, message_id)
     await db.commit()
+    return sender_id
+
+def _received_by(user_id: int):
+    """Filter for messages user_id is a recipient of"""
+    user_group_ids = select(models.GroupMember.group_id).where(models.GroupMember.user_id == user_id)
+    return and_(
+        models.Message.sender_id != user_id,
+        or_(models.Message.receiver_id == user_id, models.Message.group_id.in_(user_group_ids))
+    )
+
+async def _upsert_receipts(db: AsyncSession, user_id: int, message_ids_query, read: bool = False):
+    """Receipts of user_id for the messages selected by message_ids_query, in one INSERT ... SELECT.
+
+    Returns the ids whose receipt changed: newly delivered, or newly read
+    when read is set. Runs in the caller's transaction.
+    """
+    now = func.now()
+    ids = message_ids_query.subquery()
+    # The WHERE keeps SQLite from parsing ON CONFLICT as part of the SELECT
+    received = select(ids.c.id, literal(user_id, Integer), now, now if read else null()).where(true())
+    stmt = _upsert(db, models.MessageReceipt).from_select(
+        ["message_id", "user_id", "delivered_at", "read_at"], received
+    )
+    keys = ["message_id", "user_id"]
+    if read:
+        stmt = stmt.on_conflict_do_update(
+            index_elements=keys,
+            set_={"read_at": stmt.excluded.read_at},
+            where=models.MessageReceipt.read_at.is_(None)
+        )
+    else:
+        stmt = stmt.on_conflict_do_nothing(index_elements=keys)
+
+    result = await db.execute(stmt.returning(models.MessageReceipt.message_id))
+    return result.scalars().all()
+
+async def record_receipts(db: AsyncSession, user_id: int, message_ids: list, read: bool = False):
+    """Record that user_id received (or read) messages, in one INSERT ... ON CONFLICT.
+
+    Ids of messages the user isn't a recipient of are ignored. Returns the
+    ids whose receipt changed; acks repeated by a reconnecting client are
+    no-ops. Direct messages also move Message.status forward.
+    """
+    if not message_ids:
+        return []
+    changed = await _upsert_receipts(db, user_id, select(models.Message.id).where(
+        models.Message.id.in_(message_ids), _received_by(user_id)
+    ), read=read)
+    if changed:
+        earlier = ["sent", "delivered"] if read else ["sent"]
+        await db.execute(update(models.Message).where(
+            models.Message.id.in_(changed),
+            models.Message.receiver_id.is_not(None),
+            models.Message.status.in_(earlier)
+        ).values(status="read" if read else "delivered"))
+    if changed and read:
+        await _subtract_unread(db, user_id, changed)
+    await db.commit()
+    return changed
+
+async def _subtract_unread(db: AsyncSession, user_id: int, message_ids):
+    """Take newly read messages off a user's unread counters"""
+    result = await db.execute(
+        select(models.Message.conversation_id, func.count(models.Message.id))
+        .where(models.Message.id.in_(message_ids))
+        .group_by(models.Message.conversation_id)
+    )
+    summary = models.ConversationSummary
+    for conversation_id, read_count in result.all():
+        await db.execute(update(summary).where(
+            summary.user_id == user_id,
+            summary.conversation_id == conversation_id
+        ).values(unread_count=case(
+            (summary.unread_count > read_count, summary.unread_count - read_count), else_=0
+        )))
+
+async def get_receipt_counts(db: AsyncSession, message_ids):
+    """Delivered and read counts per message: [(message_id, sender_id, delivered, read)]"""
+    stmt = select(
+        models.Message.id,
+        models.Message.sender_id,
+        func.count(models.MessageReceipt.delivered_at),
+        func.count(models.MessageReceipt.read_at)
+    ).join(
+        models.MessageReceipt, models.MessageReceipt.message_id == models.Message.id
+    ).where(models.Message.id.in_(message_ids)).group_by(models.Message.id, models.Message.sender_id)
+    result = await db.execute(stmt)
+    return result.all()
 
 async def get_message_by_id(db: AsyncSession, message_id: int):
     """Get a message by its ID"""
     result = await db.execute(select(models.Message).where(models.Message.id == message_id))
     return result.scalars().first()
 
+async def get_conversation_summaries(db: AsyncSession, user_id: int, before_id: int = None, limit: int = 50):
+    """Get a page of a user's conversations, most recent first.
+
+    Pass the last_message_id of the oldest row already loaded as ``before_id``.
+    """
+    stmt = select(models.ConversationSummary).where(models.ConversationSummary.user_id == user_id)
+    if before_id is not None:
+        stmt = stmt.where(models.ConversationSummary.last_message_id < before_id)
+    stmt = stmt.order_by(models.ConversationSummary.last_message_id.desc()).limit(limit)
+    result = await db.execute(stmt)
+    return result.scalars().all()
+
+# --- Sync ---
+async def get_changes(db: AsyncSession, user_id: int, since: int, limit: int = 200):
+    """Get change log entries visible to a user after cursor `since`, oldest first.
+
+    Returns up to limit + 1 (entry, message) rows so the caller can tell
+    whether another page follows; message is None for non-message entries.
+    Group entries from before the user (last) joined the group are left out.
+    """
+    user_group_ids = select(models.GroupMember.group_id).where(models.GroupMember.user_id == user_id)
+    joins = aliased(models.ChangeLog)
+    joined_at_change = select(func.max(joins.id)).where(
+        joins.kind == "membership",
+        joins.user_id == user_id,
+        joins.group_id == models.ChangeLog.group_id
+    ).scalar_subquery()
+    stmt = select(models.ChangeLog, models.Message).outerjoin(
+        models.Message, models.Message.id == models.ChangeLog.message_id
+    ).where(
+        models.ChangeLog.id > since,
+        or_(
+            models.ChangeLog.user_id == user_id,
+            models.ChangeLog.actor_id == user_id,
+            and_(
+                models.ChangeLog.group_id.in_(user_group_ids),
+                # Members from before the change log have no entry and see everything
+                models.ChangeLog.id >= func.coalesce(joined_at_change, 0)
+            )
+        )
+    ).order_by(models.ChangeLog.id.asc()).limit(limit + 1)
+    result = await db.execute(stmt)
+    return result.all()
+
+async def get_latest_change_id(db: AsyncSession) -> int:
+    """Current head of the change log, the cursor for a client with nothing to catch up on"""
+    result = await db.execute(select(func.max(models.ChangeLog.id)))
+    return result.scalar() or 0
+
+async def get_oldest_change_id(db: AsyncSession) -> int:
+    """First entry still in the change log; older ones were pruned by retention"""
+    result = await db.execute(select(func.min(models.ChangeLog.id)))
+    return result.scalar() or 0
+
 # Profile CRUD functions
 async def get_user_by_id(db: AsyncSession, user_id: int):
     """Get user by ID"""
@@ -187,18 +752,17 @@ async def update_user_profile(
         user.theme_preference = theme_preference
     
     await db.commit()
-    await db.refresh(user)
     return user
 
-async def update_profile_photo(db: AsyncSession, user_id: int, photo_url: str = None):
+async def update_profile_photo(db: AsyncSession, user_id: int, photo_url: str = None, thumbnail_url: str = None):
     """Update user profile photo"""
     user = await get_user_by_id(db, user_id)
     if not user:
         return None
     
     user.profile_photo_url = photo_url
+    user.profile_thumbnail_url = thumbnail_url
     await db.commit()
-    await db.refresh(user)
     return user
 
 async def update_last_seen(db: AsyncSession, user_id: int):
@@ -209,3 +773,58 @@ async def update_last_seen(db: AsyncSession, user_id: int):
     
     await db.execute(stmt)
     await db.commit()
+
+# --- Blobs (content-addressed uploads) ---
+# Uploads are served from /uploads/<path>; stored blobs live under blobs/
+UPLOADS_URL_PREFIX = "/uploads/"
+
+def blob_path_for_url(url: str):
+    """Path of the blob behind an upload URL, or None for other URLs"""
+    if not url or not url.startswith(UPLOADS_URL_PREFIX + "blobs/"):
+        return None
+    return url[len(UPLOADS_URL_PREFIX):]
+
+async def get_blob(db: AsyncSession, digest: str):
+    """Get a stored blob by content digest"""
+    result = await db.execute(select(models.Blob).where(models.Blob.digest == digest))
+    return result.scalars().first()
+
+async def create_blob(db: AsyncSession, digest: str, path: str, size: int, content_type: str = None):
+    """Record a newly stored blob; it gains references as messages and profiles point at it"""
+    blob = models.Blob(digest=digest, path=path, size=size, content_type=content_type, ref_count=0)
+    db.add(blob)
+    await db.commit()
+    return blob
+
+async def change_blob_refs_for_urls(db: AsyncSession, urls, delta: int):
+    """Add delta to the blob behind each URL, in the caller's transaction"""
+    counts = {}
+    for url in urls:
+        path = blob_path_for_url(url)
+        if path:
+            counts[path] = counts.get(path, 0) + delta
+    for path, change in counts.items():
+        await db.execute(
+            update(models.Blob).where(models.Blob.path == path).values(ref_count=models.Blob.ref_count + change)
+        )
+
+async def get_blob_by_path(db: AsyncSession, path: str):
+    """Get a stored blob by its path under the uploads directory"""
+    result = await db.execute(select(models.Blob).where(models.Blob.path == path))
+    return result.scalars().first()
+
+async def get_unreferenced_blobs(db: AsyncSession, after: str = None, limit: int = 1000):
+    """Get blobs nothing points at, in digest order after the given digest"""
+    query = select(models.Blob).where(models.Blob.ref_count <= 0)
+    if after is not None:
+        query = query.where(models.Blob.digest > after)
+    result = await db.execute(query.order_by(models.Blob.digest).limit(limit))
+    return result.scalars().all()
+
+async def delete_blob(db: AsyncSession, digest: str):
+    """Delete a blob row if it is still unreferenced; returns True if deleted"""
+    result = await db.execute(
+        delete(models.Blob).where(models.Blob.digest == digest, models.Blob.ref_count <= 0)
+    )
+    await db.commit()
+    return result.rowcount > 0
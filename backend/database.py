@@ -1,9 +1,10 @@
-from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession, create_async_engine
 from sqlalchemy.orm import sessionmaker, declarative_base
 
 import os
 
-# Render/Railway provide DATABASE_URL. 
+# Render/Railway provide DATABASE_URL.
 # We need to ensure it uses the asyncpg driver.
 DATABASE_URL = os.getenv("DATABASE_URL", "sqlite+aiosqlite:///./echat.db")
 if DATABASE_URL.startswith("postgres://"):
@@ -11,7 +12,56 @@ if DATABASE_URL.startswith("postgres://"):
 elif DATABASE_URL.startswith("postgresql://"):
     DATABASE_URL = DATABASE_URL.replace("postgresql://", "postgresql+asyncpg://", 1)
 
-engine = create_async_engine(DATABASE_URL, echo=True)
+# Engine settings
+# DB_ECHO: "false" (default), "true" to log SQL, "debug" to also log result rows
+DB_ECHO = os.getenv("DB_ECHO", "false").lower()
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_POOL_TIMEOUT = int(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "true").lower() == "true"
+# asyncpg prepared statement cache; set to 0 behind pgbouncer in transaction mode
+DB_STATEMENT_CACHE_SIZE = int(os.getenv("DB_STATEMENT_CACHE_SIZE", "100"))
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+
+def _echo_setting(value: str):
+    if value == "debug":
+        return "debug"
+    return value in ("1", "true", "yes")
+
+def engine_options(url: str) -> dict:
+    """Keyword arguments for create_async_engine, derived from the DB_* settings"""
+    options = {"echo": _echo_setting(DB_ECHO)}
+
+    # In-memory SQLite runs on a single static connection, so pool sizing doesn't apply
+    if ":memory:" not in url:
+        options.update(
+            pool_size=DB_POOL_SIZE,
+            max_overflow=DB_MAX_OVERFLOW,
+            pool_timeout=DB_POOL_TIMEOUT,
+            pool_pre_ping=DB_POOL_PRE_PING,
+        )
+
+    if url.startswith("postgresql+asyncpg"):
+        options["connect_args"] = {"statement_cache_size": DB_STATEMENT_CACHE_SIZE}
+
+    return options
+
+def _set_sqlite_pragmas(dbapi_connection, connection_record):
+    """WAL lets readers run alongside the writer; NORMAL sync is durable in WAL mode"""
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+    cursor.close()
+
+def build_engine(url: str) -> AsyncEngine:
+    """Create the async engine for a database URL"""
+    db_engine = create_async_engine(url, **engine_options(url))
+    if url.startswith("sqlite"):
+        event.listen(db_engine.sync_engine, "connect", _set_sqlite_pragmas)
+    return db_engine
+
+engine = build_engine(DATABASE_URL)
 
 SessionLocal = sessionmaker(
     bind=engine,
@@ -1,3 +1,4 @@
+import asyncio
 import os
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
@@ -5,9 +6,15 @@ from fastapi.staticfiles import StaticFiles
 from fastapi.responses import FileResponse
 import socketio
 from dotenv import load_dotenv
-from .database import engine, Base
-from .routers import auth, chat, profile
-from . import models, database
+from .routers import auth, chat, profile, media
+from . import models, database, uploads
+from .cache import cache_stats
+from .backplane import create_client_manager
+from .write_behind import message_write_buffer
+from .receipts import receipt_aggregator
+from .typing_indicator import typing_manager
+from .retention import retention_job, RETENTION_INTERVAL_SECONDS
+from .hashing import password_hasher
 
 # Load environment variables
 load_dotenv()
@@ -34,8 +41,10 @@ app.add_middleware(
 )
 
 # Create Socket.IO server
+# With SOCKETIO_BACKPLANE_URL set, emits are shared between workers over pub/sub
 sio = socketio.AsyncServer(
     async_mode='asgi',
+    client_manager=create_client_manager(),
     cors_allowed_origins='*',  # Allow all origins
     logger=True,
     engineio_logger=True
@@ -50,23 +59,37 @@ try:
 except:
     pass  # Static directory might not exist
 
-# Mount uploads directory for profile photos and files
-try:
-    app.mount("/uploads", StaticFiles(directory="backend/uploads"), name="uploads")
-except:
-    os.makedirs("backend/uploads", exist_ok=True)
-    app.mount("/uploads", StaticFiles(directory="backend/uploads"), name="uploads")
+# Uploads are served by routers/media.py (ETags, immutable caching, Range requests)
 
 # Include routers
 app.include_router(auth.router)
 app.include_router(chat.router)
 app.include_router(profile.router)
+app.include_router(media.router)
 
 @app.on_event("startup")
 async def startup():
-    # Create tables
-    async with engine.begin() as conn:
-        await conn.run_sync(Base.metadata.create_all)
+    # Schema changes are applied by the release step (python backend/migrate.py), not by workers
+
+    # Abandoned resumable uploads
+    await uploads.purge_stale_sessions()
+
+    # Presence heartbeats and expiry sweeps
+    app.state.presence_task = asyncio.create_task(presence_loop(sio))
+
+    # Message archival and pruning; off by default, or run `python -m backend.retention run` from cron
+    app.state.retention_task = None
+    if RETENTION_INTERVAL_SECONDS > 0:
+        app.state.retention_task = asyncio.create_task(retention_job.run_forever(RETENTION_INTERVAL_SECONDS))
+
+@app.on_event("shutdown")
+async def shutdown():
+    app.state.presence_task.cancel()
+    if app.state.retention_task:
+        app.state.retention_task.cancel()
+    # Don't drop messages still waiting in the write-behind queue
+    await message_write_buffer.close()
+    await receipt_aggregator.close()
 
 @app.get("/")
 async def root():
@@ -77,6 +100,18 @@ async def health_check():
     """Health check endpoint for monitoring"""
     return {"status": "healthy", "service": "e_chat"}
 
+@app.get("/stats")
+async def stats():
+    """Internal counters for monitoring"""
+    return {
+        "caches": cache_stats(),
+        "message_write_behind": message_write_buffer.stats(),
+        "receipts": receipt_aggregator.stats(),
+        "typing": typing_manager.stats(),
+        "retention": retention_job.stats(),
+        "password_hashing": password_hasher.stats(),
+    }
+
 # Socket.IO Event Handlers
-from .chat_manager import setup_socketio_events
+from .chat_manager import setup_socketio_events, presence_loop
 setup_socketio_events(sio)
@@ -0,0 +1,122 @@
+"""
+Resized image variants for uploads
+
+Chat lists and avatars don't need the full-size original. For every image
+upload a small worker pool renders WebP variants at a few fixed widths and
+caches them on disk under uploads/variants. Variants are addressed as
+/media/<upload path>?w=<width>; the route renders a missing variant on
+demand, so recorded URLs work even before the background job finishes.
+
+Requires Pillow. Without it uploads still work, only variants are skipped.
+"""
+import asyncio
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, Optional
+
+import aiofiles.os
+
+from . import blobstore
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # pragma: no cover - optional dependency
+    Image = None
+
+logger = logging.getLogger(__name__)
+
+MEDIA_WORKERS = int(os.getenv("MEDIA_WORKERS", "2"))
+THUMBNAIL_WIDTH = 256
+PREVIEW_WIDTH = 1280
+# Only these widths are rendered, so ?w= can't be used to fill the disk
+VARIANT_WIDTHS = (64, 128, THUMBNAIL_WIDTH, 512, PREVIEW_WIDTH)
+VARIANT_DIR_NAME = "variants"
+WEBP_QUALITY = 80
+IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png", ".gif", ".webp"}
+
+# Pillow releases the GIL while decoding, resizing and encoding
+_executor = ThreadPoolExecutor(max_workers=MEDIA_WORKERS, thread_name_prefix="media")
+# variant path -> render in progress, so concurrent requests share one job
+_in_flight: Dict[str, asyncio.Future] = {}
+
+def variants_enabled() -> bool:
+    return Image is not None
+
+def is_image(path: str) -> bool:
+    return Path(path).suffix.lower() in IMAGE_EXTENSIONS
+
+def snap_width(width: int) -> int:
+    """Smallest supported width >= width (or the largest one)"""
+    for candidate in VARIANT_WIDTHS:
+        if candidate >= width:
+            return candidate
+    return VARIANT_WIDTHS[-1]
+
+def variant_path(path: str, width: int) -> str:
+    """Where the variant of an upload is cached, relative to the uploads directory"""
+    return f"{VARIANT_DIR_NAME}/{path.replace('/', '_')}_w{width}.webp"
+
+def variant_url(url: Optional[str], width: int) -> Optional[str]:
+    """URL serving an image upload at `width`, or None for non-images"""
+    prefix = blobstore.blob_url("")
+    if not url or not url.startswith(prefix) or not is_image(url) or not variants_enabled():
+        return None
+    return f"/media/{url[len(prefix):]}?w={width}"
+
+def image_variant_urls(url: Optional[str]) -> dict:
+    """Thumbnail and preview URLs to record alongside an image upload"""
+    return {
+        "thumbnail_url": variant_url(url, THUMBNAIL_WIDTH),
+        "preview_url": variant_url(url, PREVIEW_WIDTH),
+    }
+
+def _render(source: Path, target: Path, width: int):
+    with Image.open(source) as img:
+        img = ImageOps.exif_transpose(img)
+        img.thumbnail((width, width * 4))
+        if img.mode not in ("RGB", "RGBA"):
+            img = img.convert("RGBA")
+        target.parent.mkdir(parents=True, exist_ok=True)
+        temp = target.with_suffix(".tmp")
+        img.save(temp, "WEBP", quality=WEBP_QUALITY)
+    os.replace(temp, target)
+
+async def ensure_variant(path: str, width: int) -> Path:
+    """Render the variant of an upload if it isn't cached yet; returns its file"""
+    rel = variant_path(path, width)
+    target = blobstore.UPLOAD_ROOT / rel
+    if target.exists():
+        return target
+
+    future = _in_flight.get(rel)
+    if future is None:
+        loop = asyncio.get_running_loop()
+        future = loop.run_in_executor(_executor, _render, blobstore.UPLOAD_ROOT / path, target, width)
+        _in_flight[rel] = future
+        future.add_done_callback(lambda _: _in_flight.pop(rel, None))
+    await asyncio.shield(future)
+    return target
+
+def schedule_variants(url: Optional[str]):
+    """Pre-render thumbnail and preview of an image upload in the background"""
+    prefix = blobstore.blob_url("")
+    if not url or not url.startswith(prefix) or not is_image(url) or not variants_enabled():
+        return
+    path = url[len(prefix):]
+    for width in (THUMBNAIL_WIDTH, PREVIEW_WIDTH):
+        task = asyncio.create_task(ensure_variant(path, width))
+        task.add_done_callback(_log_failure)
+
+async def remove_variants(path: str):
+    """Delete every cached variant of an upload"""
+    for width in VARIANT_WIDTHS:
+        try:
+            await aiofiles.os.remove(blobstore.UPLOAD_ROOT / variant_path(path, width))
+        except FileNotFoundError:
+            pass
+
+def _log_failure(task: asyncio.Task):
+    if not task.cancelled() and task.exception():
+        logger.warning(f"Image variant failed: {task.exception()}")
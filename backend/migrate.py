@@ -1,37 +1,198 @@
 """
-Database migration script for E-Chat
-Creates all database tables from SQLAlchemy models
+Database migrations for E-Chat
+
+Applies the versioned migrations in backend/migrations that the database
+hasn't seen yet, in order, and records each one in schema_migrations:
+
+    python backend/migrate.py            # apply pending migrations
+    python backend/migrate.py status     # list applied and pending versions
+
+Runs as the release step (Procfile, fly.toml, start.sh); workers no
+longer touch the schema on startup. On Postgres, indexes are built with
+CREATE INDEX CONCURRENTLY so existing tables stay writable, and an
+advisory lock keeps two release processes from migrating at once.
 """
 import asyncio
+import importlib
+import pkgutil
 import sys
 import os
+from contextlib import asynccontextmanager
 
 # Add parent directory to path
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-from backend.database import engine, Base
-from backend.models import User, Message, Contact, Group, GroupMember
+from sqlalchemy import Column, DateTime, MetaData, String, Table, func, inspect, insert, select, text
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession
+from backend import database
+import backend.migrations
+
+BACKFILL_BATCH_SIZE = 1000
+# pg_advisory_lock key held while migrating ("echat" in ASCII)
+MIGRATION_LOCK_KEY = 0x6563686174
+
+schema_migrations = Table(
+    "schema_migrations",
+    MetaData(),
+    Column("version", String, primary_key=True),
+    Column("description", String, nullable=True),
+    Column("applied_at", DateTime(timezone=True), server_default=func.now()),
+)
+
+class MigrationContext:
+    """Helpers handed to each migration's upgrade()"""
+
+    def __init__(self, engine: AsyncEngine):
+        self.engine = engine
+        self.dialect = engine.dialect.name
+
+    async def execute(self, statement, params=None):
+        """Run one statement in its own transaction"""
+        if isinstance(statement, str):
+            statement = text(statement)
+        async with self.engine.begin() as conn:
+            return await conn.execute(statement, params)
+
+    async def run_sync(self, fn):
+        """Run fn(sync_connection) in a transaction, e.g. metadata.create_all"""
+        async with self.engine.begin() as conn:
+            return await conn.run_sync(fn)
+
+    def session(self) -> AsyncSession:
+        return AsyncSession(self.engine, expire_on_commit=False)
+
+    async def add_column(self, table: str, column: str, column_type: str):
+        """ALTER TABLE ... ADD COLUMN unless the column already exists"""
+        def add(sync_conn):
+            existing = {c["name"] for c in inspect(sync_conn).get_columns(table)}
+            if column not in existing:
+                sync_conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {column} {column_type}"))
+        await self.run_sync(add)
+
+    async def is_partitioned(self, table: str) -> bool:
+        """Whether a table is partitioned (Postgres only)"""
+        if self.dialect != "postgresql":
+            return False
+        result = await self.execute("SELECT relkind FROM pg_class WHERE oid = to_regclass(:name)", {"name": table})
+        return result.scalar() == "p"
+
+    async def create_index(self, name: str, table: str, columns: list, unique: bool = False, using: str = None):
+        """CREATE INDEX IF NOT EXISTS, CONCURRENTLY on Postgres.
 
-async def init_db():
-    """Initialize database tables"""
-    print("🔄 Starting database migration...")
-    print(f"📊 Database URL: {engine.url}")
-    
+        columns may be expressions; using picks the index method (e.g. gin).
+        """
+        unique_sql = "UNIQUE " if unique else ""
+        columns_sql = ", ".join(columns)
+        if self.dialect != "postgresql":
+            await self.execute(f"CREATE {unique_sql}INDEX IF NOT EXISTS {name} ON {table} ({columns_sql})")
+            return
+        using_sql = f"USING {using} " if using else ""
+        if await self.is_partitioned(table):
+            # Postgres can't build a partitioned index CONCURRENTLY; this blocks writes, not reads
+            await self.execute(f"CREATE {unique_sql}INDEX IF NOT EXISTS {name} ON {table} {using_sql}({columns_sql})")
+            return
+
+        # CONCURRENTLY doesn't block writes but can't run inside a transaction
+        async with self.engine.connect() as conn:
+            conn = await conn.execution_options(isolation_level="AUTOCOMMIT")
+            invalid = await conn.scalar(text(
+                "SELECT NOT i.indisvalid FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid "
+                "WHERE c.relname = :name"
+            ), {"name": name})
+            if invalid:
+                # Left behind by an interrupted concurrent build; IF NOT EXISTS would keep it
+                await conn.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {name}"))
+            await conn.execute(text(
+                f"CREATE {unique_sql}INDEX CONCURRENTLY IF NOT EXISTS {name} ON {table} {using_sql}({columns_sql})"
+            ))
+
+    async def backfill(self, step, batch_size: int = BACKFILL_BATCH_SIZE) -> int:
+        """Call `await step(conn, batch_size)` until it handles fewer than batch_size rows.
+
+        Each batch commits on its own, so locks are short and an interrupted
+        backfill resumes where it stopped. Returns the total rows handled.
+        """
+        total = 0
+        while True:
+            async with self.engine.begin() as conn:
+                handled = await step(conn, batch_size)
+            total += handled
+            if handled < batch_size:
+                return total
+
+def discover_migrations():
+    """(version, name, module) for every migration, oldest first"""
+    found = []
+    for info in pkgutil.iter_modules(backend.migrations.__path__):
+        version, _, name = info.name.partition("_")
+        if version.isdigit():
+            found.append((version, name, importlib.import_module(f"backend.migrations.{info.name}")))
+    return sorted(found, key=lambda m: m[0])
+
+def _describe(module) -> str:
+    lines = (module.__doc__ or "").strip().splitlines()
+    return lines[0] if lines else ""
+
+async def applied_versions(engine: AsyncEngine) -> set:
+    async with engine.begin() as conn:
+        await conn.run_sync(schema_migrations.metadata.create_all)
+        result = await conn.execute(select(schema_migrations.c.version))
+        return set(result.scalars().all())
+
+@asynccontextmanager
+async def _migration_lock(engine: AsyncEngine):
+    if engine.dialect.name != "postgresql":
+        yield
+        return
+    # Session-level lock on an autocommit connection, so it doesn't hold a transaction open
+    async with engine.connect() as conn:
+        conn = await conn.execution_options(isolation_level="AUTOCOMMIT")
+        await conn.execute(text("SELECT pg_advisory_lock(:key)"), {"key": MIGRATION_LOCK_KEY})
+        try:
+            yield
+        finally:
+            await conn.execute(text("SELECT pg_advisory_unlock(:key)"), {"key": MIGRATION_LOCK_KEY})
+
+async def migrate(engine: AsyncEngine = None) -> list:
+    """Apply pending migrations; returns the versions applied"""
+    engine = engine or database.engine
+    ctx = MigrationContext(engine)
+    applied = []
+    async with _migration_lock(engine):
+        done = await applied_versions(engine)
+        for version, name, module in discover_migrations():
+            if version in done:
+                continue
+            print(f"⏫ Applying {version}_{name}")
+            await module.upgrade(ctx)
+            # Recorded after the fact: migrations are written to be safe to re-run
+            await ctx.execute(insert(schema_migrations).values(version=version, description=_describe(module)))
+            applied.append(version)
+    return applied
+
+async def status(engine: AsyncEngine = None):
+    engine = engine or database.engine
+    done = await applied_versions(engine)
+    for version, name, module in discover_migrations():
+        print(f"{'✅' if version in done else '⏳'} {version}_{name}: {_describe(module)}")
+
+async def main():
+    command = sys.argv[1] if len(sys.argv) > 1 else "up"
+    print(f"📊 Database URL: {database.engine.url}")
     try:
-        async with engine.begin() as conn:
-            # Create all tables
-            await conn.run_sync(Base.metadata.create_all)
-        
-        print("✅ Database tables created successfully!")
-        print("📋 Tables: users, messages, contacts, groups, group_members")
-        
+        if command == "status":
+            await status()
+        elif command == "up":
+            applied = await migrate()
+            print(f"✅ Applied {len(applied)} migrations" if applied else "✅ Database is up to date")
+        else:
+            print(f"Unknown command {command!r}; use 'up' or 'status'")
+            sys.exit(2)
     except Exception as e:
         print(f"❌ Migration failed: {e}")
         raise
-
-async def main():
-    await init_db()
-    await engine.dispose()
+    finally:
+        await database.engine.dispose()
 
 if __name__ == "__main__":
     asyncio.run(main())
@@ -0,0 +1,78 @@
+"""Initial schema: users, contacts, groups, messages, OTPs and call history"""
+from sqlalchemy import Boolean, Column, DateTime, ForeignKey, Integer, MetaData, String, Table, Text, func
+
+# Frozen copy of the tables as they were before versioned migrations;
+# later changes belong in later migrations, not here
+metadata = MetaData()
+
+Table(
+    "users", metadata,
+    Column("id", Integer, primary_key=True, index=True),
+    Column("email", String, unique=True, index=True, nullable=False),
+    Column("password_hash", String, nullable=False),
+    Column("created_at", DateTime(timezone=True), server_default=func.now()),
+)
+
+Table(
+    "contacts", metadata,
+    Column("id", Integer, primary_key=True, index=True),
+    Column("owner_id", Integer, ForeignKey("users.id"), nullable=False),
+    Column("contact_user_id", Integer, ForeignKey("users.id"), nullable=False),
+    Column("created_at", DateTime(timezone=True), server_default=func.now()),
+)
+
+Table(
+    "groups", metadata,
+    Column("id", Integer, primary_key=True, index=True),
+    Column("name", String, nullable=False),
+    Column("admin_id", Integer, ForeignKey("users.id"), nullable=False),
+    Column("created_at", DateTime(timezone=True), server_default=func.now()),
+)
+
+Table(
+    "group_members", metadata,
+    Column("id", Integer, primary_key=True, index=True),
+    Column("group_id", Integer, ForeignKey("groups.id"), nullable=False),
+    Column("user_id", Integer, ForeignKey("users.id"), nullable=False),
+    Column("joined_at", DateTime(timezone=True), server_default=func.now()),
+)
+
+Table(
+    "messages", metadata,
+    Column("id", Integer, primary_key=True, index=True),
+    Column("sender_id", Integer, ForeignKey("users.id"), nullable=False),
+    Column("receiver_id", Integer, ForeignKey("users.id"), nullable=True),
+    Column("group_id", Integer, ForeignKey("groups.id"), nullable=True),
+    Column("content", Text, nullable=True),
+    Column("file_url", String, nullable=True),
+    Column("file_type", String, nullable=True),
+    Column("file_name", String, nullable=True),
+    Column("file_size", Integer, nullable=True),
+    Column("status", String),
+    Column("created_at", DateTime(timezone=True), server_default=func.now()),
+)
+
+Table(
+    "otps", metadata,
+    Column("id", Integer, primary_key=True, index=True),
+    Column("email", String, index=True, nullable=False),
+    Column("code", String, nullable=False),
+    Column("expires_at", DateTime, nullable=False),
+    Column("is_used", Boolean),
+)
+
+Table(
+    "call_history", metadata,
+    Column("id", Integer, primary_key=True, index=True),
+    Column("caller_id", Integer, ForeignKey("users.id"), nullable=False),
+    Column("receiver_id", Integer, ForeignKey("users.id"), nullable=False),
+    Column("call_type", String, nullable=False),
+    Column("status", String, nullable=False),
+    Column("duration", Integer, nullable=True),
+    Column("started_at", DateTime(timezone=True), server_default=func.now()),
+    Column("ended_at", DateTime(timezone=True), nullable=True),
+)
+
+async def upgrade(ctx):
+    # checkfirst: databases from before migrations already have these tables
+    await ctx.run_sync(metadata.create_all)
@@ -0,0 +1,8 @@
+"""Add profile columns to users (was migrations/add_profile_fields.sql)"""
+
+async def upgrade(ctx):
+    await ctx.add_column("users", "display_name", "VARCHAR")
+    await ctx.add_column("users", "about", "VARCHAR")
+    await ctx.add_column("users", "profile_photo_url", "VARCHAR")
+    await ctx.add_column("users", "theme_preference", "VARCHAR DEFAULT 'light'")
+    await ctx.add_column("users", "last_seen", "TIMESTAMP WITH TIME ZONE")
@@ -0,0 +1,51 @@
+"""Add conversation_id and media variant columns, and backfill conversation_id"""
+from sqlalchemy import Column, Integer, MetaData, String, Table, bindparam, select, update
+
+# Frozen copy of the columns this migration reads and writes
+metadata = MetaData()
+messages = Table(
+    "messages", metadata,
+    Column("id", Integer, primary_key=True),
+    Column("sender_id", Integer),
+    Column("receiver_id", Integer),
+    Column("group_id", Integer),
+    Column("conversation_id", String),
+)
+
+def _conversation_key(sender_id, receiver_id, group_id):
+    """Key format as of this migration: "g:<group>" or "u:<low>:<high>"; "" for neither"""
+    if group_id is not None:
+        return f"g:{group_id}"
+    if sender_id is None or receiver_id is None:
+        return ""
+    low, high = sorted((sender_id, receiver_id))
+    return f"u:{low}:{high}"
+
+async def _fill_conversation_ids(conn, batch_size):
+    result = await conn.execute(
+        select(messages.c.id, messages.c.sender_id, messages.c.receiver_id, messages.c.group_id)
+        .where(messages.c.conversation_id.is_(None))
+        .order_by(messages.c.id)
+        .limit(batch_size)
+    )
+    rows = result.all()
+    if rows:
+        # Rows without a receiver or group have no conversation; "" marks them done
+        await conn.execute(
+            update(messages)
+            .where(messages.c.id == bindparam("msg_id"))
+            .values(conversation_id=bindparam("key")),
+            [
+                {"msg_id": row.id, "key": _conversation_key(row.sender_id, row.receiver_id, row.group_id)}
+                for row in rows
+            ]
+        )
+    return len(rows)
+
+async def upgrade(ctx):
+    await ctx.add_column("messages", "conversation_id", "VARCHAR")
+    await ctx.add_column("messages", "thumbnail_url", "VARCHAR")
+    await ctx.add_column("messages", "preview_url", "VARCHAR")
+    await ctx.add_column("users", "profile_thumbnail_url", "VARCHAR")
+    total = await ctx.backfill(_fill_conversation_ids)
+    print(f"🔁 Backfilled conversation_id on {total} messages")
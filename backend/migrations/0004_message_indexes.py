@@ -0,0 +1,66 @@
+"""Tables for uploads, sync, the chat list and receipts; indexes for keyset pagination and lookups"""
+from sqlalchemy import Column, DateTime, ForeignKey, Integer, MetaData, String, Table, Text, func
+
+# Frozen copies; tables referenced by foreign keys are stubs and aren't created here
+metadata = MetaData()
+Table("users", metadata, Column("id", Integer, primary_key=True))
+Table("groups", metadata, Column("id", Integer, primary_key=True))
+Table("messages", metadata, Column("id", Integer, primary_key=True))
+
+blobs = Table(
+    "blobs", metadata,
+    Column("digest", String, primary_key=True),
+    Column("path", String, nullable=False, unique=True),
+    Column("size", Integer, nullable=False),
+    Column("content_type", String, nullable=True),
+    Column("ref_count", Integer, nullable=False),
+    Column("created_at", DateTime(timezone=True), server_default=func.now()),
+)
+
+change_log = Table(
+    "change_log", metadata,
+    Column("id", Integer, primary_key=True, index=True),
+    Column("kind", String, nullable=False),
+    Column("actor_id", Integer, nullable=True),
+    Column("user_id", Integer, nullable=True),
+    Column("group_id", Integer, nullable=True),
+    Column("message_id", Integer, nullable=True),
+    Column("payload", Text, nullable=True),
+    Column("created_at", DateTime(timezone=True), server_default=func.now()),
+)
+
+conversation_summaries = Table(
+    "conversation_summaries", metadata,
+    Column("user_id", Integer, ForeignKey("users.id"), primary_key=True),
+    Column("conversation_id", String, primary_key=True),
+    Column("peer_user_id", Integer, ForeignKey("users.id"), nullable=True),
+    Column("group_id", Integer, ForeignKey("groups.id"), nullable=True),
+    Column("last_message_id", Integer, nullable=False),
+    Column("last_sender_id", Integer, nullable=True),
+    Column("snippet", String, nullable=True),
+    Column("unread_count", Integer, nullable=False),
+    Column("updated_at", DateTime(timezone=True), server_default=func.now()),
+)
+
+message_receipts = Table(
+    "message_receipts", metadata,
+    Column("message_id", Integer, ForeignKey("messages.id"), primary_key=True),
+    Column("user_id", Integer, ForeignKey("users.id"), primary_key=True),
+    Column("delivered_at", DateTime(timezone=True), nullable=False),
+    Column("read_at", DateTime(timezone=True), nullable=True),
+)
+
+async def upgrade(ctx):
+    await ctx.run_sync(lambda conn: metadata.create_all(
+        conn, tables=[blobs, change_log, conversation_summaries, message_receipts]
+    ))
+    await ctx.create_index("ix_messages_group_id_id", "messages", ["group_id", "id"])
+    await ctx.create_index("ix_messages_sender_receiver_id", "messages", ["sender_id", "receiver_id", "id"])
+    await ctx.create_index("ix_messages_conversation_id_id", "messages", ["conversation_id", "id"])
+    await ctx.create_index("ix_contacts_contact_user_id", "contacts", ["contact_user_id"])
+    await ctx.create_index("ix_change_log_user_id_id", "change_log", ["user_id", "id"])
+    await ctx.create_index("ix_change_log_actor_id_id", "change_log", ["actor_id", "id"])
+    await ctx.create_index("ix_change_log_group_id_id", "change_log", ["group_id", "id"])
+    await ctx.create_index(
+        "ix_conversation_summaries_user_id_last_message_id", "conversation_summaries", ["user_id", "last_message_id"]
+    )
@@ -0,0 +1,31 @@
+"""Full-text search index on message content (FTS5 / GIN expression index)"""
+
+SQLITE_SEARCH_DDL = [
+    """CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5(
+        content, content='messages', content_rowid='id', tokenize='unicode61 remove_diacritics 2'
+    )""",
+    """CREATE TRIGGER IF NOT EXISTS messages_fts_insert AFTER INSERT ON messages BEGIN
+        INSERT INTO messages_fts(rowid, content) VALUES (new.id, new.content);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS messages_fts_delete AFTER DELETE ON messages BEGIN
+        INSERT INTO messages_fts(messages_fts, rowid, content) VALUES ('delete', old.id, old.content);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS messages_fts_update AFTER UPDATE OF content ON messages BEGIN
+        INSERT INTO messages_fts(messages_fts, rowid, content) VALUES ('delete', old.id, old.content);
+        INSERT INTO messages_fts(rowid, content) VALUES (new.id, new.content);
+    END""",
+]
+
+async def upgrade(ctx):
+    if ctx.dialect == "postgresql":
+        # An expression index stores nothing per row, so messages isn't rewritten
+        await ctx.create_index(
+            "ix_messages_content_fts", "messages", ["to_tsvector('simple', coalesce(content, ''))"], using="gin"
+        )
+    elif ctx.dialect == "sqlite":
+        exists = (await ctx.execute("SELECT 1 FROM sqlite_master WHERE name = 'messages_fts'")).first()
+        for statement in SQLITE_SEARCH_DDL:
+            await ctx.execute(statement)
+        if not exists:
+            # Index messages written before the search table existed
+            await ctx.execute("INSERT INTO messages_fts(messages_fts) VALUES ('rebuild')")
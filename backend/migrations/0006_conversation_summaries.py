@@ -0,0 +1,97 @@
+"""Build conversation summaries from existing history"""
+from sqlalchemy import Column, DateTime, Integer, MetaData, String, Table, Text, func, insert, select
+
+# Frozen copies of the columns this migration reads and writes
+metadata = MetaData()
+messages = Table(
+    "messages", metadata,
+    Column("id", Integer, primary_key=True),
+    Column("sender_id", Integer),
+    Column("receiver_id", Integer),
+    Column("group_id", Integer),
+    Column("conversation_id", String),
+    Column("content", Text),
+    Column("file_name", String),
+    Column("status", String),
+    Column("created_at", DateTime(timezone=True)),
+)
+group_members = Table(
+    "group_members", metadata,
+    Column("id", Integer, primary_key=True),
+    Column("group_id", Integer),
+    Column("user_id", Integer),
+)
+conversation_summaries = Table(
+    "conversation_summaries", metadata,
+    Column("user_id", Integer, primary_key=True),
+    Column("conversation_id", String, primary_key=True),
+    Column("peer_user_id", Integer),
+    Column("group_id", Integer),
+    Column("last_message_id", Integer),
+    Column("last_sender_id", Integer),
+    Column("snippet", String),
+    Column("unread_count", Integer),
+    Column("updated_at", DateTime(timezone=True)),
+)
+
+SNIPPET_LENGTH = 100
+INSERT_BATCH_SIZE = 1000
+
+def _snippet(msg):
+    if msg.content:
+        return msg.content[:SNIPPET_LENGTH]
+    if msg.file_name:
+        return f"📎 {msg.file_name}"[:SNIPPET_LENGTH]
+    return None
+
+async def _build(conn) -> int:
+    if await conn.scalar(select(func.count()).select_from(conversation_summaries)):
+        return 0
+
+    last_ids = select(func.max(messages.c.id)).where(
+        messages.c.conversation_id != ""
+    ).group_by(messages.c.conversation_id)
+    last_messages = (await conn.execute(
+        select(messages).where(messages.c.id.in_(last_ids)).order_by(messages.c.id)
+    )).all()
+
+    members = {}
+    result = await conn.execute(select(group_members.c.group_id, group_members.c.user_id))
+    for group_id, user_id in result.all():
+        members.setdefault(group_id, []).append(user_id)
+
+    # 1:1 unread counts from message status; groups have no per-member read state in old data
+    result = await conn.execute(
+        select(messages.c.conversation_id, messages.c.receiver_id, func.count(messages.c.id))
+        .where(messages.c.receiver_id.is_not(None), messages.c.status != "read")
+        .group_by(messages.c.conversation_id, messages.c.receiver_id)
+    )
+    unread = {(receiver_id, key): count for key, receiver_id, count in result.all()}
+
+    rows = []
+    for msg in last_messages:
+        if msg.group_id is not None:
+            participants = [(member_id, None) for member_id in members.get(msg.group_id, [])]
+        else:
+            participants = [(msg.sender_id, msg.receiver_id), (msg.receiver_id, msg.sender_id)]
+        for user_id, peer_id in participants:
+            rows.append(dict(
+                user_id=user_id,
+                conversation_id=msg.conversation_id,
+                peer_user_id=peer_id,
+                group_id=msg.group_id,
+                last_message_id=msg.id,
+                last_sender_id=msg.sender_id,
+                snippet=_snippet(msg),
+                unread_count=unread.get((user_id, msg.conversation_id), 0),
+                updated_at=msg.created_at,
+            ))
+
+    for start in range(0, len(rows), INSERT_BATCH_SIZE):
+        await conn.execute(insert(conversation_summaries), rows[start:start + INSERT_BATCH_SIZE])
+    return len(rows)
+
+async def upgrade(ctx):
+    async with ctx.engine.begin() as conn:
+        total = await _build(conn)
+    print(f"🔁 Backfilled {total} conversation summaries")
@@ -0,0 +1,28 @@
+"""Per-group message retention, the message archive table and an index on message age"""
+from sqlalchemy import Column, DateTime, Index, Integer, MetaData, String, Table, Text, func
+
+# Frozen copy of messages_archive
+messages_archive = Table(
+    "messages_archive", MetaData(),
+    Column("id", Integer, primary_key=True),
+    Column("sender_id", Integer, nullable=False),
+    Column("receiver_id", Integer, nullable=True),
+    Column("group_id", Integer, nullable=True),
+    Column("conversation_id", String, nullable=True),
+    Column("content", Text, nullable=True),
+    Column("file_url", String, nullable=True),
+    Column("file_type", String, nullable=True),
+    Column("file_name", String, nullable=True),
+    Column("file_size", Integer, nullable=True),
+    Column("thumbnail_url", String, nullable=True),
+    Column("preview_url", String, nullable=True),
+    Column("status", String, nullable=True),
+    Column("created_at", DateTime(timezone=True), nullable=True),
+    Column("archived_at", DateTime(timezone=True), server_default=func.now()),
+    Index("ix_messages_archive_conversation_id_id", "conversation_id", "id"),
+)
+
+async def upgrade(ctx):
+    await ctx.add_column("groups", "retention_days", "INTEGER")
+    await ctx.run_sync(lambda conn: messages_archive.create(conn, checkfirst=True))
+    await ctx.create_index("ix_messages_created_at", "messages", ["created_at"])
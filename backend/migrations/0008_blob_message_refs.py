@@ -0,0 +1,38 @@
+"""Count blob references from messages and profiles instead of uploads"""
+from sqlalchemy import Column, Integer, MetaData, String, Table, func, select, update
+
+# Frozen copies of the columns this migration reads and writes
+metadata = MetaData()
+blobs = Table(
+    "blobs", metadata,
+    Column("digest", String, primary_key=True),
+    Column("path", String),
+    Column("ref_count", Integer),
+)
+referencing_columns = [
+    Table("messages", metadata, Column("id", Integer, primary_key=True), Column("file_url", String)).c.file_url,
+    Table("messages_archive", metadata, Column("id", Integer, primary_key=True), Column("file_url", String)).c.file_url,
+    Table("users", metadata, Column("id", Integer, primary_key=True), Column("profile_photo_url", String)).c.profile_photo_url,
+]
+
+# Upload URLs as of this migration: /uploads/<path>, blob paths under blobs/
+UPLOADS_URL_PREFIX = "/uploads/"
+
+async def _recount(conn) -> int:
+    counts = {}
+    for column in referencing_columns:
+        result = await conn.execute(
+            select(column, func.count()).where(column.like(UPLOADS_URL_PREFIX + "blobs/%")).group_by(column)
+        )
+        for url, count in result.all():
+            path = url[len(UPLOADS_URL_PREFIX):]
+            counts[path] = counts.get(path, 0) + count
+    await conn.execute(update(blobs).values(ref_count=0))
+    for path, count in counts.items():
+        await conn.execute(update(blobs).where(blobs.c.path == path).values(ref_count=count))
+    return len(counts)
+
+async def upgrade(ctx):
+    async with ctx.engine.begin() as conn:
+        total = await _recount(conn)
+    print(f"🔁 Recounted references of {total} blobs")
@@ -0,0 +1,17 @@
+"""Replace the generated content_tsv column with a GIN expression index"""
+
+async def upgrade(ctx):
+    if ctx.dialect != "postgresql":
+        return
+    # Databases that ran the first 0005 have the column; fresh ones already have the index
+    await ctx.create_index(
+        "ix_messages_content_fts", "messages", ["to_tsvector('simple', coalesce(content, ''))"], using="gin"
+    )
+    if await ctx.is_partitioned("messages"):
+        await ctx.execute("DROP INDEX IF EXISTS ix_messages_content_tsv")
+    else:
+        async with ctx.engine.connect() as conn:
+            conn = await conn.execution_options(isolation_level="AUTOCOMMIT")
+            await conn.exec_driver_sql("DROP INDEX CONCURRENTLY IF EXISTS ix_messages_content_tsv")
+    # Dropping a column only updates the catalog; rows aren't rewritten
+    await ctx.execute("ALTER TABLE messages DROP COLUMN IF EXISTS content_tsv")
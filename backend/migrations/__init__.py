@@ -0,0 +1,16 @@
+"""
+Versioned schema migrations, applied in order by backend/migrate.py
+
+Each module is named <version>_<name>.py and defines
+`async def upgrade(ctx)`, where ctx is a migrate.MigrationContext; the
+first docstring line is recorded as its description.
+
+Migrations are frozen once released: table definitions and any helper
+logic (key formats, backfill rules) are copied into the migration rather
+than imported from backend.models or backend.crud, so a fresh database
+is built by replaying every step, and a schema change is a new migration.
+They must also be safe to re-run, since a version is recorded only after
+its upgrade() finishes and databases from before versioning already have
+the initial tables. Use ctx.add_column / ctx.create_index (IF NOT EXISTS,
+CONCURRENTLY on Postgres) and ctx.backfill for data changes in batches.
+"""
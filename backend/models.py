@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Text, Enum, Boolean
+from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Text, Enum, Boolean, Index
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
 import enum
@@ -15,6 +15,8 @@ class MessageStatus(str, enum.Enum):
 
 class User(Base):
     __tablename__ = "users"
+    # Fetch server-generated columns (created_at, ...) with RETURNING during the flush
+    __mapper_args__ = {"eager_defaults": True}
 
     id = Column(Integer, primary_key=True, index=True)
     email = Column(String, unique=True, index=True, nullable=False)
@@ -25,6 +27,7 @@ class User(Base):
     display_name = Column(String, nullable=True)
     about = Column(String, nullable=True, default="Hey there! I am using E-Chat")
     profile_photo_url = Column(String, nullable=True)
+    profile_thumbnail_url = Column(String, nullable=True)
     theme_preference = Column(String, nullable=True, default="light")  # light, dark, system
     last_seen = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
     
@@ -39,16 +42,20 @@ class Contact(Base):
 
     id = Column(Integer, primary_key=True, index=True)
     owner_id = Column(Integer, ForeignKey("users.id"), nullable=False)
-    contact_user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    contact_user_id = Column(Integer, ForeignKey("users.id"), nullable=False, index=True)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
 
 class Group(Base):
     __tablename__ = "groups"
+    # Fetch server-generated columns (created_at, ...) with RETURNING during the flush
+    __mapper_args__ = {"eager_defaults": True}
     
     id = Column(Integer, primary_key=True, index=True)
     name = Column(String, nullable=False)
     admin_id = Column(Integer, ForeignKey("users.id"), nullable=False)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
+    # Days to keep messages; None follows MESSAGE_RETENTION_DAYS, 0 keeps them forever
+    retention_days = Column(Integer, nullable=True)
 
 class GroupMember(Base):
     __tablename__ = "group_members"
@@ -60,6 +67,8 @@ class GroupMember(Base):
 
 class Message(Base):
     __tablename__ = "messages"
+    # Fetch server-generated columns (created_at, ...) with RETURNING during the flush
+    __mapper_args__ = {"eager_defaults": True}
 
     id = Column(Integer, primary_key=True, index=True)
     sender_id = Column(Integer, ForeignKey("users.id"), nullable=False)
@@ -68,6 +77,9 @@ class Message(Base):
     receiver_id = Column(Integer, ForeignKey("users.id"), nullable=True) 
     group_id = Column(Integer, ForeignKey("groups.id"), nullable=True)
 
+    # Denormalized conversation key ("u:<low>:<high>" or "g:<group_id>"), see crud.conversation_key
+    conversation_id = Column(String, nullable=True)
+
     content = Column(Text, nullable=True) # Text content (nullable if file only)
     
     # File Metadata
@@ -75,6 +87,8 @@ class Message(Base):
     file_type = Column(String, nullable=True) # image/png, application/pdf
     file_name = Column(String, nullable=True)
     file_size = Column(Integer, nullable=True) # bytes
+    thumbnail_url = Column(String, nullable=True) # resized variants of image files
+    preview_url = Column(String, nullable=True)
 
     status = Column(String, default="sent") # sent, delivered, read
     created_at = Column(DateTime(timezone=True), server_default=func.now())
@@ -82,6 +96,69 @@ class Message(Base):
     sender = relationship("User", foreign_keys=[sender_id], back_populates="sent_messages")
     receiver = relationship("User", foreign_keys=[receiver_id], back_populates="received_messages")
 
+    __table_args__ = (
+        # Keyset pagination over a group / 1:1 conversation is an index range scan
+        Index("ix_messages_group_id_id", "group_id", "id"),
+        Index("ix_messages_sender_receiver_id", "sender_id", "receiver_id", "id"),
+        Index("ix_messages_conversation_id_id", "conversation_id", "id"),
+        # Retention finds expired messages by age
+        Index("ix_messages_created_at", "created_at"),
+    )
+
+class MessageArchive(Base):
+    __tablename__ = "messages_archive"
+
+    # Messages moved out of the hot table by the retention job (RETENTION_ARCHIVE=table).
+    # Same columns as messages, without foreign keys, plus when it was archived
+    id = Column(Integer, primary_key=True)
+    sender_id = Column(Integer, nullable=False)
+    receiver_id = Column(Integer, nullable=True)
+    group_id = Column(Integer, nullable=True)
+    conversation_id = Column(String, nullable=True)
+    content = Column(Text, nullable=True)
+    file_url = Column(String, nullable=True)
+    file_type = Column(String, nullable=True)
+    file_name = Column(String, nullable=True)
+    file_size = Column(Integer, nullable=True)
+    thumbnail_url = Column(String, nullable=True)
+    preview_url = Column(String, nullable=True)
+    status = Column(String, nullable=True)
+    created_at = Column(DateTime(timezone=True), nullable=True)
+    archived_at = Column(DateTime(timezone=True), server_default=func.now())
+
+    __table_args__ = (
+        Index("ix_messages_archive_conversation_id_id", "conversation_id", "id"),
+    )
+
+class ConversationSummary(Base):
+    __tablename__ = "conversation_summaries"
+
+    # One row per user per conversation, kept up to date as messages arrive,
+    # so the chat list is a single index scan instead of a scan of all history
+    user_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    conversation_id = Column(String, primary_key=True)  # see crud.conversation_key
+    peer_user_id = Column(Integer, ForeignKey("users.id"), nullable=True)  # 1:1 chats
+    group_id = Column(Integer, ForeignKey("groups.id"), nullable=True)
+    last_message_id = Column(Integer, nullable=False)
+    last_sender_id = Column(Integer, nullable=True)
+    snippet = Column(String, nullable=True)
+    unread_count = Column(Integer, nullable=False, default=0)
+    updated_at = Column(DateTime(timezone=True), server_default=func.now())
+
+    __table_args__ = (
+        # Newest conversations first, paged by last_message_id
+        Index("ix_conversation_summaries_user_id_last_message_id", "user_id", "last_message_id"),
+    )
+
+class MessageReceipt(Base):
+    __tablename__ = "message_receipts"
+
+    # Per-recipient delivery/read state; Message.status can't describe a group
+    message_id = Column(Integer, ForeignKey("messages.id"), primary_key=True)
+    user_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    delivered_at = Column(DateTime(timezone=True), nullable=False)
+    read_at = Column(DateTime(timezone=True), nullable=True)
+
 class OTP(Base):
     __tablename__ = "otps"
     
@@ -103,3 +180,35 @@ class CallHistory(Base):
     started_at = Column(DateTime(timezone=True), server_default=func.now())
     ended_at = Column(DateTime(timezone=True), nullable=True)
 
+
+class Blob(Base):
+    __tablename__ = "blobs"
+
+    # Uploaded files are stored once per content hash and shared by reference
+    digest = Column(String, primary_key=True)  # sha256 hex
+    path = Column(String, nullable=False, unique=True)  # relative to the uploads directory
+    size = Column(Integer, nullable=False)
+    content_type = Column(String, nullable=True)
+    ref_count = Column(Integer, nullable=False, default=0)  # messages, archived messages and profiles using it
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+class ChangeLog(Base):
+    __tablename__ = "change_log"
+
+    # Append-only feed of everything a reconnecting client may have missed;
+    # the id is the cursor clients pass to /chat/sync
+    id = Column(Integer, primary_key=True, index=True)
+    kind = Column(String, nullable=False)  # message, status, membership
+    actor_id = Column(Integer, nullable=True)  # user who caused the change
+    user_id = Column(Integer, nullable=True)  # user it is addressed to
+    group_id = Column(Integer, nullable=True)  # or every member of this group
+    message_id = Column(Integer, nullable=True)
+    payload = Column(Text, nullable=True)  # JSON details, e.g. {"status": "read"}
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+    __table_args__ = (
+        # A user's feed is the union of these three range scans
+        Index("ix_change_log_user_id_id", "user_id", "id"),
+        Index("ix_change_log_actor_id_id", "actor_id", "id"),
+        Index("ix_change_log_group_id_id", "group_id", "id"),
+    )
@@ -0,0 +1,182 @@
+"""
+Presence tracking for connected users
+
+Each Socket.IO session is stored with an expiry time. The worker holding
+a session refreshes it on every heartbeat tick, so sessions left behind
+by a crashed or restarted worker expire on their own and their users are
+reported offline by the sweeper.
+
+Select the backend with PRESENCE_STORE_URL:
+    (unset)           in-memory, only correct for a single worker
+    redis://host:port shared across workers (requires the `redis` package)
+"""
+import os
+import time
+from abc import ABC, abstractmethod
+from typing import Dict, Iterable, List, Set
+
+PRESENCE_STORE_URL = os.getenv("PRESENCE_STORE_URL", "")
+PRESENCE_TTL_SECONDS = int(os.getenv("PRESENCE_TTL_SECONDS", "60"))
+PRESENCE_HEARTBEAT_SECONDS = int(os.getenv("PRESENCE_HEARTBEAT_SECONDS", "20"))
+
+class PresenceStore(ABC):
+    """Where session liveness is recorded"""
+
+    def __init__(self, ttl: int = PRESENCE_TTL_SECONDS):
+        self.ttl = ttl
+
+    @abstractmethod
+    async def add_session(self, user_id: int, sid: str) -> bool:
+        """Register a session. Returns True if the user just came online."""
+
+    @abstractmethod
+    async def heartbeat(self, user_id: int, sids: Iterable[str]):
+        """Push the expiry of live sessions forward"""
+
+    @abstractmethod
+    async def remove_session(self, user_id: int, sid: str) -> bool:
+        """Drop a session. Returns True if the user just went offline."""
+
+    @abstractmethod
+    async def get_online(self, user_ids: Iterable[int]) -> Set[int]:
+        """Return the subset of user_ids with at least one live session"""
+
+    @abstractmethod
+    async def sweep(self) -> List[int]:
+        """Drop expired sessions. Returns users left with no live session."""
+
+    async def is_online(self, user_id: int) -> bool:
+        return user_id in await self.get_online([user_id])
+
+class MemoryPresenceStore(PresenceStore):
+    """Process-local presence store"""
+
+    def __init__(self, ttl: int = PRESENCE_TTL_SECONDS):
+        super().__init__(ttl)
+        # user_id -> {sid: expires_at}
+        self._sessions: Dict[int, Dict[str, float]] = {}
+
+    async def add_session(self, user_id: int, sid: str) -> bool:
+        now = time.time()
+        sessions = self._sessions.setdefault(user_id, {})
+        # Expired sessions the sweeper hasn't reached yet don't keep the user online
+        for stale in [stale for stale, expires_at in sessions.items() if expires_at <= now]:
+            del sessions[stale]
+        came_online = not sessions
+        sessions[sid] = now + self.ttl
+        return came_online
+
+    async def heartbeat(self, user_id: int, sids: Iterable[str]):
+        sessions = self._sessions.setdefault(user_id, {})
+        expires_at = time.time() + self.ttl
+        for sid in sids:
+            sessions[sid] = expires_at
+
+    async def remove_session(self, user_id: int, sid: str) -> bool:
+        sessions = self._sessions.get(user_id)
+        if not sessions or sid not in sessions:
+            return False
+        del sessions[sid]
+        if sessions:
+            return False
+        del self._sessions[user_id]
+        return True
+
+    async def get_online(self, user_ids: Iterable[int]) -> Set[int]:
+        now = time.time()
+        return {
+            user_id for user_id in user_ids
+            if any(expires_at > now for expires_at in self._sessions.get(user_id, {}).values())
+        }
+
+    async def sweep(self) -> List[int]:
+        now = time.time()
+        offline = []
+        for user_id in list(self._sessions):
+            sessions = self._sessions[user_id]
+            for sid in [sid for sid, expires_at in sessions.items() if expires_at <= now]:
+                del sessions[sid]
+            if not sessions:
+                del self._sessions[user_id]
+                offline.append(user_id)
+        return offline
+
+class RedisPresenceStore(PresenceStore):
+    """Presence shared between workers through Redis.
+
+    Each user has a sorted set of sids scored by expiry time, and a global
+    sorted set scores users by their latest expiry so the sweeper only
+    looks at users that may have expired.
+    """
+    USERS_KEY = "presence:users"
+
+    def __init__(self, url: str, ttl: int = PRESENCE_TTL_SECONDS):
+        super().__init__(ttl)
+        import redis.asyncio as redis
+        self.redis = redis.from_url(url)
+
+    def _key(self, user_id: int) -> str:
+        return f"presence:user:{user_id}"
+
+    async def _live_count(self, user_id: int, now: float) -> int:
+        return await self.redis.zcount(self._key(user_id), now, "+inf")
+
+    async def add_session(self, user_id: int, sid: str) -> bool:
+        now = time.time()
+        came_online = await self._live_count(user_id, now) == 0
+        await self.heartbeat(user_id, [sid])
+        return came_online
+
+    async def heartbeat(self, user_id: int, sids: Iterable[str]):
+        expires_at = time.time() + self.ttl
+        mapping = {sid: expires_at for sid in sids}
+        if not mapping:
+            return
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.zadd(self._key(user_id), mapping)
+            pipe.zadd(self.USERS_KEY, {str(user_id): expires_at}, gt=True)
+            await pipe.execute()
+
+    async def remove_session(self, user_id: int, sid: str) -> bool:
+        removed = await self.redis.zrem(self._key(user_id), sid)
+        if not removed:
+            return False
+        if await self._live_count(user_id, time.time()) > 0:
+            return False
+        # Only the worker that actually removes the user reports them offline
+        return bool(await self.redis.zrem(self.USERS_KEY, str(user_id)))
+
+    async def get_online(self, user_ids: Iterable[int]) -> Set[int]:
+        user_ids = list(user_ids)
+        if not user_ids:
+            return set()
+        now = time.time()
+        async with self.redis.pipeline(transaction=False) as pipe:
+            for user_id in user_ids:
+                pipe.zcount(self._key(user_id), now, "+inf")
+            counts = await pipe.execute()
+        return {user_id for user_id, count in zip(user_ids, counts) if count}
+
+    async def sweep(self) -> List[int]:
+        now = time.time()
+        offline = []
+        candidates = await self.redis.zrangebyscore(self.USERS_KEY, "-inf", now)
+        for raw_id in candidates:
+            user_id = int(raw_id)
+            await self.redis.zremrangebyscore(self._key(user_id), "-inf", now)
+            if await self._live_count(user_id, now) > 0:
+                continue
+            if await self.redis.zrem(self.USERS_KEY, raw_id):
+                offline.append(user_id)
+        return offline
+
+def create_presence_store(url: str = None) -> PresenceStore:
+    """Build the presence store for PRESENCE_STORE_URL"""
+    url = PRESENCE_STORE_URL if url is None else url
+    if not url:
+        return MemoryPresenceStore()
+    if url.startswith(("redis://", "rediss://", "unix://")):
+        return RedisPresenceStore(url)
+    raise ValueError(f"Unsupported PRESENCE_STORE_URL: {url}")
+
+presence_store: PresenceStore = create_presence_store()
@@ -0,0 +1,88 @@
+"""
+Delivery and read receipt aggregation
+
+Clients ack the messages they receive (and read) in batches with the
+`messages_ack` socket event; each ack batch is one INSERT ... ON CONFLICT
+into message_receipts. Rather than telling a sender about every member of
+every group one by one, acked message ids are collected for
+RECEIPT_WINDOW_MS and each sender then gets one `message_receipts` event
+with the current delivered/read counts of their messages.
+"""
+import asyncio
+import logging
+import os
+from typing import Awaitable, Callable, Dict, List, Optional, Set
+
+from . import crud, database
+
+logger = logging.getLogger(__name__)
+
+RECEIPT_WINDOW_MS = int(os.getenv("RECEIPT_WINDOW_MS", "250"))
+MAX_ACK_IDS = 500
+
+class ReceiptAggregator:
+    """Collects acked message ids and reports receipt counts to senders once per window"""
+
+    def __init__(
+        self,
+        notify: Optional[Callable[[int, List[dict]], Awaitable[None]]] = None,
+        session_factory=None,
+        window_ms: int = RECEIPT_WINDOW_MS
+    ):
+        # notify(sender_id, [{message_id, delivered, read}]), set up by chat_manager
+        self.notify = notify
+        self.session_factory = session_factory
+        self.window = window_ms / 1000
+        self._dirty: Set[int] = set()
+        self._task: Optional[asyncio.Task] = None
+        self.windows = 0
+        self.notifications = 0
+
+    def add(self, message_ids):
+        """Report receipt changes of these messages at the end of the current window"""
+        self._dirty.update(message_ids)
+        if self._dirty and (self._task is None or self._task.done()):
+            self._task = asyncio.create_task(self._flush_later())
+
+    async def _flush_later(self):
+        await asyncio.sleep(self.window)
+        # Ids acked while flushing open a new window
+        self._task = None
+        try:
+            await self.flush()
+        except Exception as e:
+            logger.error(f"Receipt flush failed: {e}", exc_info=True)
+
+    async def flush(self):
+        message_ids, self._dirty = self._dirty, set()
+        if not message_ids or self.notify is None:
+            return
+        session_factory = self.session_factory or database.SessionLocal
+        async with session_factory() as db:
+            counts = await crud.get_receipt_counts(db, message_ids)
+
+        by_sender: Dict[int, List[dict]] = {}
+        for message_id, sender_id, delivered, read in counts:
+            by_sender.setdefault(sender_id, []).append(
+                {"message_id": message_id, "delivered": delivered, "read": read}
+            )
+        self.windows += 1
+        for sender_id, receipts in by_sender.items():
+            await self.notify(sender_id, receipts)
+            self.notifications += 1
+
+    async def close(self):
+        """Report whatever is pending now instead of waiting out the window"""
+        if self._task is not None and not self._task.done():
+            self._task.cancel()
+            self._task = None
+        await self.flush()
+
+    def stats(self) -> dict:
+        return {
+            "pending": len(self._dirty),
+            "windows": self.windows,
+            "notifications": self.notifications,
+        }
+
+receipt_aggregator = ReceiptAggregator()
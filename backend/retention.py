@@ -0,0 +1,397 @@
+"""
+Retention for messages, call history, the change log and OTPs
+
+Without it these tables grow forever and the hot queries in crud slow
+down with them. Policies, all in days (0 = keep forever):
+
+- MESSAGE_RETENTION_DAYS: global message lifetime. A group's
+  retention_days (PUT /chat/groups/{id}/retention) overrides it.
+- CALL_HISTORY_RETENTION_DAYS and CHANGE_LOG_RETENTION_DAYS. Clients
+  whose sync cursor predates the pruned change log are told to reload.
+- OTPs are deleted once used or expired.
+
+Expired messages are handled in batches of RETENTION_BATCH_SIZE, one
+transaction each, so locks stay short. RETENTION_ARCHIVE decides where
+they go: the messages_archive table ("table"), gzipped NDJSON files in
+RETENTION_ARCHIVE_DIR in the backend.archive format ("file"), or nowhere
+("none"). Attachments are only kept with the table archive.
+
+    python -m backend.retention run          # one pass, e.g. from cron
+    python -m backend.retention partition    # Postgres: partition messages by month
+
+Workers also run a pass every RETENTION_INTERVAL_SECONDS when it is set.
+On Postgres an advisory lock lets one pass run at a time. SQLite has no
+such lock, so run passes from a single process there; an overlapping
+pass is still safe for the table archive (already archived rows are
+skipped), but may write the same messages to two archive files.
+
+On Postgres, `partition` turns messages into a table partitioned by month
+on created_at, so recent messages live in small partitions that stay in
+cache. It rewrites the table under an exclusive lock; run it in a
+maintenance window. The existing rows become one "legacy" partition,
+foreign keys pointing at messages are dropped (a partitioned table's
+unique keys must include created_at), and each pass then creates
+partitions ahead of time and drops old ones the retention has emptied.
+"""
+import argparse
+import asyncio
+import gzip
+import logging
+import os
+from contextlib import asynccontextmanager
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from typing import Optional
+
+from sqlalchemy import and_, delete, or_, select, text
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession
+
+from . import archive, crud, database, models
+
+logger = logging.getLogger(__name__)
+
+MESSAGE_RETENTION_DAYS = int(os.getenv("MESSAGE_RETENTION_DAYS", "0"))
+CALL_HISTORY_RETENTION_DAYS = int(os.getenv("CALL_HISTORY_RETENTION_DAYS", "0"))
+CHANGE_LOG_RETENTION_DAYS = int(os.getenv("CHANGE_LOG_RETENTION_DAYS", "30"))
+RETENTION_ARCHIVE = os.getenv("RETENTION_ARCHIVE", "table")  # table, file or none
+RETENTION_ARCHIVE_DIR = Path(os.getenv("RETENTION_ARCHIVE_DIR", "backend/archive"))
+RETENTION_BATCH_SIZE = int(os.getenv("RETENTION_BATCH_SIZE", "1000"))
+RETENTION_INTERVAL_SECONDS = int(os.getenv("RETENTION_INTERVAL_SECONDS", "0"))
+# Monthly partitions created ahead of the current month
+PARTITION_MONTHS_AHEAD = 3
+# pg_advisory_lock key held by a retention pass ("echatr" in ASCII)
+RETENTION_LOCK_KEY = 0x656368617472
+
+ARCHIVE_MODES = ("table", "file", "none")
+
+def _month_start(moment: datetime, months_ahead: int = 0) -> datetime:
+    month = moment.month - 1 + months_ahead
+    return datetime(moment.year + month // 12, month % 12 + 1, 1, tzinfo=timezone.utc)
+
+class RetentionJob:
+    """Applies the retention policies in batches; see the module docstring"""
+
+    def __init__(
+        self,
+        session_factory=None,
+        message_days: int = MESSAGE_RETENTION_DAYS,
+        call_history_days: int = CALL_HISTORY_RETENTION_DAYS,
+        change_log_days: int = CHANGE_LOG_RETENTION_DAYS,
+        archive_mode: str = RETENTION_ARCHIVE,
+        archive_dir: Path = RETENTION_ARCHIVE_DIR,
+        batch_size: int = RETENTION_BATCH_SIZE
+    ):
+        if archive_mode not in ARCHIVE_MODES:
+            raise ValueError(f"RETENTION_ARCHIVE must be one of {', '.join(ARCHIVE_MODES)}")
+        self.session_factory = session_factory
+        self.message_days = message_days
+        self.call_history_days = call_history_days
+        self.change_log_days = change_log_days
+        self.archive_mode = archive_mode
+        self.archive_dir = Path(archive_dir)
+        self.batch_size = batch_size
+        self.runs = 0
+        self.last_run_at: Optional[datetime] = None
+        self.last_result: dict = {}
+
+    async def run(self, now: Optional[datetime] = None) -> dict:
+        """One pass over every policy; returns rows removed per table"""
+        now = now or datetime.now(timezone.utc)
+        session_factory = self.session_factory or database.SessionLocal
+        result = {}
+        async with session_factory() as db:
+            async with _pass_lock(db.bind) as acquired:
+                if not acquired:
+                    logger.info("Retention pass skipped: another worker is running one")
+                    return result
+                result["messages"] = await self._expire_messages(db, now)
+                if self.call_history_days > 0:
+                    result["call_history"] = await self._prune_oldest(
+                        db, models.CallHistory.__table__, models.CallHistory.started_at,
+                        now - timedelta(days=self.call_history_days)
+                    )
+                if self.change_log_days > 0:
+                    result["change_log"] = await self._prune_oldest(
+                        db, models.ChangeLog.__table__, models.ChangeLog.created_at,
+                        now - timedelta(days=self.change_log_days), keep_newest=True
+                    )
+                result["otps"] = await self._delete_otps(db, now)
+                if await is_partitioned(db):
+                    await ensure_partitions(db, now)
+                    result["partitions_dropped"] = await drop_empty_partitions(db, now)
+
+        self.runs += 1
+        self.last_run_at = now
+        self.last_result = result
+        return result
+
+    async def run_forever(self, interval_seconds: int = RETENTION_INTERVAL_SECONDS):
+        while True:
+            await asyncio.sleep(interval_seconds)
+            try:
+                result = await self.run()
+                logger.info(f"Retention pass: {result}")
+            except Exception as e:
+                logger.error(f"Retention pass failed: {e}", exc_info=True)
+
+    async def _message_policies(self, db: AsyncSession, now: datetime) -> list:
+        """(cutoff, filter) pairs together covering every message with a finite lifetime"""
+        groups = models.Group
+        result = await db.execute(
+            select(groups.retention_days).where(groups.retention_days > 0).distinct()
+        )
+        policies = [
+            (now - timedelta(days=days), models.Message.group_id.in_(
+                select(groups.id).where(groups.retention_days == days)
+            ))
+            for days in result.scalars().all()
+        ]
+        if self.message_days > 0:
+            overridden = select(groups.id).where(groups.retention_days.is_not(None))
+            policies.append((now - timedelta(days=self.message_days), or_(
+                models.Message.group_id.is_(None), models.Message.group_id.not_in(overridden)
+            )))
+        return policies
+
+    async def _expire_messages(self, db: AsyncSession, now: datetime) -> int:
+        total = 0
+        out = None
+        try:
+            for cutoff, policy in await self._message_policies(db, now):
+                expired = and_(policy, models.Message.created_at < cutoff)
+                while True:
+                    result = await db.execute(
+                        select(models.Message.__table__).where(expired)
+                        .order_by(models.Message.id).limit(self.batch_size)
+                    )
+                    rows = result.mappings().all()
+                    if not rows:
+                        break
+                    ids = [row["id"] for row in rows]
+
+                    if self.archive_mode == "table":
+                        await crud.archive_messages(db, [dict(row) for row in rows])
+                    elif self.archive_mode == "file":
+                        if out is None:
+                            out = self._open_archive_file(now)
+                        for row in rows:
+                            out.write(archive.archive_line({"table": "messages", "row": dict(row)}))
+                        out.flush()
+
+                    await db.execute(delete(models.MessageReceipt).where(models.MessageReceipt.message_id.in_(ids)))
+                    # created_at lets Postgres skip partitions that can't hold these rows
+                    deleted = await db.execute(delete(models.Message).where(
+                        models.Message.id.in_(ids), models.Message.created_at < cutoff
+                    ).returning(models.Message.file_url))
+                    if self.archive_mode != "table":
+                        # Archived rows still point at their files; deleted ones let go.
+                        # Only rows this pass deleted count, so an overlapping pass can't release twice
+                        await crud.change_blob_refs_for_urls(db, deleted.scalars().all(), -1)
+                    # The chat list must not keep showing expired text
+                    await crud.refresh_summaries(db, {row["conversation_id"] for row in rows})
+                    await db.commit()
+                    total += len(ids)
+
+                    if len(rows) < self.batch_size:
+                        break
+        finally:
+            if out is not None:
+                out.close()
+        return total
+
+    def _open_archive_file(self, now: datetime):
+        self.archive_dir.mkdir(parents=True, exist_ok=True)
+        path = self.archive_dir / f"messages-{now:%Y%m%dT%H%M%S}.ndjson.gz"
+        out = gzip.open(path, "at", encoding="utf-8")
+        out.write(archive.archive_line(archive.archive_header("retention")))
+        logger.info(f"Archiving expired messages to {path}")
+        return out
+
+    async def _prune_oldest(self, db: AsyncSession, table, time_column, cutoff: datetime, keep_newest: bool = False) -> int:
+        """Delete rows older than cutoff from a table whose ids grow with time.
+
+        Walks the primary key from the oldest row and stops at the first one
+        that is still young enough, so no index on the timestamp is needed.
+        With keep_newest the last row always stays: SQLite would hand its id
+        out again, and the change log id is the clients' sync cursor.
+        """
+        newest_id = await db.scalar(select(table.c.id).order_by(table.c.id.desc()).limit(1)) if keep_newest else None
+        total = 0
+        while True:
+            result = await db.execute(
+                select(table.c.id, time_column < cutoff).order_by(table.c.id).limit(self.batch_size)
+            )
+            ids = []
+            for row_id, expired in result.all():
+                if not expired or row_id == newest_id:
+                    break
+                ids.append(row_id)
+            if ids:
+                await db.execute(delete(table).where(table.c.id.in_(ids)))
+                await db.commit()
+                total += len(ids)
+            if len(ids) < self.batch_size:
+                return total
+
+    async def _delete_otps(self, db: AsyncSession, now: datetime) -> int:
+        otps = models.OTP
+        # expires_at is stored without a time zone, in UTC
+        stale = select(otps.id).where(
+            or_(otps.is_used.is_(True), otps.expires_at < now.replace(tzinfo=None))
+        ).limit(self.batch_size)
+        total = 0
+        while True:
+            result = await db.execute(delete(otps).where(otps.id.in_(stale)))
+            await db.commit()
+            total += result.rowcount
+            if result.rowcount < self.batch_size:
+                return total
+
+    def stats(self) -> dict:
+        return {
+            "runs": self.runs,
+            "last_run_at": self.last_run_at.isoformat() if self.last_run_at else None,
+            "last_result": self.last_result,
+        }
+
+@asynccontextmanager
+async def _pass_lock(engine: AsyncEngine):
+    """Yields whether this process may run a pass; one at a time across workers on Postgres"""
+    if engine.dialect.name != "postgresql":
+        # No cross-process lock; overlapping passes are tolerated, see the module docstring
+        yield True
+        return
+    async with engine.connect() as conn:
+        conn = await conn.execution_options(isolation_level="AUTOCOMMIT")
+        acquired = await conn.scalar(text("SELECT pg_try_advisory_lock(:key)"), {"key": RETENTION_LOCK_KEY})
+        try:
+            yield acquired
+        finally:
+            if acquired:
+                await conn.execute(text("SELECT pg_advisory_unlock(:key)"), {"key": RETENTION_LOCK_KEY})
+
+# --- Postgres partitioning ---
+async def is_partitioned(db) -> bool:
+    """Whether messages is a partitioned table (Postgres only)"""
+    if db.bind.dialect.name != "postgresql":
+        return False
+    relkind = await db.scalar(text("SELECT relkind FROM pg_class WHERE oid = 'messages'::regclass"))
+    return relkind == "p"
+
+def _partition_name(month: datetime) -> str:
+    return f"messages_p{month:%Y%m}"
+
+async def ensure_partitions(db, now: datetime, months_ahead: int = PARTITION_MONTHS_AHEAD):
+    """Create the monthly partitions after the current month that don't exist yet.
+
+    Partitions are created before any row can land in them; a month that
+    has already started is covered by its partition from an earlier pass,
+    or by the legacy or default partition.
+    """
+    for ahead in range(1, months_ahead + 1):
+        start, end = _month_start(now, ahead), _month_start(now, ahead + 1)
+        await db.execute(text(
+            f"CREATE TABLE IF NOT EXISTS {_partition_name(start)} PARTITION OF messages "
+            f"FOR VALUES FROM ('{start.isoformat()}') TO ('{end.isoformat()}')"
+        ))
+    await db.commit()
+
+async def drop_empty_partitions(db, now: datetime) -> int:
+    """Drop monthly (and the legacy) partitions before the current month that retention has emptied"""
+    result = await db.execute(text(
+        "SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+        "WHERE i.inhparent = 'messages'::regclass"
+    ))
+    current = _partition_name(_month_start(now))
+    dropped = 0
+    for name in result.scalars().all():
+        is_old_month = name.startswith("messages_p") and name < current
+        if not (is_old_month or name == "messages_legacy"):
+            continue
+        if await db.scalar(text(f"SELECT EXISTS (SELECT 1 FROM {name})")):
+            continue
+        await db.execute(text(f"DROP TABLE {name}"))
+        dropped += 1
+    await db.commit()
+    return dropped
+
+async def partition_messages(engine: AsyncEngine, now: Optional[datetime] = None) -> bool:
+    """Convert messages into a table partitioned by month; False if it already is"""
+    if engine.dialect.name != "postgresql":
+        raise NotImplementedError("Partitioning is only supported on Postgres")
+    from . import search
+
+    now = now or datetime.now(timezone.utc)
+    messages = models.Message.__table__
+    async with AsyncSession(engine) as db:
+        if await is_partitioned(db):
+            return False
+        await db.execute(text("LOCK TABLE messages IN ACCESS EXCLUSIVE MODE"))
+
+        # Unique keys of a partitioned table must include created_at, so nothing can reference messages(id)
+        result = await db.execute(text(
+            "SELECT conrelid::regclass::text, conname FROM pg_constraint "
+            "WHERE confrelid = 'messages'::regclass AND contype = 'f'"
+        ))
+        for table_name, constraint in result.all():
+            await db.execute(text(f'ALTER TABLE {table_name} DROP CONSTRAINT "{constraint}"'))
+
+        # Keep the existing rows and their indexes as the legacy partition
+        result = await db.execute(text("SELECT indexname FROM pg_indexes WHERE tablename = 'messages'"))
+        index_names = result.scalars().all()
+        await db.execute(text("ALTER TABLE messages RENAME TO messages_legacy"))
+        for name in index_names:
+            await db.execute(text(f'ALTER INDEX "{name}" RENAME TO "{name}_legacy"'))
+        await db.execute(text("UPDATE messages_legacy SET created_at = 'epoch' WHERE created_at IS NULL"))
+        await db.execute(text("ALTER TABLE messages_legacy ALTER COLUMN created_at SET NOT NULL"))
+
+        await db.execute(text(
+            "CREATE TABLE messages (LIKE messages_legacy INCLUDING DEFAULTS INCLUDING GENERATED) "
+            "PARTITION BY RANGE (created_at)"
+        ))
+        await db.execute(text("ALTER TABLE messages ADD PRIMARY KEY (id, created_at)"))
+        # The id sequence must outlive the legacy partition
+        await db.execute(text(
+            "ALTER SEQUENCE IF EXISTS messages_id_seq OWNED BY messages.id"
+        ))
+        for fk in messages.foreign_keys:
+            await db.execute(text(
+                f"ALTER TABLE messages ADD FOREIGN KEY ({fk.parent.name}) "
+                f"REFERENCES {fk.column.table.name} ({fk.column.name})"
+            ))
+        # Created on the parent before attaching, so the legacy indexes are adopted instead of rebuilt
+        for index in messages.indexes:
+            columns = ", ".join(column.name for column in index.columns)
+            await db.execute(text(f"CREATE INDEX {index.name} ON messages ({columns})"))
+        await db.run_sync(lambda session: search.ensure_search_index(session.connection()))
+
+        await db.execute(text(
+            f"ALTER TABLE messages ATTACH PARTITION messages_legacy "
+            f"FOR VALUES FROM (MINVALUE) TO ('{_month_start(now, 1).isoformat()}')"
+        ))
+        # Catches rows beyond the prepared months if passes stop running
+        await db.execute(text("CREATE TABLE messages_default PARTITION OF messages DEFAULT"))
+        await db.commit()
+        await ensure_partitions(db, now)
+    return True
+
+retention_job = RetentionJob()
+
+async def main():
+    parser = argparse.ArgumentParser(description="Apply E-Chat retention policies")
+    parser.add_argument("command", choices=["run", "partition"])
+    args = parser.parse_args()
+
+    try:
+        if args.command == "run":
+            result = await retention_job.run()
+            print(f"🧹 Retention pass removed: {result}")
+        elif await partition_messages(database.engine):
+            print("✅ messages is now partitioned by month")
+        else:
+            print("✅ messages is already partitioned")
+    finally:
+        await database.engine.dispose()
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -2,6 +2,7 @@ from fastapi import APIRouter, Depends, HTTPException, status
 from sqlalchemy.ext.asyncio import AsyncSession
 from datetime import datetime, timedelta, timezone
 from .. import schemas, database, crud, auth
+from ..hashing import password_hasher
 
 router = APIRouter(prefix="/auth", tags=["auth"])
 
@@ -16,7 +17,7 @@ async def signup(payload: schemas.UserCreate, db: AsyncSession = Depends(databas
         )
     
     # Create user
-    hashed_pw = auth.get_password_hash(payload.password)
+    hashed_pw = await password_hasher.hash(payload.password)
     new_user = await crud.create_user(db, payload.email, hashed_pw)
     
     # Login immediately
@@ -35,7 +36,7 @@ async def signup(payload: schemas.UserCreate, db: AsyncSession = Depends(databas
 @router.post("/login", response_model=schemas.Token)
 async def login(payload: schemas.UserLogin, db: AsyncSession = Depends(database.get_db)):
     user = await crud.get_user_by_email(db, payload.email)
-    if not user or not auth.verify_password(payload.password, user.password_hash):
+    if not user or not await password_hasher.verify(payload.password, user.password_hash):
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect email or password",
@@ -1,21 +1,15 @@
-from fastapi import APIRouter, Depends, WebSocket, WebSocketDisconnect, HTTPException, UploadFile, File
-import shutil
-import os
-import uuid
+from fastapi import APIRouter, Depends, WebSocket, WebSocketDisconnect, HTTPException, UploadFile, File, Query, Request
 from sqlalchemy.ext.asyncio import AsyncSession
-from typing import List
-from .. import schemas, database, models, auth, chat_manager, crud
+from typing import List, Optional
+from .. import schemas, database, models, auth, chat_manager, crud, uploads, sync, search
+from ..presence import presence_store
 import json 
 import logging
-from pathlib import Path
 
 router = APIRouter(prefix="/chat", tags=["chat"])
 logger = logging.getLogger(__name__)
 
-# File upload configuration  
-UPLOAD_DIR = Path("backend/uploads")
-UPLOAD_DIR.mkdir(parents=True, exist_ok=True)
-MAX_FILE_SIZE = 10 * 1024 * 1024  # 10MB
+# File upload configuration (size limit: MAX_UPLOAD_SIZE in uploads.py)
 ALLOWED_EXTENSIONS = {
     'image': ['.jpg', '.jpeg', '.png', '.gif', '.webp'],
     'document': ['.pdf', '.doc', '.docx', '.txt', '.xls', '.xlsx', '.ppt', '.pptx'],
@@ -23,6 +17,17 @@ ALLOWED_EXTENSIONS = {
     'audio': ['.mp3', '.wav', '.ogg', '.m4a']
 }
 
+# History pagination
+HISTORY_PAGE_SIZE = 50
+MAX_HISTORY_PAGE_SIZE = 200
+
+# Conversation list pagination
+CONVERSATIONS_PAGE_SIZE = 50
+MAX_CONVERSATIONS_PAGE_SIZE = 200
+
+# Bulk presence lookup
+MAX_PRESENCE_IDS = 500
+
 @router.get("/contacts", response_model=List[schemas.ContactResponse])
 async def get_contacts(
     current_user: dict = Depends(auth.get_current_user),
@@ -47,7 +52,9 @@ async def create_group(
     current_user: dict = Depends(auth.get_current_user),
     db: AsyncSession = Depends(database.get_db)
 ):
-    return await crud.create_group(db, payload.name, current_user["id"])
+    group = await crud.create_group(db, payload.name, current_user["id"])
+    await chat_manager.join_group_room(current_user["id"], group.id)
+    return group
 
 @router.get("/groups", response_model=List[schemas.GroupResponse])
 async def get_groups(
@@ -67,45 +74,165 @@ async def add_group_member(
     member = await crud.add_group_member(db, group_id, payload.email)
     if not member:
         raise HTTPException(400, "User not found or already in group")
+    await chat_manager.join_group_room(member.id, group_id)
     return member
 
+@router.put("/groups/{group_id}/retention", response_model=schemas.GroupResponse)
+async def set_group_retention(
+    group_id: int,
+    payload: schemas.GroupRetentionUpdate,
+    current_user: dict = Depends(auth.get_current_user),
+    db: AsyncSession = Depends(database.get_db)
+):
+    """Override how long this group's messages are kept (see backend/retention.py)"""
+    group = await crud.get_group(db, group_id)
+    if not group:
+        raise HTTPException(404, "Group not found")
+    if group.admin_id != current_user["id"]:
+        raise HTTPException(403, "Only the group admin can change retention")
+    return await crud.set_group_retention(db, group, payload.retention_days)
+
 @router.post("/upload")
 async def upload_file(
     file: UploadFile = File(...),
+    current_user: dict = Depends(auth.get_current_user),
+    db: AsyncSession = Depends(database.get_db)
+):
+    try:
+        return await uploads.save_upload(db, file)
+    except uploads.UploadTooLarge:
+        raise HTTPException(400, f"File too large. Max {uploads.MAX_UPLOAD_SIZE // (1024*1024)}MB")
+
+# --- Resumable uploads ---
+@router.post("/uploads", response_model=schemas.UploadSessionResponse)
+async def create_upload(
+    payload: schemas.UploadSessionCreate,
     current_user: dict = Depends(auth.get_current_user)
 ):
-    # Validate file size
-    file.file.seek(0, 2)
-    size = file.file.tell()
-    file.file.seek(0)
-    if size > MAX_FILE_SIZE:
-        raise HTTPException(400, f"File too large. Max {MAX_FILE_SIZE // (1024*1024)}MB")
-    
-    # Get file extension
-    ext = Path(file.filename).suffix.lower() if file.filename else '.bin'
-    
-    # Save file
-    filename = f"{uuid.uuid4()}{ext}"
-    file_path = UPLOAD_DIR / filename
-    
-    with open(file_path, "wb") as buffer:
-        shutil.copyfileobj(file.file, buffer)
-        
-    return {
-        "url": f"/uploads/{filename}",
-        "filename": file.filename,
-        "type": file.content_type,
-        "size": size
-    }
+    """Start a resumable upload"""
+    try:
+        session = await uploads.create_session(current_user["id"], payload.filename, payload.size, payload.content_type)
+    except uploads.UploadTooLarge:
+        raise HTTPException(413, f"File too large. Max {uploads.MAX_UPLOAD_SIZE // (1024*1024)}MB")
+    return {**session, "chunk_size": uploads.UPLOAD_CHUNK_SIZE}
+
+async def _get_upload_session(upload_id: str, user_id: int) -> dict:
+    session = await uploads.get_session(upload_id, user_id)
+    if not session:
+        raise HTTPException(404, "Upload not found")
+    return session
+
+@router.get("/uploads/{upload_id}", response_model=schemas.UploadSessionResponse)
+async def get_upload(
+    upload_id: str,
+    current_user: dict = Depends(auth.get_current_user)
+):
+    """Current offset of a resumable upload, to resume after a dropped connection"""
+    session = await _get_upload_session(upload_id, current_user["id"])
+    return {**session, "chunk_size": uploads.UPLOAD_CHUNK_SIZE}
+
+@router.put("/uploads/{upload_id}", response_model=schemas.UploadSessionResponse)
+async def put_upload_chunk(
+    upload_id: str,
+    request: Request,
+    offset: int = Query(..., ge=0),
+    current_user: dict = Depends(auth.get_current_user)
+):
+    """Append the raw request body at `offset`"""
+    session = await _get_upload_session(upload_id, current_user["id"])
+    try:
+        session["offset"] = await uploads.append_chunk(session, offset, request.stream())
+    except uploads.UploadOffsetMismatch as e:
+        raise HTTPException(409, f"Upload is at offset {e.expected}")
+    except uploads.UploadTooLarge:
+        raise HTTPException(413, "Chunk goes past the declared upload size")
+    return {**session, "chunk_size": uploads.UPLOAD_CHUNK_SIZE}
+
+@router.post("/uploads/{upload_id}/complete")
+async def complete_upload(
+    upload_id: str,
+    current_user: dict = Depends(auth.get_current_user),
+    db: AsyncSession = Depends(database.get_db)
+):
+    """Finish a resumable upload; returns the same shape as /chat/upload"""
+    session = await _get_upload_session(upload_id, current_user["id"])
+    try:
+        return await uploads.complete_session(db, session)
+    except uploads.UploadOffsetMismatch as e:
+        raise HTTPException(409, f"Upload incomplete: {e.expected} of {session['size']} bytes received")
+
+@router.get("/presence")
+async def get_presence(
+    ids: str = Query(..., description="Comma separated user ids"),
+    current_user: dict = Depends(auth.get_current_user)
+):
+    """Bulk online status lookup for a contact list"""
+    try:
+        user_ids = [int(i) for i in ids.split(",") if i.strip()]
+    except ValueError:
+        raise HTTPException(400, "ids must be comma separated integers")
+    if len(user_ids) > MAX_PRESENCE_IDS:
+        raise HTTPException(400, f"At most {MAX_PRESENCE_IDS} ids per request")
+
+    online = await presence_store.get_online(user_ids)
+    return {str(user_id): ("online" if user_id in online else "offline") for user_id in user_ids}
+
+@router.get("/conversations", response_model=List[schemas.ConversationSummaryResponse])
+async def get_conversations(
+    before_id: Optional[int] = None,
+    limit: int = Query(CONVERSATIONS_PAGE_SIZE, ge=1, le=MAX_CONVERSATIONS_PAGE_SIZE),
+    current_user: dict = Depends(auth.get_current_user),
+    db: AsyncSession = Depends(database.get_db)
+):
+    """Conversations with last message preview and unread count, most recent first.
+
+    Pass the smallest ``last_message_id`` loaded so far as ``before_id`` to load more.
+    """
+    return await crud.get_conversation_summaries(db, current_user["id"], before_id=before_id, limit=limit)
+
+@router.get("/search", response_model=List[schemas.MessageResponse])
+async def search_messages(
+    q: str = Query(..., min_length=1, max_length=200),
+    limit: int = Query(search.SEARCH_PAGE_SIZE, ge=1, le=search.MAX_SEARCH_PAGE_SIZE),
+    offset: int = Query(0, ge=0),
+    current_user: dict = Depends(auth.get_current_user),
+    db: AsyncSession = Depends(database.get_db)
+):
+    """Full-text search over the user's conversations, best match first"""
+    return await search.search_messages(db, current_user["id"], q, limit=limit, offset=offset)
 
 @router.get("/history/{contact_or_group_id}", response_model=List[schemas.MessageResponse])
 async def get_history(
     contact_or_group_id: int,
     is_group: bool = False,
+    before_id: Optional[int] = None,
+    after_id: Optional[int] = None,
+    limit: int = Query(HISTORY_PAGE_SIZE, ge=1, le=MAX_HISTORY_PAGE_SIZE),
+    current_user: dict = Depends(auth.get_current_user),
+    db: AsyncSession = Depends(database.get_db)
+):
+    """Get a page of chat history. Pass the oldest loaded id as ``before_id`` to load more."""
+    if before_id is not None and after_id is not None:
+        raise HTTPException(400, "Use either before_id or after_id, not both")
+    return await crud.get_chat_history(
+        db,
+        current_user["id"],
+        contact_or_group_id,
+        is_group,
+        before_id=before_id,
+        after_id=after_id,
+        limit=limit
+    )
+
+@router.get("/sync", response_model=schemas.SyncResponse)
+async def get_sync(
+    since: Optional[int] = Query(None, ge=0, description="Cursor from the previous sync; omit to get the current head"),
+    limit: int = Query(sync.SYNC_PAGE_SIZE, ge=1, le=sync.MAX_SYNC_PAGE_SIZE),
     current_user: dict = Depends(auth.get_current_user),
     db: AsyncSession = Depends(database.get_db)
 ):
-    return await crud.get_chat_history(db, current_user["id"], contact_or_group_id, is_group)
+    """Messages, status and membership changes since a cursor. Call again with ``cursor`` while ``has_more``."""
+    return await sync.get_delta(db, current_user["id"], since, limit)
 
 @router.websocket("/ws")
 async def websocket_endpoint(
@@ -0,0 +1,76 @@
+from fastapi import APIRouter, HTTPException, Query, Request, Response
+from fastapi.responses import FileResponse
+from pathlib import Path
+from typing import Optional
+import logging
+from .. import blobstore, media
+
+router = APIRouter(tags=["media"])
+logger = logging.getLogger(__name__)
+
+# Upload file names are content hashes or uuids and are never overwritten,
+# so a response can be cached forever and the name doubles as a strong ETag
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+# A ?w= URL answered with the original (variant failed) may render fine later
+FALLBACK_CACHE_CONTROL = "public, max-age=300"
+
+def resolve_upload_path(file_path: str) -> Path:
+    """Map a URL path to a file under the uploads directory, refusing anything outside it"""
+    root = blobstore.UPLOAD_ROOT.resolve()
+    full_path = (root / file_path).resolve()
+    if root not in full_path.parents or ".partial" in full_path.relative_to(root).parts:
+        raise HTTPException(404, "Not found")
+    if not full_path.is_file():
+        raise HTTPException(404, "Not found")
+    return full_path
+
+def _etag_matches(if_none_match: str, etag: str) -> bool:
+    candidates = [tag.strip() for tag in if_none_match.split(",")]
+    return "*" in candidates or any(tag.removeprefix("W/") == etag for tag in candidates)
+
+def cached_file_response(
+    request: Request,
+    path: Path,
+    media_type: Optional[str] = None,
+    cache_control: str = IMMUTABLE_CACHE_CONTROL
+) -> Response:
+    """FileResponse with a strong ETag, immutable caching and 304 revalidation.
+
+    FileResponse answers Range requests with 206 (audio/video seeking) and
+    hands whole files to the server via the ASGI pathsend extension where
+    the server supports it.
+    """
+    headers = {
+        "ETag": f'"{path.stem}"',
+        "Cache-Control": cache_control,
+        "Accept-Ranges": "bytes",
+    }
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match and _etag_matches(if_none_match, headers["ETag"]):
+        return Response(status_code=304, headers=headers)
+    return FileResponse(path, media_type=media_type, headers=headers)
+
+@router.api_route("/uploads/{file_path:path}", methods=["GET", "HEAD"])
+async def get_upload(file_path: str, request: Request):
+    """Serve an uploaded file"""
+    return cached_file_response(request, resolve_upload_path(file_path))
+
+@router.api_route("/media/{file_path:path}", methods=["GET", "HEAD"])
+async def get_media(
+    file_path: str,
+    request: Request,
+    w: Optional[int] = Query(None, ge=1, description="Width of a resized WebP variant")
+):
+    """Serve an upload, or a resized variant of an image upload with ?w="""
+    full_path = resolve_upload_path(file_path)
+    if w is None or not media.variants_enabled() or not media.is_image(file_path):
+        return cached_file_response(request, full_path)
+
+    rel_path = full_path.relative_to(blobstore.UPLOAD_ROOT.resolve()).as_posix()
+    try:
+        variant = await media.ensure_variant(rel_path, media.snap_width(w))
+    except Exception as e:
+        # Undecodable image: fall back to the original
+        logger.warning(f"Could not render variant of {rel_path}: {e}")
+        return cached_file_response(request, full_path, cache_control=FALLBACK_CACHE_CONTROL)
+    return cached_file_response(request, variant, media_type="image/webp")
@@ -1,10 +1,7 @@
 from fastapi import APIRouter, Depends, HTTPException, UploadFile, File
 from sqlalchemy.ext.asyncio import AsyncSession
 from typing import Optional
-import shutil
-import os
-import uuid
-from .. import schemas, database, models, auth, crud
+from .. import schemas, database, models, auth, crud, uploads, blobstore
 
 router = APIRouter(prefix="/profile", tags=["profile"])
 
@@ -24,6 +21,7 @@ async def get_my_profile(
         "display_name": user.display_name or user.email.split('@')[0],
         "about": user.about or "Hey there! I am using E-Chat",
         "profile_photo_url": user.profile_photo_url,
+        "profile_thumbnail_url": user.profile_thumbnail_url,
         "theme_preference": user.theme_preference or "light",
         "last_seen": user.last_seen,
         "created_at": user.created_at
@@ -50,6 +48,7 @@ async def update_my_profile(
         "display_name": user.display_name or user.email.split('@')[0],
         "about": user.about or "Hey there! I am using E-Chat",
         "profile_photo_url": user.profile_photo_url,
+        "profile_thumbnail_url": user.profile_thumbnail_url,
         "theme_preference": user.theme_preference or "light",
         "last_seen": user.last_seen,
         "created_at": user.created_at
@@ -66,24 +65,23 @@ async def upload_profile_photo(
     if not file.content_type or not file.content_type.startswith("image/"):
         raise HTTPException(400, "File must be an image")
     
-    # Create uploads directory
-    os.makedirs("backend/uploads/profiles", exist_ok=True)
-    
-    # Generate unique filename
-    ext = file.filename.split('.')[-1] if '.' in file.filename else 'jpg'
-    filename = f"{current_user['id']}_{uuid.uuid4()}.{ext}"
-    path = f"backend/uploads/profiles/{filename}"
-    
-    # Save file
-    with open(path, "wb") as buffer:
-        shutil.copyfileobj(file.file, buffer)
-    
-    # Update user profile
-    photo_url = f"/uploads/profiles/{filename}"
-    user = await crud.update_profile_photo(db, current_user["id"], photo_url)
+    # Store the image (deduplicated by content)
+    try:
+        stored = await uploads.save_upload(db, file)
+    except uploads.UploadTooLarge:
+        raise HTTPException(400, f"File too large. Max {uploads.MAX_UPLOAD_SIZE // (1024*1024)}MB")
+    photo_url = stored["url"]
+
+    # Update user profile, dropping our reference to the previous photo
+    previous = await crud.get_user_by_id(db, current_user["id"])
+    previous_url = previous.profile_photo_url if previous else None
+    user = await crud.update_profile_photo(db, current_user["id"], photo_url, stored["thumbnail_url"])
+    await blobstore.retain(db, photo_url)
+    await blobstore.release(db, previous_url)
     
     return {
         "profile_photo_url": photo_url,
+        "profile_thumbnail_url": stored["thumbnail_url"],
         "message": "Profile photo updated successfully"
     }
 
@@ -93,7 +91,10 @@ async def delete_profile_photo(
     db: AsyncSession = Depends(database.get_db)
 ):
     """Delete profile photo"""
+    previous = await crud.get_user_by_id(db, current_user["id"])
+    previous_url = previous.profile_photo_url if previous else None
     user = await crud.update_profile_photo(db, current_user["id"], None)
+    await blobstore.release(db, previous_url)
     
     return {
         "message": "Profile photo deleted successfully"
@@ -34,6 +34,7 @@ class ContactResponse(UserBase):
     display_name: Optional[str] = None
     about: Optional[str] = None
     profile_photo_url: Optional[str] = None
+    profile_thumbnail_url: Optional[str] = None
     created_at: datetime
     
     class Config:
@@ -45,11 +46,16 @@ class GroupCreate(BaseModel):
 class GroupMemberAdd(BaseModel):
     email: EmailStr
 
+class GroupRetentionUpdate(BaseModel):
+    # None follows the server-wide policy, 0 keeps messages forever
+    retention_days: Optional[int] = Field(None, ge=0)
+
 class GroupResponse(BaseModel):
     id: int
     name: str
     admin_id: int
     created_at: datetime
+    retention_days: Optional[int] = None
     
     class Config:
         from_attributes = True
@@ -62,6 +68,8 @@ class MessageBase(BaseModel):
     file_type: Optional[str] = None
     file_name: Optional[str] = None
     file_size: Optional[int] = None
+    thumbnail_url: Optional[str] = None
+    preview_url: Optional[str] = None
 
 class MessageCreate(MessageBase):
     receiver_id: Optional[int] = None
@@ -78,6 +86,19 @@ class MessageResponse(MessageBase):
     class Config:
         from_attributes = True
 
+class ConversationSummaryResponse(BaseModel):
+    conversation_id: str
+    peer_user_id: Optional[int] = None
+    group_id: Optional[int] = None
+    last_message_id: int
+    last_sender_id: Optional[int] = None
+    snippet: Optional[str] = None
+    unread_count: int
+    updated_at: Optional[datetime] = None
+
+    class Config:
+        from_attributes = True
+
 # User Profile Schemas
 class UserProfileUpdate(BaseModel):
     display_name: Optional[str] = None
@@ -90,6 +111,7 @@ class UserProfileResponse(BaseModel):
     display_name: Optional[str] = None
     about: Optional[str] = None
     profile_photo_url: Optional[str] = None
+    profile_thumbnail_url: Optional[str] = None
     theme_preference: Optional[str] = None
     last_seen: Optional[datetime] = None
     created_at: datetime
@@ -97,3 +119,36 @@ class UserProfileResponse(BaseModel):
     class Config:
         from_attributes = True
 
+
+# Resumable upload schemas
+class UploadSessionCreate(BaseModel):
+    filename: str
+    size: int = Field(..., ge=0)
+    content_type: Optional[str] = None
+
+class UploadSessionResponse(BaseModel):
+    upload_id: str
+    filename: str
+    content_type: Optional[str] = None
+    size: int
+    offset: int
+    chunk_size: int
+
+
+# Incremental sync schemas
+class SyncChange(BaseModel):
+    id: int
+    kind: str  # message, status, membership
+    actor_id: Optional[int] = None
+    user_id: Optional[int] = None
+    group_id: Optional[int] = None
+    message_id: Optional[int] = None
+    message: Optional[MessageResponse] = None
+    payload: Optional[dict] = None
+    created_at: Optional[datetime] = None
+
+class SyncResponse(BaseModel):
+    changes: List[SyncChange]
+    cursor: int
+    has_more: bool
+    reset: bool = False  # cursor predates the retained change log; reload instead
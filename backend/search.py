@@ -0,0 +1,106 @@
+"""
+Full-text message search
+
+The index lives in the database and is maintained on write:
+
+- SQLite: an FTS5 external-content table, messages_fts, kept in step
+  with messages by triggers.
+- Postgres: a GIN expression index on the tsvector of the content.
+  Nothing is stored per row, so adding it doesn't rewrite messages.
+
+ensure_search_index() creates whichever applies; it runs automatically
+when the messages table is created. Existing databases get the index
+from migrations 0005 and 0009, concurrently on Postgres. Searches are limited to conversations the user is in and
+ranked by relevance (bm25 / ts_rank).
+"""
+import re
+
+from fastapi import HTTPException
+from sqlalchemy import event, func, literal_column, select, text, column, table
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from . import crud, models
+
+SEARCH_PAGE_SIZE = 20
+MAX_SEARCH_PAGE_SIZE = 100
+# Text search configuration on Postgres; 'simple' doesn't assume a language
+SEARCH_TS_CONFIG = "simple"
+
+SQLITE_SEARCH_DDL = [
+    """CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5(
+        content, content='messages', content_rowid='id', tokenize='unicode61 remove_diacritics 2'
+    )""",
+    """CREATE TRIGGER IF NOT EXISTS messages_fts_insert AFTER INSERT ON messages BEGIN
+        INSERT INTO messages_fts(rowid, content) VALUES (new.id, new.content);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS messages_fts_delete AFTER DELETE ON messages BEGIN
+        INSERT INTO messages_fts(messages_fts, rowid, content) VALUES ('delete', old.id, old.content);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS messages_fts_update AFTER UPDATE OF content ON messages BEGIN
+        INSERT INTO messages_fts(messages_fts, rowid, content) VALUES ('delete', old.id, old.content);
+        INSERT INTO messages_fts(rowid, content) VALUES (new.id, new.content);
+    END""",
+]
+
+# Queries must spell the indexed expression exactly like this (literals, not
+# bind parameters) for the planner to use the index
+POSTGRES_TSVECTOR = f"to_tsvector('{SEARCH_TS_CONFIG}', coalesce(content, ''))"
+POSTGRES_SEARCH_INDEX = "ix_messages_content_fts"
+POSTGRES_SEARCH_DDL = [
+    f"CREATE INDEX IF NOT EXISTS {POSTGRES_SEARCH_INDEX} ON messages USING gin ({POSTGRES_TSVECTOR})",
+]
+
+def ensure_search_index(sync_conn):
+    """Create the full-text index for the connection's database if it is missing"""
+    dialect = sync_conn.dialect.name
+    if dialect == "sqlite":
+        exists = sync_conn.execute(
+            text("SELECT 1 FROM sqlite_master WHERE name = 'messages_fts'")
+        ).first()
+        for statement in SQLITE_SEARCH_DDL:
+            sync_conn.execute(text(statement))
+        if not exists:
+            # Index messages written before the search table existed
+            sync_conn.execute(text("INSERT INTO messages_fts(messages_fts) VALUES ('rebuild')"))
+    elif dialect == "postgresql":
+        for statement in POSTGRES_SEARCH_DDL:
+            sync_conn.execute(text(statement))
+
+@event.listens_for(models.Message.__table__, "after_create")
+def _create_search_index(target, connection, **kw):
+    ensure_search_index(connection)
+
+def fts5_query(q: str) -> str:
+    """Turn free text into an FTS5 query: every word must match, as a prefix.
+
+    Quoting each word keeps FTS5 operators and punctuation in user input
+    from being parsed as query syntax.
+    """
+    return " ".join(f'"{word}"*' for word in re.findall(r"\w+", q))
+
+async def search_messages(db: AsyncSession, user_id: int, q: str, limit: int = SEARCH_PAGE_SIZE, offset: int = 0):
+    """Messages visible to user_id that match q, best match first"""
+    dialect = db.bind.dialect.name
+    if dialect == "sqlite":
+        query = fts5_query(q)
+        if not query:
+            return []
+        fts = table("messages_fts", column("rowid"))
+        match_table = literal_column("messages_fts")
+        # bm25 is lower for better matches
+        rank = func.bm25(match_table)
+        stmt = select(models.Message).select_from(
+            fts.join(models.Message, models.Message.id == fts.c.rowid)
+        ).where(match_table.match(query)).order_by(rank, models.Message.id.desc())
+    elif dialect == "postgresql":
+        ts_query = func.websearch_to_tsquery(SEARCH_TS_CONFIG, q)
+        content_tsv = literal_column(POSTGRES_TSVECTOR)
+        stmt = select(models.Message).where(
+            content_tsv.op("@@")(ts_query)
+        ).order_by(func.ts_rank(content_tsv, ts_query).desc(), models.Message.id.desc())
+    else:
+        raise HTTPException(status_code=501, detail=f"Full-text search is not supported on {dialect}")
+
+    stmt = stmt.where(crud.message_visible_to(user_id)).limit(limit).offset(offset)
+    result = await db.execute(stmt)
+    return result.scalars().all()
@@ -1,4 +1,5 @@
 import pytest
+import pytest_asyncio
 from httpx import AsyncClient, ASGITransport
 from backend.main import app
 
@@ -24,3 +25,785 @@ async def test_auth_flow():
         # Since we use randomized OTP in auth.py, we can't easily guess it in test 
         # without mocking the generator or peeking DB. 
         # For this test, we accept if request-otp passes.)
+
+@pytest_asyncio.fixture
+async def db_session(tmp_path):
+    from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+    from sqlalchemy.orm import sessionmaker
+    from backend.database import Base
+
+    test_engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path / 'test.db'}")
+    async with test_engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    session_factory = sessionmaker(bind=test_engine, class_=AsyncSession, expire_on_commit=False)
+    async with session_factory() as session:
+        yield session
+    await test_engine.dispose()
+
+@pytest.mark.asyncio
+async def test_chat_history_pagination(db_session):
+    from backend import crud
+
+    alice = await crud.create_user(db_session, "alice@example.com", "x")
+    bob = await crud.create_user(db_session, "bob@example.com", "x")
+    ids = []
+    for i in range(5):
+        msg = await crud.create_message(db_session, sender_id=alice.id, receiver_id=bob.id, content=str(i))
+        ids.append(msg.id)
+
+    latest = await crud.get_chat_history(db_session, bob.id, alice.id, limit=2)
+    assert [m.id for m in latest] == ids[3:]
+
+    older = await crud.get_chat_history(db_session, bob.id, alice.id, before_id=ids[3], limit=2)
+    assert [m.id for m in older] == ids[1:3]
+
+    newer = await crud.get_chat_history(db_session, bob.id, alice.id, after_id=ids[0], limit=2)
+    assert [m.id for m in newer] == ids[1:3]
+
+def test_lru_cache_eviction_and_counters():
+    from backend.cache import LRUCache
+
+    cache = LRUCache(maxsize=2)
+    cache.set(1, "a")
+    cache.set(2, "b")
+    assert cache.get(1) == "a"  # 1 is now most recent
+    cache.set(3, "c")  # evicts 2
+    assert cache.get(2) is None
+    assert cache.stats() == {"size": 2, "maxsize": 2, "hits": 1, "misses": 1, "evictions": 1}
+
+def test_lru_cache_ttl(monkeypatch):
+    from backend import cache as cache_module
+
+    now = [1000.0]
+    monkeypatch.setattr(cache_module.time, "monotonic", lambda: now[0])
+    cache = cache_module.LRUCache(maxsize=2, ttl=30)
+    cache.set(1, "a")
+    now[0] += 29
+    assert cache.get(1) == "a"
+    now[0] += 2
+    assert cache.get(1) is None and 1 not in cache and len(cache) == 0
+
+@pytest.mark.asyncio
+async def test_group_members_cache(db_session):
+    from backend import crud
+    from backend.cache import group_members_cache
+
+    group_members_cache.clear()
+    admin = await crud.create_user(db_session, "admin@example.com", "x")
+    await crud.create_user(db_session, "member@example.com", "x")
+    group = await crud.create_group(db_session, "team", admin.id)
+
+    member = await crud.add_group_member(db_session, group.id, "member@example.com")
+    assert sorted(await crud.get_group_members_ids(db_session, group.id)) == sorted([admin.id, member.id])
+
+    group_members_cache.invalidate(group.id)
+    assert sorted(await crud.get_group_members_ids(db_session, group.id)) == sorted([admin.id, member.id])
+
+    # A member list cached before another worker added someone doesn't lock them out
+    group_members_cache.set(group.id, (admin.id,))
+    assert await crud.is_group_member(db_session, group.id, member.id) is True
+    assert await crud.is_group_member(db_session, group.id, 999) is False
+
+@pytest.mark.asyncio
+async def test_contact_watchers_cache(db_session, monkeypatch):
+    import time
+    from backend import cache as cache_module, crud, models
+    from backend.cache import contact_watchers_cache
+
+    contact_watchers_cache.clear()
+    alice = await crud.create_user(db_session, "alice@example.com", "x")
+    bob = await crud.create_user(db_session, "bob@example.com", "x")
+    carol = await crud.create_user(db_session, "carol@example.com", "x")
+    dave = await crud.create_user(db_session, "dave@example.com", "x")
+
+    assert await crud.get_watcher_ids(db_session, alice.id) == set()
+
+    # Cached entries are kept up to date without going back to the DB
+    await crud.add_contact(db_session, bob.id, "alice@example.com")
+    await crud.create_message(db_session, sender_id=alice.id, receiver_id=carol.id, content="hi")
+    assert await crud.get_watcher_ids(db_session, alice.id) == {bob.id, carol.id}
+
+    contact_watchers_cache.invalidate(alice.id)
+    assert await crud.get_watcher_ids(db_session, alice.id) == {bob.id, carol.id}
+
+    # A contact added by another worker bypasses this cache until the entry expires
+    db_session.add(models.Contact(owner_id=dave.id, contact_user_id=alice.id))
+    await db_session.commit()
+    assert dave.id not in await crud.get_watcher_ids(db_session, alice.id)
+    later = time.monotonic() + contact_watchers_cache.ttl + 1
+    monkeypatch.setattr(cache_module.time, "monotonic", lambda: later)
+    assert await crud.get_watcher_ids(db_session, alice.id) == {bob.id, carol.id, dave.id}
+
+@pytest.mark.asyncio
+async def test_in_process_backplane_delivers_across_workers():
+    import asyncio
+    import socketio
+    from backend.backplane import InProcessManager, emit_skipping_user, join_user_to_room, user_room
+
+    def make_worker():
+        sio = socketio.AsyncServer(async_mode='asgi', client_manager=InProcessManager(channel="test"))
+        sio.manager.set_server(sio)
+        sio.manager.initialize()
+        sent = []
+
+        async def fake_send(eio_sid, eio_pkt):
+            sent.append((eio_sid, eio_pkt.data))
+
+        sio._send_eio_packet = fake_send
+        return sio, sent
+
+    worker_a, sent_a = make_worker()
+    worker_b, sent_b = make_worker()
+    await asyncio.sleep(0)  # let both listeners subscribe
+
+    # A user connected to worker B only
+    sid = await worker_b.manager.connect("eio-1", "/")
+    await worker_b.enter_room(sid, user_room(7))
+
+    # Room membership and emits issued on worker A reach the session on worker B
+    await join_user_to_room(worker_a, 7, "group_1")
+    await worker_a.emit("new_message", {"id": 1}, room="group_1")
+    for _ in range(10):
+        await asyncio.sleep(0)
+
+    assert sent_b == [("eio-1", '2["new_message",{"id":1}]')]
+
+    # A group message skips the sender's sessions on every worker, not just the sending one
+    sender_on_a = await worker_a.manager.connect("eio-2", "/")
+    await worker_a.enter_room(sender_on_a, user_room(8))
+    sender_on_b = await worker_b.manager.connect("eio-3", "/")
+    await worker_b.enter_room(sender_on_b, user_room(8))
+    await join_user_to_room(worker_a, 8, "group_1")
+    for _ in range(10):
+        await asyncio.sleep(0)
+    sent_b.clear()
+    await emit_skipping_user(worker_a, "new_message", {"id": 2}, "group_1", 8)
+    for _ in range(10):
+        await asyncio.sleep(0)
+
+    assert sent_a == []
+    assert sent_b == [("eio-1", '2["new_message",{"id":2}]')]
+    worker_a.manager.thread.cancel()
+    worker_b.manager.thread.cancel()
+
+@pytest.mark.asyncio
+async def test_memory_presence_store_expiry():
+    import time
+    from backend.presence import MemoryPresenceStore
+
+    store = MemoryPresenceStore(ttl=60)
+    assert await store.add_session(1, "a") is True
+    assert await store.add_session(1, "b") is False
+    assert await store.remove_session(1, "a") is False
+    assert await store.get_online([1, 2]) == {1}
+
+    # A session nobody refreshes expires and the sweeper reports the user offline
+    store._sessions[1]["b"] = time.time() - 1
+    assert await store.get_online([1]) == set()
+    assert await store.sweep() == [1]
+
+    # Reconnecting before the sweeper runs still counts as coming online
+    assert await store.add_session(2, "c") is True
+    store._sessions[2]["c"] = time.time() - 1
+    assert await store.add_session(2, "d") is True
+    assert await store.sweep() == []
+    assert await store.remove_session(1, "b") is False
+
+@pytest.mark.asyncio
+async def test_write_behind_batches_inserts(db_session):
+    import asyncio
+    from backend import crud
+    from backend.write_behind import MessageWriteBuffer
+
+    alice = await crud.create_user(db_session, "alice@example.com", "x")
+    bob = await crud.create_user(db_session, "bob@example.com", "x")
+
+    session_factory = lambda: type(db_session)(bind=db_session.bind, expire_on_commit=False)
+    buffer = MessageWriteBuffer(session_factory=session_factory, batch_size=10, flush_ms=50)
+    messages = await asyncio.gather(*[
+        buffer.submit(sender_id=alice.id, receiver_id=bob.id, content=str(i)) for i in range(3)
+    ])
+    await buffer.close()
+
+    assert buffer.flushes == 1
+    assert [m.content for m in messages] == ["0", "1", "2"]
+    assert all(m.id and m.created_at for m in messages)
+    history = await crud.get_chat_history(db_session, alice.id, bob.id)
+    assert [m.id for m in history] == [m.id for m in messages]
+
+    # A row the database rejects fails only its own sender
+    buffer = MessageWriteBuffer(session_factory=session_factory, batch_size=10, flush_ms=50)
+    results = await asyncio.gather(
+        buffer.submit(sender_id=alice.id, receiver_id=bob.id, content="fine"),
+        buffer.submit(sender_id=None, receiver_id=bob.id, content="no sender"),
+        buffer.submit(sender_id=bob.id, receiver_id=alice.id, content="also fine"),
+        return_exceptions=True
+    )
+    await buffer.close()
+    assert [m.content for m in (results[0], results[2])] == ["fine", "also fine"]
+    assert isinstance(results[1], Exception)
+
+@pytest.mark.asyncio
+async def test_password_hasher_sheds_load():
+    import asyncio
+    from fastapi import HTTPException
+    from backend.hashing import PasswordHasher
+
+    hasher = PasswordHasher(workers=1, queue_limit=1)
+    hashed = await hasher.hash("correct horse")
+    assert await hasher.verify("correct horse", hashed)
+
+    # One running + one queued fill the hasher; the third is rejected
+    results = await asyncio.gather(
+        *[hasher.verify("correct horse", hashed) for _ in range(3)],
+        return_exceptions=True
+    )
+    assert results[:2] == [True, True]
+    assert isinstance(results[2], HTTPException) and results[2].status_code == 429
+    assert hasher.stats()["rejected"] == 1
+
+def test_verify_token_cache():
+    from datetime import timedelta
+    from backend import auth
+    from backend.cache import verified_tokens_cache
+
+    verified_tokens_cache.clear()
+    token = auth.create_access_token({"sub": "a@example.com", "id": 1}, timedelta(minutes=5))
+    assert auth.verify_token(token) == {"email": "a@example.com", "id": 1}
+    hits = verified_tokens_cache.hits
+    assert auth.verify_token(token) == {"email": "a@example.com", "id": 1}
+    assert verified_tokens_cache.hits == hits + 1
+
+    expired = auth.create_access_token({"sub": "a@example.com", "id": 1}, timedelta(seconds=-1))
+    assert auth.verify_token(expired) is None
+
+@pytest_asyncio.fixture
+async def api_client(db_session, tmp_path, monkeypatch):
+    """Client authenticated as user 1, with the test database and a temp uploads directory"""
+    from datetime import timedelta
+    from backend import auth, blobstore, database, uploads
+
+    monkeypatch.setattr(blobstore, "UPLOAD_ROOT", tmp_path)
+    monkeypatch.setattr(blobstore, "BLOB_DIR", tmp_path / "blobs")
+    monkeypatch.setattr(uploads, "PARTIAL_DIR", tmp_path)
+
+    async def override_get_db():
+        yield db_session
+
+    app.dependency_overrides[database.get_db] = override_get_db
+    token = auth.create_access_token({"sub": "a@example.com", "id": 1}, timedelta(minutes=5))
+    transport = ASGITransport(app=app)
+    async with AsyncClient(transport=transport, base_url="http://test", headers={"Authorization": f"Bearer {token}"}) as ac:
+        yield ac
+    app.dependency_overrides.clear()
+
+@pytest.mark.asyncio
+async def test_resumable_upload(api_client, tmp_path):
+    data = b"x" * 10
+
+    response = await api_client.post("/chat/uploads", json={"filename": "clip.mp4", "size": len(data)})
+    assert response.status_code == 200
+    upload_id = response.json()["upload_id"]
+
+    response = await api_client.put(f"/chat/uploads/{upload_id}?offset=0", content=data[:6])
+    assert response.json()["offset"] == 6
+    # A retry at a stale offset is rejected instead of corrupting the file
+    response = await api_client.put(f"/chat/uploads/{upload_id}?offset=0", content=data[:6])
+    assert response.status_code == 409
+    response = await api_client.post(f"/chat/uploads/{upload_id}/complete")
+    assert response.status_code == 409
+
+    assert (await api_client.get(f"/chat/uploads/{upload_id}")).json()["offset"] == 6
+    await api_client.put(f"/chat/uploads/{upload_id}?offset=6", content=data[6:])
+    response = await api_client.post(f"/chat/uploads/{upload_id}/complete")
+
+    assert response.status_code == 200
+    result = response.json()
+    assert result["size"] == len(data) and result["url"].endswith(".mp4")
+    assert (tmp_path / result["url"][len("/uploads/"):]).read_bytes() == data
+
+@pytest.mark.asyncio
+async def test_concurrent_chunks_at_one_offset_append_once(api_client, tmp_path):
+    import asyncio
+    from backend import uploads
+
+    session = await uploads.create_session(1, "race.bin", 4, None)
+
+    async def slow_chunk():
+        await asyncio.sleep(0.01)
+        yield b"ab"
+
+    # Both requests loaded the session at offset 0 before either wrote
+    results = await asyncio.gather(
+        uploads.append_chunk(dict(session), 0, slow_chunk()),
+        uploads.append_chunk(dict(session), 0, slow_chunk()),
+        return_exceptions=True
+    )
+    assert results[0] == 2
+    assert isinstance(results[1], uploads.UploadOffsetMismatch) and results[1].expected == 2
+    assert (tmp_path / f"{session['upload_id']}.part").read_bytes() == b"ab"
+
+@pytest.mark.asyncio
+async def test_uploads_are_deduplicated_and_collected(api_client, db_session, tmp_path):
+    from backend import blobstore, crud, media
+
+    files = {"file": ("meme.png", b"same bytes", "image/png")}
+    first = (await api_client.post("/chat/upload", files=files)).json()
+    second = (await api_client.post("/chat/upload", files=files)).json()
+    assert first["url"] == second["url"]
+
+    # References come from the messages carrying the file, not from the uploads
+    alice = await crud.create_user(db_session, "alice@example.com", "x")
+    bob = await crud.create_user(db_session, "bob@example.com", "x")
+    await crud.create_message(db_session, sender_id=alice.id, receiver_id=bob.id, file_url=first["url"])
+    await crud.create_messages(db_session, [crud.message_values(bob.id, alice.id, file_url=second["url"])])
+    blob = await crud.get_blob(db_session, first["url"].rsplit("/", 1)[1].split(".")[0])
+    await db_session.refresh(blob)
+    assert blob.ref_count == 2
+
+    variant = tmp_path / media.variant_path(blob.path, media.THUMBNAIL_WIDTH)
+    variant.parent.mkdir(parents=True, exist_ok=True)
+    variant.write_bytes(b"webp")
+    await blobstore.release(db_session, first["url"])
+    await blobstore.release(db_session, second["url"])
+    # Freshly uploaded files get a grace period before a message refers to them
+    assert await blobstore.collect_garbage(db_session) == {"blobs": 0, "orphans": 0}
+    assert await blobstore.collect_garbage(db_session, grace_seconds=-1) == {"blobs": 1, "orphans": 0}
+    assert not (tmp_path / blob.path).exists()
+    assert not variant.exists()
+
+@pytest.mark.asyncio
+async def test_image_upload_variants(api_client):
+    import io
+    from PIL import Image
+
+    buffer = io.BytesIO()
+    Image.new("RGB", (800, 400), "red").save(buffer, "PNG")
+    files = {"file": ("photo.png", buffer.getvalue(), "image/png")}
+    uploaded = (await api_client.post("/chat/upload", files=files)).json()
+    assert uploaded["thumbnail_url"].endswith("?w=256")
+
+    response = await api_client.get(uploaded["url"].replace("/uploads/", "/media/", 1) + "?w=100")
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "image/webp"
+    assert Image.open(io.BytesIO(response.content)).size == (128, 64)
+
+    assert (await api_client.get("/media/../tests.py")).status_code == 404
+
+    # An image that can't be decoded falls back to the original, without pinning that answer forever
+    files = {"file": ("broken.png", b"not a png", "image/png")}
+    broken = (await api_client.post("/chat/upload", files=files)).json()
+    response = await api_client.get(broken["url"].replace("/uploads/", "/media/", 1) + "?w=100")
+    assert response.status_code == 200 and response.content == b"not a png"
+    assert response.headers["cache-control"] == "public, max-age=300"
+
+@pytest.mark.asyncio
+async def test_uploads_served_with_etag_and_ranges(api_client):
+    files = {"file": ("voice.ogg", b"0123456789", "audio/ogg")}
+    url = (await api_client.post("/chat/upload", files=files)).json()["url"]
+
+    response = await api_client.get(url)
+    assert response.status_code == 200
+    assert "immutable" in response.headers["cache-control"]
+    etag = response.headers["etag"]
+
+    response = await api_client.get(url, headers={"If-None-Match": etag})
+    assert response.status_code == 304
+
+    response = await api_client.head(url)
+    assert response.status_code == 200 and response.content == b""
+    assert response.headers["content-length"] == "10"
+
+    response = await api_client.get(url, headers={"Range": "bytes=2-5"})
+    assert response.status_code == 206
+    assert response.content == b"2345"
+    assert response.headers["content-range"] == "bytes 2-5/10"
+
+@pytest.mark.asyncio
+async def test_sync_returns_changes_after_cursor(api_client, db_session):
+    from backend import crud
+
+    alice = await crud.create_user(db_session, "a@example.com", "x")  # user 1, the client
+    bob = await crud.create_user(db_session, "b@example.com", "x")
+    carol = await crud.create_user(db_session, "c@example.com", "x")
+
+    head = (await api_client.get("/chat/sync")).json()
+    assert head == {"changes": [], "cursor": 0, "has_more": False, "reset": False}
+
+    direct = await crud.create_message(db_session, sender_id=bob.id, receiver_id=alice.id, content="hi")
+    await crud.create_message(db_session, sender_id=bob.id, receiver_id=carol.id, content="not for alice")
+    group = await crud.create_group(db_session, "team", carol.id)
+    await crud.create_message(db_session, sender_id=carol.id, group_id=group.id, content="before alice joined")
+    await crud.add_group_member(db_session, group.id, alice.email)
+    await crud.create_messages(db_session, [crud.message_values(carol.id, group_id=group.id, content="all")])
+    await crud.update_message_status(db_session, direct.id, "read", actor_id=alice.id)
+
+    first = (await api_client.get("/chat/sync", params={"since": 0, "limit": 2})).json()
+    assert first["has_more"] is True
+    assert first["changes"][0]["message"]["content"] == "hi"
+    rest = (await api_client.get("/chat/sync", params={"since": first["cursor"]})).json()
+    assert rest["has_more"] is False
+
+    changes = first["changes"] + rest["changes"]
+    # Group history from before alice joined isn't replayed to her
+    assert [c["kind"] for c in changes] == ["message", "membership", "message", "status"]
+    assert changes[1]["user_id"] == alice.id
+    assert changes[2]["message"]["content"] == "all"
+    assert changes[3]["payload"] == {"status": "read"}
+    assert (await api_client.get("/chat/sync", params={"since": rest["cursor"]})).json()["changes"] == []
+
+@pytest.mark.asyncio
+async def test_mark_read_upto_groups_by_sender(db_session):
+    from backend import crud
+
+    alice = await crud.create_user(db_session, "alice@example.com", "x")
+    bob = await crud.create_user(db_session, "bob@example.com", "x")
+    carol = await crud.create_user(db_session, "carol@example.com", "x")
+    group = await crud.create_group(db_session, "team", alice.id)
+    messages = await crud.create_messages(db_session, [
+        crud.message_values(sender_id, group_id=group.id, content=str(i))
+        for i, sender_id in enumerate([bob.id, carol.id, bob.id, alice.id, bob.id])
+    ])
+    ids = [m.id for m in messages]
+
+    key = crud.conversation_key(group_id=group.id)
+    read = await crud.mark_read_upto(db_session, alice.id, key, ids[3])
+    assert read == {bob.id: [ids[0], ids[2]], carol.id: [ids[1]]}
+    # Already read messages are not reported twice
+    assert await crud.mark_read_upto(db_session, alice.id, key, ids[4]) == {bob.id: [ids[4]]}
+    # Reads are per member: the receipts count alice's read of bob's messages
+    counts = await crud.get_receipt_counts(db_session, [ids[0], ids[4]])
+    assert [(message_id, read) for message_id, _, _, read in counts] == [(ids[0], 1), (ids[4], 1)]
+    # One member reading doesn't mark the group messages read for everyone
+    history = await crud.get_chat_history(db_session, alice.id, group.id, is_group=True)
+    assert {m.status for m in history} == {"sent"}
+    await crud.add_group_member(db_session, group.id, carol.email)
+    assert await crud.mark_read_upto(db_session, carol.id, key, ids[4]) == {bob.id: [ids[0], ids[2], ids[4]], alice.id: [ids[3]]}
+
+@pytest.mark.asyncio
+async def test_receipts_are_recorded_once_and_aggregated(db_session):
+    from backend import crud
+    from backend.receipts import ReceiptAggregator
+
+    alice = await crud.create_user(db_session, "alice@example.com", "x")
+    bob = await crud.create_user(db_session, "bob@example.com", "x")
+    carol = await crud.create_user(db_session, "carol@example.com", "x")
+    group = await crud.create_group(db_session, "team", alice.id)
+    await crud.add_group_member(db_session, group.id, bob.email)
+    await crud.add_group_member(db_session, group.id, carol.email)
+    group_msg = await crud.create_message(db_session, sender_id=alice.id, group_id=group.id, content="all")
+    direct = await crud.create_message(db_session, sender_id=alice.id, receiver_id=bob.id, content="hi")
+    other = await crud.create_message(db_session, sender_id=carol.id, receiver_id=alice.id, content="not bob's")
+
+    assert await crud.record_receipts(db_session, bob.id, [group_msg.id, direct.id, other.id]) == [group_msg.id, direct.id]
+    assert await crud.record_receipts(db_session, bob.id, [group_msg.id, direct.id]) == []
+    assert await crud.record_receipts(db_session, carol.id, [group_msg.id], read=True) == [group_msg.id]
+    await db_session.refresh(direct)
+    assert direct.status == "delivered"
+
+    sent = []
+    async def notify(sender_id, receipts):
+        sent.append((sender_id, receipts))
+    session_factory = lambda: type(db_session)(bind=db_session.bind, expire_on_commit=False)
+    aggregator = ReceiptAggregator(notify=notify, session_factory=session_factory, window_ms=10)
+    aggregator.add([group_msg.id, direct.id])
+    aggregator.add([group_msg.id])
+    await aggregator._task
+
+    assert sent == [(alice.id, [
+        {"message_id": group_msg.id, "delivered": 2, "read": 1},
+        {"message_id": direct.id, "delivered": 1, "read": 0},
+    ])]
+
+    # message_read records the reader's receipt too
+    await crud.update_message_status(db_session, direct.id, "read", actor_id=bob.id)
+    assert [read for _, _, _, read in await crud.get_receipt_counts(db_session, [direct.id])] == [1]
+
+@pytest.mark.asyncio
+async def test_typing_manager_debounces_and_expires():
+    import asyncio
+    from backend.typing_indicator import TypingManager
+
+    sent = []
+    async def notify(event, user_id, receiver_id, group_id):
+        sent.append((event, user_id, receiver_id, group_id))
+
+    manager = TypingManager(notify=notify, interval=10, timeout=0.05)
+    for _ in range(5):
+        await manager.start(1, group_id=7)
+    await manager.start(1, receiver_id=2)
+    await manager.stop(1, receiver_id=2)
+    await manager.stop(1, receiver_id=2)
+    await asyncio.sleep(0.1)
+
+    assert sent == [
+        ("typing_start", 1, None, 7),
+        ("typing_start", 1, 2, None),
+        ("typing_stop", 1, 2, None),
+        ("typing_stop", 1, None, 7),  # expired
+    ]
+    assert manager.stats() == {"active": 0, "forwarded": 4, "suppressed": 5}
+
+@pytest.mark.asyncio
+async def test_conversation_summaries_track_last_message_and_unread(api_client, db_session):
+    from backend import crud
+
+    alice = await crud.create_user(db_session, "a@example.com", "x")  # user 1, the client
+    bob = await crud.create_user(db_session, "b@example.com", "x")
+    group = await crud.create_group(db_session, "team", bob.id)
+    await crud.add_group_member(db_session, group.id, alice.email)
+
+    first = await crud.create_message(db_session, sender_id=bob.id, receiver_id=alice.id, content="one")
+    await crud.create_messages(db_session, [
+        crud.message_values(bob.id, receiver_id=alice.id, content="two"),
+        crud.message_values(bob.id, group_id=group.id, content="group"),
+        crud.message_values(bob.id, receiver_id=alice.id, content="three"),
+    ])
+
+    page = (await api_client.get("/chat/conversations")).json()
+    assert [(c["peer_user_id"], c["group_id"], c["snippet"], c["unread_count"]) for c in page] == [
+        (bob.id, None, "three", 3),
+        (None, group.id, "group", 1),
+    ]
+    older = (await api_client.get("/chat/conversations", params={"before_id": page[0]["last_message_id"]})).json()
+    assert [c["group_id"] for c in older] == [group.id]
+
+    await crud.mark_read_upto(db_session, alice.id, crud.conversation_key(alice.id, bob.id), first.id)
+    await crud.record_receipts(db_session, alice.id, [page[1]["last_message_id"]], read=True)
+    page = (await api_client.get("/chat/conversations")).json()
+    assert [c["unread_count"] for c in page] == [2, 0]
+    # The sender's own row has nothing unread
+    bob_rows = await crud.get_conversation_summaries(db_session, bob.id)
+    assert [r.unread_count for r in bob_rows] == [0, 0]
+
+    # A single message_read reads up to that message; re-reading an older one changes nothing
+    await crud.update_message_status(db_session, page[0]["last_message_id"], "read", actor_id=alice.id)
+    await crud.update_message_status(db_session, first.id, "read", actor_id=alice.id)
+    page = (await api_client.get("/chat/conversations")).json()
+    assert [c["unread_count"] for c in page] == [0, 0]
+
+@pytest.mark.asyncio
+async def test_search_is_ranked_and_scoped(api_client, db_session):
+    from backend import crud
+
+    alice = await crud.create_user(db_session, "a@example.com", "x")  # user 1, the client
+    bob = await crud.create_user(db_session, "b@example.com", "x")
+    carol = await crud.create_user(db_session, "c@example.com", "x")
+    weak = await crud.create_message(db_session, sender_id=bob.id, receiver_id=alice.id, content="pizza tonight? or maybe tomorrow, whatever works")
+    strong = await crud.create_message(db_session, sender_id=alice.id, receiver_id=bob.id, content="pizza pizza")
+    await crud.create_message(db_session, sender_id=bob.id, receiver_id=carol.id, content="pizza without alice")
+    group = await crud.create_group(db_session, "team", carol.id)
+    await crud.add_group_member(db_session, group.id, alice.email)
+    in_group = await crud.create_messages(db_session, [crud.message_values(carol.id, group_id=group.id, content="Pizzeria booked")])
+
+    response = await api_client.get("/chat/search", params={"q": "pizz"})
+    assert [m["id"] for m in response.json()] == [strong.id, in_group[0].id, weak.id]
+
+    page = (await api_client.get("/chat/search", params={"q": "pizza", "limit": 1, "offset": 1})).json()
+    assert [m["id"] for m in page] == [weak.id]
+    # FTS syntax in user input is treated as text
+    assert (await api_client.get("/chat/search", params={"q": 'pizza" OR *'})).status_code == 200
+
+@pytest.mark.asyncio
+async def test_archive_export_and_import_round_trip(db_session, tmp_path, monkeypatch):
+    import io
+    import json
+    from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+    from sqlalchemy.orm import sessionmaker
+    from backend import archive, crud, database, search
+
+    alice = await crud.create_user(db_session, "alice@example.com", "hash-a")
+    bob = await crud.create_user(db_session, "bob@example.com", "hash-b")
+    carol = await crud.create_user(db_session, "carol@example.com", "hash-c")
+    await crud.add_contact(db_session, alice.id, bob.email)
+    group = await crud.create_group(db_session, "team", alice.id)
+    await crud.create_message(db_session, sender_id=alice.id, group_id=group.id, content="hello team")
+    await crud.create_message(db_session, sender_id=bob.id, receiver_id=carol.id, content="private")
+
+    def use_database(engine):
+        session_factory = sessionmaker(bind=engine, class_=AsyncSession, expire_on_commit=False)
+        monkeypatch.setattr(database, "engine", engine)
+        monkeypatch.setattr(database, "SessionLocal", session_factory)
+
+    use_database(db_session.bind)
+    user_export = io.StringIO()
+    counts = await archive.export_archive(user_export, user_id=alice.id, batch_size=1)
+    records = [json.loads(line) for line in user_export.getvalue().splitlines()]
+    assert records[0]["scope"] == "user"
+    assert counts["messages"] == 1 and "password_hash" not in records[1]["row"]
+
+    full_export = io.StringIO()
+    await archive.export_archive(full_export)
+
+    target = create_async_engine(f"sqlite+aiosqlite:///{tmp_path / 'target.db'}")
+    async with target.begin() as conn:
+        await conn.run_sync(database.Base.metadata.create_all)
+    use_database(target)
+    counts = await archive.import_archive(full_export.getvalue().splitlines(), batch_size=2)
+    assert counts == {"users": 3, "groups": 1, "group_members": 1, "contacts": 1, "messages": 2}
+
+    async with database.SessionLocal() as db:
+        imported = await crud.get_user_by_email(db, "bob@example.com")
+        assert imported.id == bob.id and imported.password_hash == "hash-b"
+        assert [m.content for m in await search.search_messages(db, alice.id, "team")] == ["hello team"]
+        assert [s.snippet for s in await crud.get_conversation_summaries(db, carol.id)] == ["private"]
+    with pytest.raises(ValueError):
+        await archive.import_archive(user_export.getvalue().splitlines())
+    await target.dispose()
+
+@pytest.mark.asyncio
+async def test_migrations_upgrade_old_database_and_are_recorded(tmp_path):
+    from sqlalchemy import inspect, text
+    from sqlalchemy.ext.asyncio import create_async_engine
+    from backend import migrate
+
+    engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path / 'old.db'}")
+    # Schema from before profile fields and conversation ids
+    async with engine.begin() as conn:
+        await conn.execute(text("CREATE TABLE users (id INTEGER PRIMARY KEY, email VARCHAR NOT NULL, password_hash VARCHAR NOT NULL, created_at DATETIME)"))
+        await conn.execute(text("CREATE TABLE messages (id INTEGER PRIMARY KEY, sender_id INTEGER, receiver_id INTEGER, group_id INTEGER, content TEXT, file_url VARCHAR, file_type VARCHAR, file_name VARCHAR, file_size INTEGER, status VARCHAR, created_at DATETIME)"))
+        await conn.execute(text("INSERT INTO users (id, email, password_hash) VALUES (1, 'a@x', 'x'), (2, 'b@x', 'x')"))
+        await conn.execute(text("INSERT INTO messages (sender_id, receiver_id, content, status) VALUES (2, 1, 'old hello', 'sent')"))
+
+    versions = [version for version, _, _ in migrate.discover_migrations()]
+    assert await migrate.migrate(engine) == versions
+    assert await migrate.migrate(engine) == []
+
+    async with engine.connect() as conn:
+        columns = await conn.run_sync(lambda c: {col["name"] for col in inspect(c).get_columns("users")})
+        indexes = await conn.run_sync(lambda c: {ix["name"] for ix in inspect(c).get_indexes("messages")})
+        conversation_id = await conn.scalar(text("SELECT conversation_id FROM messages"))
+        summary = (await conn.execute(text("SELECT user_id, unread_count FROM conversation_summaries ORDER BY user_id"))).all()
+        found = await conn.scalar(text("SELECT rowid FROM messages_fts WHERE messages_fts MATCH 'hello'"))
+    assert {"display_name", "profile_thumbnail_url"} <= columns
+    assert "ix_messages_conversation_id_id" in indexes
+    assert conversation_id == "u:1:2"
+    assert summary == [(1, 1), (2, 0)]
+    assert found == 1
+    await engine.dispose()
+
+def test_conversation_key_is_symmetric():
+    from backend import crud
+
+    assert crud.conversation_key(3, 12) == crud.conversation_key(12, 3) == "u:3:12"
+    assert crud.conversation_key(3, None, group_id=5) == "g:5"
+    assert crud.conversation_key(3, None) is None
+
+@pytest.mark.asyncio
+async def test_conversation_id_backfill_fills_null_rows(db_session):
+    import importlib
+    from sqlalchemy import text
+    from backend import migrate
+
+    backfill = importlib.import_module("backend.migrations.0003_message_columns")
+    async with db_session.bind.begin() as conn:
+        await conn.execute(text(
+            "INSERT INTO messages (sender_id, receiver_id, group_id, content, status) VALUES "
+            "(1, 2, NULL, 'a', 'sent'), (2, 1, NULL, 'b', 'sent'), (1, NULL, 5, 'c', 'sent'), (1, NULL, NULL, 'd', 'sent')"
+        ))
+
+    ctx = migrate.MigrationContext(db_session.bind)
+    # Several batches, and re-running finds nothing left to do
+    assert await ctx.backfill(backfill._fill_conversation_ids, batch_size=3) == 4
+    assert await ctx.backfill(backfill._fill_conversation_ids, batch_size=3) == 0
+
+    result = await db_session.execute(text("SELECT conversation_id FROM messages ORDER BY id"))
+    assert result.scalars().all() == ["u:1:2", "u:1:2", "g:5", ""]
+
+@pytest.mark.asyncio
+async def test_retention_archives_expired_messages_and_prunes(db_session, tmp_path):
+    import gzip
+    import json
+    from datetime import datetime, timedelta, timezone
+    from sqlalchemy import func, select, update
+    from sqlalchemy.ext.asyncio import AsyncSession
+    from sqlalchemy.orm import sessionmaker
+    from backend import crud, models, sync
+    from backend.retention import RetentionJob
+
+    alice = await crud.create_user(db_session, "alice@example.com", "x")
+    bob = await crud.create_user(db_session, "bob@example.com", "x")
+    short = await crud.create_group(db_session, "short", alice.id)
+    forever = await crud.create_group(db_session, "forever", alice.id)
+    await crud.set_group_retention(db_session, short, 7)
+    await crud.set_group_retention(db_session, forever, 0)
+    old_dm = await crud.create_message(db_session, sender_id=alice.id, receiver_id=bob.id, content="old dm")
+    await crud.record_receipts(db_session, bob.id, [old_dm.id])
+    week_old_group = await crud.create_message(db_session, sender_id=alice.id, group_id=short.id, content="a week")
+    old_forever = await crud.create_message(db_session, sender_id=alice.id, group_id=forever.id, content="keep")
+    recent_dm = await crud.create_message(db_session, sender_id=bob.id, receiver_id=alice.id, content="new dm")
+
+    now = datetime.now(timezone.utc)
+    for msg, age in [(old_dm, 40), (week_old_group, 8), (old_forever, 400), (recent_dm, 8)]:
+        await db_session.execute(update(models.Message).where(models.Message.id == msg.id).values(
+            created_at=now - timedelta(days=age)
+        ))
+    await db_session.execute(update(models.ChangeLog).values(created_at=now - timedelta(days=60)))
+    db_session.add_all([
+        models.OTP(email="a@x", code="1", expires_at=(now - timedelta(minutes=1)).replace(tzinfo=None)),
+        models.OTP(email="b@x", code="2", expires_at=(now + timedelta(minutes=5)).replace(tzinfo=None)),
+    ])
+    await db_session.commit()
+    cursor = await crud.get_latest_change_id(db_session)
+
+    session_factory = sessionmaker(bind=db_session.bind, class_=AsyncSession, expire_on_commit=False)
+    job = RetentionJob(session_factory, message_days=30, change_log_days=30, archive_mode="table", batch_size=1)
+    result = await job.run(now)
+    assert result == {"messages": 2, "change_log": cursor - 1, "otps": 1}
+
+    remaining = (await db_session.execute(select(models.Message.id).order_by(models.Message.id))).scalars().all()
+    archived = (await db_session.execute(select(models.MessageArchive.content).order_by(models.MessageArchive.id))).scalars().all()
+    assert remaining == [old_forever.id, recent_dm.id]
+    assert archived == ["old dm", "a week"]
+    # A pass overlapping on the same batch (no cross-process lock on SQLite) doesn't fail
+    rows = (await db_session.execute(select(models.MessageArchive.__table__))).mappings().all()
+    await crud.archive_messages(db_session, [{k: v for k, v in row.items() if k != "archived_at"} for row in rows])
+    await db_session.commit()
+    assert await db_session.scalar(select(func.count()).select_from(models.MessageReceipt)) == 0
+    # The short-lived group's last message is gone from the chat list, the DM shows the newest one left
+    snippets = lambda summaries: sorted(s.snippet for s in summaries)
+    assert snippets(await crud.get_conversation_summaries(db_session, alice.id)) == ["keep", "new dm"]
+    assert snippets(await crud.get_conversation_summaries(db_session, bob.id)) == ["new dm"]
+    # The newest change log entry stays so ids (sync cursors) never go backwards
+    assert await crud.get_oldest_change_id(db_session) == cursor
+    assert (await sync.get_delta(db_session, alice.id, 0))["reset"] is True
+    assert "reset" not in await sync.get_delta(db_session, alice.id, cursor)
+
+    file_job = RetentionJob(session_factory, message_days=1, change_log_days=0, archive_mode="file", archive_dir=tmp_path)
+    assert (await file_job.run(now))["messages"] == 1
+    [archive_file] = tmp_path.glob("messages-*.ndjson.gz")
+    with gzip.open(archive_file, "rt") as f:
+        records = [json.loads(line) for line in f]
+    assert records[0]["scope"] == "retention"
+    assert [r["row"]["content"] for r in records[1:]] == ["new dm"]
+    assert snippets(await crud.get_conversation_summaries(db_session, alice.id)) == ["keep"]
+    assert await crud.get_conversation_summaries(db_session, bob.id) == []
+
+@pytest.mark.asyncio
+async def test_migrations_build_the_schema_of_the_models(tmp_path):
+    from sqlalchemy import inspect
+    from sqlalchemy.ext.asyncio import create_async_engine
+    from backend import migrate
+    from backend.database import Base
+
+    def schema(sync_conn):
+        inspector = inspect(sync_conn)
+        return {
+            table: (
+                {c["name"] for c in inspector.get_columns(table)},
+                {ix["name"] for ix in inspector.get_indexes(table)},
+            )
+            for table in inspector.get_table_names()
+            if table != "schema_migrations" and not table.startswith("messages_fts")
+        }
+
+    migrated = create_async_engine(f"sqlite+aiosqlite:///{tmp_path / 'migrated.db'}")
+    await migrate.migrate(migrated)
+    from_models = create_async_engine(f"sqlite+aiosqlite:///{tmp_path / 'models.db'}")
+    async with from_models.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+
+    async with migrated.connect() as a, from_models.connect() as b:
+        assert await a.run_sync(schema) == await b.run_sync(schema)
+    await migrated.dispose()
+    await from_models.dispose()
@@ -0,0 +1,114 @@
+"""
+Typing indicator state
+
+Clients tend to send typing_start on every keystroke. The TypingManager
+keeps one state per (user, conversation) and forwards typing_start at
+most once per TYPING_INTERVAL_SECONDS; repeats in between only keep the
+state alive. A state that isn't refreshed within TYPING_TIMEOUT_SECONDS
+expires and a typing_stop is sent for it, so recipients never see a
+stuck indicator when a client drops without saying so.
+"""
+import asyncio
+import logging
+import os
+import time
+from typing import Awaitable, Callable, Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+TYPING_INTERVAL_SECONDS = float(os.getenv("TYPING_INTERVAL_SECONDS", "3"))
+TYPING_TIMEOUT_SECONDS = float(os.getenv("TYPING_TIMEOUT_SECONDS", "6"))
+
+class _TypingState:
+    __slots__ = ("receiver_id", "group_id", "last_sent", "timer")
+
+    def __init__(self, receiver_id: Optional[int], group_id: Optional[int]):
+        self.receiver_id = receiver_id
+        self.group_id = group_id
+        self.last_sent = 0.0
+        self.timer: Optional[asyncio.TimerHandle] = None
+
+class TypingManager:
+    """Debounces typing events per (user, conversation) and expires idle states"""
+
+    def __init__(
+        self,
+        notify: Optional[Callable[[str, int, Optional[int], Optional[int]], Awaitable[None]]] = None,
+        interval: float = TYPING_INTERVAL_SECONDS,
+        timeout: float = TYPING_TIMEOUT_SECONDS
+    ):
+        # notify(event, user_id, receiver_id, group_id), set up by chat_manager
+        self.notify = notify
+        self.interval = interval
+        self.timeout = timeout
+        self._states: Dict[Tuple[int, str], _TypingState] = {}
+        self.forwarded = 0
+        self.suppressed = 0
+
+    @staticmethod
+    def _key(user_id: int, receiver_id: Optional[int], group_id: Optional[int]) -> Tuple[int, str]:
+        return (user_id, f"g:{group_id}" if group_id is not None else f"u:{receiver_id}")
+
+    async def start(self, user_id: int, receiver_id: Optional[int] = None, group_id: Optional[int] = None) -> bool:
+        """Record a typing_start; returns True if it was forwarded"""
+        key = self._key(user_id, receiver_id, group_id)
+        state = self._states.get(key)
+        if state is None:
+            state = self._states[key] = _TypingState(receiver_id, group_id)
+
+        self._schedule_expiry(key, state)
+        now = time.monotonic()
+        if now - state.last_sent < self.interval:
+            self.suppressed += 1
+            return False
+        state.last_sent = now
+        await self._send("typing_start", user_id, state)
+        return True
+
+    async def stop(self, user_id: int, receiver_id: Optional[int] = None, group_id: Optional[int] = None) -> bool:
+        """Record a typing_stop; only forwarded if a start was"""
+        state = self._states.pop(self._key(user_id, receiver_id, group_id), None)
+        if state is None:
+            self.suppressed += 1
+            return False
+        state.timer.cancel()
+        await self._send("typing_stop", user_id, state)
+        return True
+
+    async def stop_all(self, user_id: int):
+        """Stop every conversation a user is typing in, e.g. when they go offline"""
+        for key in [key for key in self._states if key[0] == user_id]:
+            state = self._states.pop(key)
+            state.timer.cancel()
+            await self._send("typing_stop", user_id, state)
+
+    def _schedule_expiry(self, key: Tuple[int, str], state: _TypingState):
+        if state.timer is not None:
+            state.timer.cancel()
+        loop = asyncio.get_running_loop()
+        state.timer = loop.call_later(self.timeout, lambda: asyncio.create_task(self._expire(key, state)))
+
+    async def _expire(self, key: Tuple[int, str], state: _TypingState):
+        # A newer state for the same key replaces this one; leave it alone
+        if self._states.get(key) is not state:
+            return
+        del self._states[key]
+        await self._send("typing_stop", key[0], state)
+
+    async def _send(self, event: str, user_id: int, state: _TypingState):
+        self.forwarded += 1
+        if self.notify is None:
+            return
+        try:
+            await self.notify(event, user_id, state.receiver_id, state.group_id)
+        except Exception as e:
+            logger.error(f"Error sending {event}: {e}", exc_info=True)
+
+    def stats(self) -> dict:
+        return {
+            "active": len(self._states),
+            "forwarded": self.forwarded,
+            "suppressed": self.suppressed,
+        }
+
+typing_manager = TypingManager()
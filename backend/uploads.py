@@ -0,0 +1,219 @@
+"""
+Streaming and resumable file uploads
+
+Uploads are written to disk chunk by chunk with aiofiles, and the size
+limit is enforced as bytes arrive instead of after the whole file has
+been spooled. Finished files are handed to the content-addressed blob
+store, which keeps a single copy of identical files.
+
+Resumable uploads follow a three-step protocol:
+    POST /chat/uploads                  -> upload_id
+    PUT  /chat/uploads/{id}?offset=N    -> append a chunk at offset N
+    POST /chat/uploads/{id}/complete    -> move the file into place
+The partial file and a JSON sidecar live under uploads/.partial, so
+an interrupted client can ask for the current offset and carry on, even
+after a server restart.
+"""
+import asyncio
+import json
+import os
+import time
+import uuid
+from pathlib import Path
+from typing import AsyncIterator, Dict, Optional
+
+import aiofiles
+import aiofiles.os
+from fastapi import UploadFile
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from . import blobstore, media
+
+PARTIAL_DIR = blobstore.UPLOAD_ROOT / ".partial"
+PARTIAL_DIR.mkdir(parents=True, exist_ok=True)
+
+MAX_UPLOAD_SIZE = int(os.getenv("MAX_UPLOAD_SIZE", str(100 * 1024 * 1024)))  # 100MB
+UPLOAD_CHUNK_SIZE = 1024 * 1024  # read/write granularity, and suggested client chunk size
+UPLOAD_SESSION_TTL = int(os.getenv("UPLOAD_SESSION_TTL", str(24 * 3600)))
+
+# upload_id -> lock, so chunks of one upload are written one request at a time
+_append_locks: Dict[str, asyncio.Lock] = {}
+
+class UploadTooLarge(Exception):
+    pass
+
+class UploadOffsetMismatch(Exception):
+    def __init__(self, expected: int):
+        super().__init__(f"Expected offset {expected}")
+        self.expected = expected
+
+def file_extension(filename: Optional[str], default: str = ".bin") -> str:
+    return Path(filename).suffix.lower() if filename and Path(filename).suffix else default
+
+async def iter_upload_file(file: UploadFile) -> AsyncIterator[bytes]:
+    """Read a multipart UploadFile in chunks"""
+    while True:
+        chunk = await file.read(UPLOAD_CHUNK_SIZE)
+        if not chunk:
+            break
+        yield chunk
+
+async def write_stream(
+    chunks: AsyncIterator[bytes],
+    path: Path,
+    max_size: int,
+    append: bool = False,
+    start: int = 0,
+    hasher=None
+) -> int:
+    """Write chunks to path, failing with UploadTooLarge once start + written exceeds max_size.
+
+    With append, the existing file is written from byte `start` on. Feeds
+    each chunk to `hasher` if given. Returns the total size of the file afterwards.
+    """
+    size = start
+    async with aiofiles.open(path, "r+b" if append else "wb") as out:
+        if append:
+            # Positioned, not O_APPEND: a duplicate chunk from another worker overwrites instead of growing the file
+            await out.seek(start)
+        async for chunk in chunks:
+            size += len(chunk)
+            if size > max_size:
+                raise UploadTooLarge()
+            if hasher is not None:
+                hasher.update(chunk)
+            await out.write(chunk)
+    return size
+
+async def save_stream(
+    db: AsyncSession,
+    chunks: AsyncIterator[bytes],
+    filename: Optional[str],
+    content_type: Optional[str],
+    max_size: int = MAX_UPLOAD_SIZE
+) -> dict:
+    """Stream bytes into the blob store, hashing them on the way"""
+    temp_path = PARTIAL_DIR / f"{uuid.uuid4().hex}.tmp"
+    hasher = blobstore.new_hasher()
+    try:
+        size = await write_stream(chunks, temp_path, max_size, hasher=hasher)
+        url = await blobstore.store(
+            db, temp_path, hasher.hexdigest(), size, file_extension(filename), content_type
+        )
+    except BaseException:
+        await _remove_quietly(temp_path)
+        raise
+    return _stored_response(url, filename, content_type, size)
+
+def _stored_response(url: str, filename: Optional[str], content_type: Optional[str], size: int) -> dict:
+    # Images get thumbnails rendered in the background
+    media.schedule_variants(url)
+    return {
+        "url": url,
+        "filename": filename,
+        "type": content_type,
+        "size": size,
+        **media.image_variant_urls(url)
+    }
+
+async def save_upload(db: AsyncSession, file: UploadFile, max_size: int = MAX_UPLOAD_SIZE) -> dict:
+    """Stream a multipart upload into the blob store"""
+    return await save_stream(db, iter_upload_file(file), file.filename, file.content_type, max_size)
+
+# --- Resumable sessions ---
+def _session_path(upload_id: str) -> Path:
+    return PARTIAL_DIR / f"{upload_id}.json"
+
+def _partial_path(upload_id: str) -> Path:
+    return PARTIAL_DIR / f"{upload_id}.part"
+
+async def _remove_quietly(path: Path):
+    try:
+        await aiofiles.os.remove(path)
+    except FileNotFoundError:
+        pass
+
+async def create_session(user_id: int, filename: str, size: int, content_type: Optional[str]) -> dict:
+    """Start a resumable upload of `size` bytes"""
+    if size > MAX_UPLOAD_SIZE:
+        raise UploadTooLarge()
+    session = {
+        "upload_id": uuid.uuid4().hex,
+        "user_id": user_id,
+        "filename": filename,
+        "content_type": content_type,
+        "size": size,
+        "created_at": time.time(),
+    }
+    async with aiofiles.open(_session_path(session["upload_id"]), "w") as f:
+        await f.write(json.dumps(session))
+    async with aiofiles.open(_partial_path(session["upload_id"]), "wb"):
+        pass
+    session["offset"] = 0
+    return session
+
+async def get_session(upload_id: str, user_id: int) -> Optional[dict]:
+    """Load an upload session owned by user_id, with its current offset"""
+    if not upload_id.isalnum():
+        return None
+    try:
+        async with aiofiles.open(_session_path(upload_id)) as f:
+            session = json.loads(await f.read())
+        stat = await aiofiles.os.stat(_partial_path(upload_id))
+    except FileNotFoundError:
+        return None
+    if session["user_id"] != user_id:
+        return None
+    session["offset"] = stat.st_size
+    return session
+
+async def append_chunk(session: dict, offset: int, chunks: AsyncIterator[bytes]) -> int:
+    """Append a chunk written at `offset`; returns the new offset.
+
+    The offset is checked against the file again under a per-upload lock,
+    so a retried chunk racing its original gets UploadOffsetMismatch
+    instead of being appended twice.
+    """
+    upload_id = session["upload_id"]
+    path = _partial_path(upload_id)
+    async with _append_locks.setdefault(upload_id, asyncio.Lock()):
+        current = (await aiofiles.os.stat(path)).st_size
+        if offset != current:
+            raise UploadOffsetMismatch(current)
+        try:
+            return await write_stream(chunks, path, session["size"], append=True, start=offset)
+        except UploadTooLarge:
+            # Drop the oversized chunk; anything received before a dropped
+            # connection is kept so the client can resume from there
+            async with aiofiles.open(path, "r+b") as f:
+                await f.truncate(offset)
+            raise
+
+async def complete_session(db: AsyncSession, session: dict) -> dict:
+    """Move a fully uploaded file into the blob store"""
+    if session["offset"] != session["size"]:
+        raise UploadOffsetMismatch(session["offset"])
+    # Chunks arrived over several requests, so hash the assembled file once here
+    part_path = _partial_path(session["upload_id"])
+    url = await blobstore.store(
+        db,
+        part_path,
+        await blobstore.hash_file(part_path),
+        session["size"],
+        file_extension(session["filename"]),
+        session["content_type"]
+    )
+    await _remove_quietly(_session_path(session["upload_id"]))
+    _append_locks.pop(session["upload_id"], None)
+    return _stored_response(url, session["filename"], session["content_type"], session["size"])
+
+async def purge_stale_sessions(max_age: int = UPLOAD_SESSION_TTL) -> int:
+    """Delete upload sessions nobody finished within max_age seconds"""
+    cutoff = time.time() - max_age
+    removed = 0
+    for entry in await aiofiles.os.scandir(PARTIAL_DIR):
+        if entry.stat().st_mtime < cutoff:
+            await _remove_quietly(Path(entry.path))
+            _append_locks.pop(Path(entry.name).stem, None)
+            removed += 1
+    return removed
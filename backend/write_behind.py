@@ -0,0 +1,119 @@
+"""
+Write-behind batching for message inserts
+
+With MESSAGE_WRITE_BEHIND=1 the send path hands messages to a queue
+instead of committing each one. A single flusher task inserts whatever
+has queued up, every MESSAGE_WRITE_BEHIND_BATCH_SIZE messages or
+MESSAGE_WRITE_BEHIND_FLUSH_MS milliseconds, in one INSERT ... RETURNING.
+Callers await the flush, so ids exist and the rows are durable before
+anything is emitted.
+"""
+import asyncio
+import logging
+import os
+from typing import List, Optional, Tuple
+
+from . import crud, database
+
+logger = logging.getLogger(__name__)
+
+WRITE_BEHIND_ENABLED = os.getenv("MESSAGE_WRITE_BEHIND", "0") == "1"
+WRITE_BEHIND_BATCH_SIZE = int(os.getenv("MESSAGE_WRITE_BEHIND_BATCH_SIZE", "100"))
+WRITE_BEHIND_FLUSH_MS = int(os.getenv("MESSAGE_WRITE_BEHIND_FLUSH_MS", "20"))
+
+class MessageWriteBuffer:
+    """Queue of pending message inserts drained by one flusher task"""
+
+    def __init__(
+        self,
+        session_factory=None,
+        batch_size: int = WRITE_BEHIND_BATCH_SIZE,
+        flush_ms: int = WRITE_BEHIND_FLUSH_MS
+    ):
+        self.session_factory = session_factory
+        self.batch_size = batch_size
+        self.flush_interval = flush_ms / 1000
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+        self.flushes = 0
+        self.flushed_messages = 0
+
+    def _ensure_started(self):
+        if self._task is None or self._task.done():
+            self._queue = self._queue or asyncio.Queue()
+            self._task = asyncio.create_task(self._run())
+
+    async def submit(self, **values):
+        """Queue a message (crud.message_values arguments) and wait until it is stored"""
+        self._ensure_started()
+        future = asyncio.get_running_loop().create_future()
+        self._queue.put_nowait((crud.message_values(**values), future))
+        return await future
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            item = await self._queue.get()
+            if item is None:
+                return
+            batch = [item]
+            stopping = False
+            deadline = loop.time() + self.flush_interval
+            while len(batch) < self.batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(self._queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                if item is None:
+                    stopping = True
+                    break
+                batch.append(item)
+            await self._flush(batch)
+            if stopping:
+                return
+
+    async def _flush(self, batch: List[Tuple[dict, asyncio.Future]]):
+        session_factory = self.session_factory or database.SessionLocal
+        try:
+            async with session_factory() as db:
+                messages = await crud.create_messages(db, [values for values, _ in batch])
+        except Exception as e:
+            if len(batch) == 1:
+                logger.error(f"Write-behind insert failed: {e}", exc_info=True)
+                if not batch[0][1].done():
+                    batch[0][1].set_exception(e)
+                return
+            # One bad row (e.g. an unknown receiver) rolls back the whole batch;
+            # retry one by one so only its sender sees the error
+            logger.warning(f"Write-behind flush of {len(batch)} messages failed, retrying singly: {e}")
+            for item in batch:
+                await self._flush([item])
+            return
+
+        self.flushes += 1
+        self.flushed_messages += len(messages)
+        for (_, future), message in zip(batch, messages):
+            if not future.done():
+                future.set_result(message)
+
+    async def close(self):
+        """Flush anything still queued and stop the flusher"""
+        if self._task is None or self._task.done():
+            return
+        # The sentinel queues behind pending messages, so they are flushed first
+        self._queue.put_nowait(None)
+        await self._task
+        self._task = None
+
+    def stats(self) -> dict:
+        return {
+            "enabled": WRITE_BEHIND_ENABLED,
+            "queued": self._queue.qsize() if self._queue else 0,
+            "flushes": self.flushes,
+            "flushed_messages": self.flushed_messages,
+        }
+
+message_write_buffer = MessageWriteBuffer()
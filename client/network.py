@@ -65,6 +65,8 @@ class NetworkManager(QObject):
             async with self.session.ws_connect(url) as ws:
                 self.ws = ws
                 self.is_connected = True
+                # Catch up on anything missed while disconnected
+                asyncio.create_task(self.sync())
                 async for msg in ws:
                     if msg.type == aiohttp.WSMsgType.TEXT:
                         data = json.loads(msg.data)
@@ -75,6 +77,21 @@ class NetworkManager(QObject):
             print(f"WS Connect Error: {e}")
             self.is_connected = False
 
+    async def sync(self):
+        headers = {"Authorization": f"Bearer {self.state.token}"}
+        while True:
+            params = {} if self.state.sync_cursor is None else {"since": self.state.sync_cursor}
+            async with self.session.get(f"{self.state.api_url}/chat/sync", params=params, headers=headers) as resp:
+                if resp.status != 200:
+                    return
+                data = await resp.json()
+            for change in data["changes"]:
+                if change["kind"] == "message" and change["message"]:
+                    self.message_received.emit({"type": "new_message", **change["message"]})
+            self.state.sync_cursor = data["cursor"]
+            if not data["has_more"]:
+                return
+
     async def fetch_contacts(self):
         headers = {"Authorization": f"Bearer {self.state.token}"}
         async with self.session.get(f"{self.state.api_url}/chat/contacts", headers=headers) as resp:
@@ -7,6 +7,7 @@ class AppState:
             cls._instance.token = None
             cls._instance.user_id = None
             cls._instance.email = None
+            cls._instance.sync_cursor = None  # last change seen, see /chat/sync
             cls._instance.api_url = "http://localhost:8000"
             cls._instance.ws_url = "ws://localhost:8000"
         return cls._instance
@@ -31,6 +31,10 @@ fi
 echo "Checking/Installing dependencies..."
 ./venv/bin/pip install -r requirements.txt
 
+# Workers don't create tables; bring the database schema up to date first
+echo "📊 Running database migrations..."
+./venv/bin/python backend/migrate.py || exit 1
+
 # Run backend in background using venv uvicorn
 ./venv/bin/uvicorn backend.main:socket_app --reload --host 0.0.0.0 --port 8000 &
 BACKEND_PID=$!
@@ -18,7 +18,7 @@ import api from "@/lib/api"
 import { useChatStore, Contact, useAuthStore } from "@/lib/store"
 
 export function ChatSidebar({ className }: { className?: string }) {
-    const { contacts, setContacts, setActiveChat, activeId, activeType } = useChatStore()
+    const { contacts, setContacts, setActiveChat, activeId, activeType, syncEpoch } = useChatStore()
     const { user } = useAuthStore()
     const router = useRouter()
     const [searchTerm, setSearchTerm] = React.useState("")
@@ -34,17 +34,33 @@ export function ChatSidebar({ className }: { className?: string }) {
         return () => clearInterval(interval)
     }, [])
 
+    // Missed changes couldn't be replayed; reload the chat list
+    React.useEffect(() => {
+        if (syncEpoch > 0) fetchContacts()
+    }, [syncEpoch])
+
     const fetchContacts = async () => {
         try {
-            const res = await api.get("/chat/contacts")
+            const [res, conversationsRes] = await Promise.all([
+                api.get("/chat/contacts"),
+                api.get("/chat/conversations"),
+            ])
+            // Last message preview and unread count per 1:1 chat
+            const summaries = new Map<number, any>(
+                conversationsRes.data
+                    .filter((s: any) => s.peer_user_id !== null)
+                    .map((s: any) => [s.peer_user_id, s])
+            )
             // backend returns list of user objects with profile info
             const mapped: Contact[] = res.data.map((c: any) => ({
                 id: c.id,
                 email: c.email,
                 name: c.display_name || c.email.split('@')[0], // Use display_name if available
                 status: 'offline', // default
-                profile_photo_url: c.profile_photo_url,
-                about: c.about
+                profile_photo_url: c.profile_thumbnail_url || c.profile_photo_url, // Small variant for the list
+                about: c.about,
+                last_message: summaries.get(c.id)?.snippet,
+                unread_count: summaries.get(c.id)?.unread_count ?? 0
             }));
             setContacts(mapped)
         } catch (error) {
@@ -138,15 +154,14 @@ export function ChatSidebar({ className }: { className?: string }) {
                                         )}>
                                             {contact.name || contact.email}
                                         </span>
-                                        {/* Mock unread badge for UI demo match */}
-                                        {contact.id === 1 && (
+                                        {!!contact.unread_count && (
                                             <span className="flex h-5 w-5 items-center justify-center rounded-full bg-primary text-[10px] font-medium text-white shadow-sm shadow-primary/30">
-                                                2
+                                                {contact.unread_count}
                                             </span>
                                         )}
                                     </div>
                                     <span className="text-xs text-muted-foreground truncate block max-w-[140px]">
-                                        Start a conversation...
+                                        {contact.last_message || "Start a conversation..."}
                                     </span>
                                 </div>
                             </div>
@@ -16,7 +16,7 @@ import { FileMessage } from "@/components/chat/file-message"
 import { VoiceRecorder } from "@/components/chat/voice-recorder"
 
 export function ChatWindow({ className }: { className?: string }) {
-    const { activeId, activeType, messages, setMessages, contacts, setActiveChat, connectionStatus } = useChatStore()
+    const { activeId, activeType, messages, setMessages, contacts, setContacts, setActiveChat, connectionStatus, syncEpoch } = useChatStore()
     const { user } = useAuthStore()
     const [inputText, setInputText] = React.useState("")
     const scrollRef = React.useRef<HTMLDivElement>(null)
@@ -29,7 +29,7 @@ export function ChatWindow({ className }: { className?: string }) {
         if (activeId && activeType) {
             fetchHistory(activeId, activeType);
         }
-    }, [activeId, activeType])
+    }, [activeId, activeType, syncEpoch])
 
     React.useEffect(() => {
         if (scrollRef.current) {
@@ -57,11 +57,25 @@ export function ChatWindow({ className }: { className?: string }) {
             if (chatKey) {
                 setMessages(chatKey, mapped);
             }
+            markChatRead(id, type, mapped);
         } catch (e) {
             console.error("Failed to fetch history", e);
         }
     }
 
+    // Opening a chat reads everything in it: one event for the whole range
+    const markChatRead = (id: number, type: 'contact' | 'group', loaded: Message[]) => {
+        const lastIncoming = [...loaded].reverse().find(m => m.sender_id !== user?.id);
+        if (!lastIncoming) return;
+
+        if (type === 'group') {
+            socketService.sendMessagesReadUpto(lastIncoming.id, undefined, id);
+        } else {
+            socketService.sendMessagesReadUpto(lastIncoming.id, id);
+            setContacts(useChatStore.getState().contacts.map(c => c.id === id ? { ...c, unread_count: 0 } : c));
+        }
+    }
+
     const handleSendMessage = () => {
         if (!inputText.trim() || !activeId) return;
 
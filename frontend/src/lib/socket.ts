@@ -1,6 +1,11 @@
 import { io, Socket } from 'socket.io-client';
 import { useChatStore, getChatKey, Message } from './store';
 
+// Per user, so another account signing in on this browser starts from its own cursor
+const syncCursorKey = (userId: number) => `echat-sync-cursor:${userId}`;
+// Delivery acks are batched over this window
+const ACK_FLUSH_MS = 250;
+
 class SocketService {
     private socket: Socket | null = null;
     private token: string | null = null;
@@ -8,6 +13,11 @@ class SocketService {
     private maxReconnectAttempts = 5;
     private reconnectDelay = 1000;
     private connectionStatusCallback: ((status: 'connected' | 'disconnected' | 'reconnecting') => void) | null = null;
+    // Id of the last change seen, used to catch up after a reconnect
+    private syncCursor: number | null = null;
+    private syncUserId: number | null = null;
+    private pendingAcks: number[] = [];
+    private ackTimer: ReturnType<typeof setTimeout> | null = null;
 
     /**
      * Connect to Socket.IO server
@@ -54,6 +64,23 @@ class SocketService {
         this.socket.on('connected', (data) => {
             console.log('Server confirmed connection:', data);
             useChatStore.getState().setConnectionStatus('connected');
+
+            if (data.user_id !== this.syncUserId) {
+                this.syncUserId = data.user_id;
+                this.syncCursor = null;
+            }
+            const cursor = this.loadSyncCursor();
+            if (cursor === null) {
+                this.saveSyncCursor(data.sync_cursor);
+            } else {
+                // Catch up on anything missed while offline
+                this.socket?.emit('resume', { since: cursor });
+            }
+        });
+
+        this.socket.on('sync', (data) => {
+            console.log(`🔄 Sync: ${data.changes.length} changes`);
+            this.handleSync(data);
         });
 
         this.socket.on('disconnect', (reason) => {
@@ -112,6 +139,15 @@ class SocketService {
             this.handleMessageRead(data);
         });
 
+        this.socket.on('message_receipts', (data) => {
+            this.handleMessageReceipts(data);
+        });
+
+        this.socket.on('messages_read_upto', (data) => {
+            console.log(`✓✓ ${data.message_ids.length} messages read:`, data);
+            this.handleMessagesReadUpto(data);
+        });
+
         // Profile updates
         this.socket.on('contact_profile_updated', (data) => {
             console.log('👤 Contact profile updated:', data);
@@ -156,6 +192,89 @@ class SocketService {
         };
 
         useChatStore.getState().addMessage(key, message);
+
+        if (data.sender_id !== currentUserId) {
+            this.queueDeliveryAck(data.id);
+
+            // Arriving in the open chat means it is read right away
+            const { activeId, activeType } = useChatStore.getState();
+            if (activeId && activeType && getChatKey(activeId, activeType) === key) {
+                if (data.group_id) {
+                    this.sendMessagesReadUpto(data.id, undefined, data.group_id);
+                } else {
+                    this.sendMessagesReadUpto(data.id, data.sender_id);
+                }
+            }
+        }
+    }
+
+    /**
+     * Ack received messages in batches instead of one event per message
+     */
+    private queueDeliveryAck(message_id: number) {
+        this.pendingAcks.push(message_id);
+        if (this.ackTimer) return;
+
+        this.ackTimer = setTimeout(() => {
+            this.ackTimer = null;
+            const message_ids = this.pendingAcks;
+            this.pendingAcks = [];
+            this.socket?.emit('messages_ack', { message_ids, status: 'delivered' });
+        }, ACK_FLUSH_MS);
+    }
+
+    /**
+     * Handle delivered/read counts for messages we sent
+     */
+    private handleMessageReceipts(data: any) {
+        for (const receipt of data.receipts) {
+            if (receipt.read > 0) {
+                useChatStore.getState().updateMessageStatus(receipt.message_id, 'read');
+            } else if (receipt.delivered > 0) {
+                useChatStore.getState().updateMessageStatus(receipt.message_id, 'delivered');
+            }
+        }
+    }
+
+    /**
+     * Apply a page of missed changes and ask for the next one
+     */
+    private handleSync(data: any) {
+        if (data.reset) {
+            // Changes since our cursor were pruned on the server; reload chat list and history over REST
+            console.warn('Sync cursor expired, reloading conversations');
+            useChatStore.getState().resetAfterSyncGap();
+        }
+        for (const change of data.changes) {
+            if (change.kind === 'message' && change.message) {
+                this.handleNewMessage(change.message);
+            } else if (change.kind === 'status' && change.payload?.upto) {
+                // One entry stands for every message of ours up to message_id
+                useChatStore.getState().markReadUpto(change.message_id);
+            } else if (change.kind === 'status' && change.payload?.status) {
+                useChatStore.getState().updateMessageStatus(change.message_id, change.payload.status);
+            }
+        }
+
+        this.saveSyncCursor(data.cursor);
+        if (data.has_more) {
+            this.socket?.emit('resume', { since: data.cursor });
+        }
+    }
+
+    private loadSyncCursor(): number | null {
+        if (this.syncCursor === null && this.syncUserId !== null) {
+            const stored = localStorage.getItem(syncCursorKey(this.syncUserId));
+            this.syncCursor = stored ? Number(stored) : null;
+        }
+        return this.syncCursor;
+    }
+
+    private saveSyncCursor(cursor: number) {
+        this.syncCursor = cursor;
+        if (this.syncUserId !== null) {
+            localStorage.setItem(syncCursorKey(this.syncUserId), String(cursor));
+        }
     }
 
     /**
@@ -204,6 +323,16 @@ class SocketService {
         useChatStore.getState().updateMessageStatus(message_id, 'read');
     }
 
+    /**
+     * Handle an aggregated read receipt for a range of messages
+     */
+    private handleMessagesReadUpto(data: any) {
+        const { message_ids } = data;
+        for (const message_id of message_ids) {
+            useChatStore.getState().updateMessageStatus(message_id, 'read');
+        }
+    }
+
     /**
      * Send a message
      */
@@ -250,6 +379,15 @@ class SocketService {
         this.socket.emit('message_read', { message_id });
     }
 
+    /**
+     * Mark a whole conversation as read up to a message, in one event
+     */
+    sendMessagesReadUpto(upto_id: number, contact_id?: number, group_id?: number) {
+        if (!this.socket?.connected) return;
+
+        this.socket.emit('messages_read_upto', { upto_id, contact_id, group_id });
+    }
+
     /**
      * Disconnect from server
      */
@@ -19,6 +19,8 @@ export interface Contact {
     status?: string; // 'online' | 'offline'
     profile_photo_url?: string;
     about?: string;
+    last_message?: string;
+    unread_count?: number;
 }
 
 export interface Group {
@@ -95,6 +97,7 @@ interface ChatState {
     connectionStatus: 'connected' | 'disconnected' | 'reconnecting';
     typingUsers: Record<string, Set<number>>; // Key: chat key, Value: set of user IDs typing
     userStatuses: Record<number, 'online' | 'offline'>; // Key: user ID, Value: status
+    syncEpoch: number; // Bumped when local state can't be caught up and must be refetched
 
     setContacts: (contacts: Contact[]) => void;
     setGroups: (groups: Group[]) => void;
@@ -105,6 +108,8 @@ interface ChatState {
     setTyping: (key: string, userId: number, isTyping: boolean) => void;
     updateUserStatus: (userId: number, status: 'online' | 'offline') => void;
     updateMessageStatus: (messageId: number, status: string) => void;
+    markReadUpto: (messageId: number) => void;
+    resetAfterSyncGap: () => void;
 }
 
 // Helper to generate key
@@ -119,6 +124,7 @@ export const useChatStore = create<ChatState>((set) => ({
     connectionStatus: 'disconnected',
     typingUsers: {},
     userStatuses: {},
+    syncEpoch: 0,
 
     setContacts: (contacts) => set({ contacts }),
     setGroups: (groups) => set({ groups }),
@@ -186,5 +192,30 @@ export const useChatStore = create<ChatState>((set) => ({
 
             return { messages };
         }),
+
+    // Everything we sent up to messageId, in the chat holding it, has been read
+    markReadUpto: (messageId) =>
+        set((state) => {
+            for (const key in state.messages) {
+                const chatMessages = state.messages[key];
+                if (!chatMessages.some(m => m.id === messageId)) continue;
+
+                return {
+                    messages: {
+                        ...state.messages,
+                        [key]: chatMessages.map(m =>
+                            m.sender === 'me' && m.id <= messageId && m.status !== 'read'
+                                ? { ...m, status: 'read' }
+                                : m
+                        )
+                    }
+                };
+            }
+            return state;
+        }),
+
+    // Drop loaded history; the chat list and open chat refetch when syncEpoch changes
+    resetAfterSyncGap: () =>
+        set((state) => ({ messages: {}, syncEpoch: state.syncEpoch + 1 })),
 }));
 
@@ -1,4 +1,6 @@
 #!/bin/bash
 source venv/bin/activate
+echo "📊 Running database migrations..."
+python backend/migrate.py || exit 1
 echo "Starting Server on http://0.0.0.0:8000"
 uvicorn backend.main:app --reload --host 0.0.0.0 --port 8000